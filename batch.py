@@ -0,0 +1,92 @@
+from psycopg2 import sql
+
+from queries import key_in_condition
+
+
+BATCH_SIZE = 1000  # строк за одну транзакцию
+
+
+def keys_condition(key_columns, keys):
+    """Условие отбора строк по списку ключей: пара (условие, параметры).
+
+    Для простого ключа - pk = ANY(%s) с одним параметром-массивом,
+    для составного - (a, b) IN (...).
+    """
+    if len(key_columns) == 1:
+        return (sql.SQL("{} = ANY(%s)").format(sql.Identifier(key_columns[0])),
+                [[key[0] for key in keys]])
+    return key_in_condition(key_columns, keys)
+
+
+def count_rows(conn, table, condition=None, params=()):
+    """Число строк таблицы, подходящих под условие (для подтверждения)"""
+    query = sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(table))
+    if condition is not None:
+        query += sql.SQL(" WHERE {}").format(condition)
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    count = cursor.fetchone()[0]
+    conn.rollback()
+    return count
+
+
+def batch_delete(conn, table, key_columns, keys=None, condition=None, params=(),
+                 batch_size=BATCH_SIZE, progress=None):
+    """Удаление строк по списку ключей keys или по условию condition.
+
+    Строки удаляются порциями по batch_size, каждая порция - отдельной
+    транзакцией, чтобы блокировки не держались долго. При отборе по
+    условию ключи подходящих строк запоминаются до начала удаления.
+    progress(удалено, всего) вызывается после каждой порции. Возвращает
+    число удаленных строк.
+    """
+    def statement(where):
+        return sql.SQL("DELETE FROM {} WHERE {}").format(sql.Identifier(table), where)
+
+    return _run_batches(conn, table, key_columns, statement, [], keys, condition, params,
+                        batch_size, progress)
+
+
+def batch_update(conn, table, key_columns, column, value, keys=None, condition=None, params=(),
+                 batch_size=BATCH_SIZE, progress=None):
+    """Запись value в столбец column строк по списку ключей или по условию.
+
+    Порции - как в batch_delete. При отборе по условию строки, где
+    значение уже равно value, пропускаются. Возвращает число измененных
+    строк.
+    """
+    def statement(where):
+        return sql.SQL("UPDATE {} SET {} = %s WHERE {}").format(
+            sql.Identifier(table), sql.Identifier(column), where)
+
+    if condition is not None:
+        condition = sql.SQL("({}) AND {} IS DISTINCT FROM %s").format(
+            condition, sql.Identifier(column))
+        params = list(params) + [value]
+    return _run_batches(conn, table, key_columns, statement, [value],
+                        keys, condition, params, batch_size, progress)
+
+
+def _run_batches(conn, table, key_columns, statement, statement_params, keys, condition,
+                 params, batch_size, progress):
+    cursor = conn.cursor()
+    if keys is None:
+        # Ключи подходящих строк читаются одним запросом: повторный отбор
+        # по условию для каждой порции просматривал бы таблицу заново
+        columns = sql.SQL(", ").join(map(sql.Identifier, key_columns))
+        query = sql.SQL("SELECT {} FROM {}").format(columns, sql.Identifier(table))
+        if condition is not None:
+            query += sql.SQL(" WHERE {}").format(condition)
+        cursor.execute(query, params)
+        keys = cursor.fetchall()
+        conn.rollback()
+
+    done = 0
+    for start in range(0, len(keys), batch_size):
+        where, where_params = keys_condition(key_columns, keys[start:start + batch_size])
+        cursor.execute(statement(where), statement_params + list(where_params))
+        done += cursor.rowcount
+        conn.commit()
+        if progress is not None:
+            progress(done, len(keys))
+    return done
@@ -0,0 +1,378 @@
+import os
+import random
+import subprocess
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from math import ceil
+
+from psycopg2 import sql
+
+from filters import CONTAINS, Condition, condition_sql
+from partitions import partitioning_installed
+from queries import browse_query, key_condition
+from repairs import RepairOrder, save_orders
+from reports import REPORTS, report_params, report_query, rollups_installed
+from schema import TABLES
+from search import prepare_search, search_condition
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+CHUNK_SIZE = 500     # первая порция строк, как у QueryTableModel
+HISTORY_DAYS = 3 * 365
+
+SURNAMES = ("Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Васильев",
+            "Соколов", "Михайлов", "Новиков", "Федоров", "Морозов", "Волков", "Алексеев",
+            "Лебедев", "Семенов", "Егоров", "Павлов", "Козлов", "Степанов")
+FAULTS = ("Замена масла", "Замена тормозных колодок", "Ремонт подвески", "Диагностика двигателя",
+          "Замена ремня ГРМ", "Ремонт коробки передач", "Замена сцепления", "Развал-схождение",
+          "Ремонт электрики", "Замена аккумулятора")
+PARTS = ("Фильтр масляный", "Фильтр воздушный", "Колодки тормозные", "Диск тормозной",
+         "Ремень ГРМ", "Ролик натяжной", "Амортизатор", "Сайлентблок", "Свеча зажигания",
+         "Аккумулятор", "Лампа", "Масло моторное", "Антифриз", "Подшипник ступицы")
+
+
+class BenchError(Exception):
+    """Ошибка подготовки данных для замеров"""
+
+
+# --- Генерация данных ---
+
+class _CopyStream:
+    """Файл для COPY FROM: строки в формате text формируются по мере чтения"""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = ""
+        self.count = 0
+
+    def read(self, size=-1):
+        lines = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            line = "\t".join("\\N" if value is None else str(value) for value in row) + "\n"
+            lines.append(line)
+            length += len(line)
+            self.count += 1
+        data = "".join(lines)
+        if size < 0:
+            size = len(data)
+        self.buffer = data[size:]
+        return data[:size]
+
+
+def _copy(cursor, table, columns, rows):
+    stream = _CopyStream(rows)
+    cursor.copy_expert(sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(table), sql.SQL(", ").join(map(sql.Identifier, columns))
+    ).as_string(cursor.connection), stream)
+    return stream.count
+
+
+def _zipf_weights(count, s=1.1):
+    """Накопленные веса распределения Ципфа: первые значения встречаются чаще"""
+    total = 0
+    weights = []
+    for rank in range(1, count + 1):
+        total += 1 / rank ** s
+        weights.append(total)
+    return weights
+
+
+def _repairs(seed, cars, faults, teams, today):
+    """Ремонты: (repair_id, car_id, fault_id, admission_date, completion_date, team_id).
+
+    Число ремонтов на машину распределено по Парето - у немногих машин
+    их десятки. Последовательность зависит только от seed.
+    """
+    rng = random.Random(seed)
+    fault_weights = _zipf_weights(faults)
+    repair_id = 0
+    for car_id in range(1, cars + 1):
+        for _ in range(min(int(rng.paretovariate(1.2)), 60)):
+            repair_id += 1
+            admission = today - timedelta(days=rng.randrange(HISTORY_DAYS))
+            completion = admission + timedelta(days=rng.randrange(15))
+            if completion > today:
+                completion = None
+            fault_id = rng.choices(range(1, faults + 1), cum_weights=fault_weights)[0]
+            team_id = rng.randint(1, teams) if rng.random() < 0.9 else None
+            yield repair_id, car_id, fault_id, admission, completion, team_id
+
+
+def _parts(seed, repairs, link_parts):
+    """Запчасти ремонтов; число на ремонт распределено экспоненциально"""
+    rng = random.Random(seed)
+    part_weights = _zipf_weights(len(PARTS))
+    for repair_id, car_id, fault_id, *_ in repairs:
+        for _ in range(min(int(rng.expovariate(1 / 4)), 50)):
+            name = rng.choices(PARTS, cum_weights=part_weights)[0]
+            row = (car_id, fault_id, name, f"{rng.uniform(100, 30000):.2f}", rng.randint(1, 4))
+            yield (repair_id,) + row if link_parts else row
+
+
+def generate(conn, cars=10000, seed=1, truncate=False, on_table=None):
+    """Заполнение всех таблиц синтетическими данными (воспроизводимо по seed).
+
+    cars - число машин, от него зависят размеры остальных таблиц.
+    Непустые таблицы очищаются только при truncate. Пользовательские
+    триггеры на время загрузки отключаются, агрегаты отчетов
+    пересчитываются в конце. on_table(таблица, строк) вызывается после
+    загрузки каждой таблицы. Возвращает {таблица: число строк}.
+    """
+    cursor = conn.cursor()
+    cursor.execute(sql.SQL("SELECT {}").format(sql.SQL(" OR ").join(
+        sql.SQL("EXISTS (SELECT 1 FROM {})").format(sql.Identifier(t)) for t in TABLES)))
+    if cursor.fetchone()[0]:
+        if not truncate:
+            conn.rollback()
+            raise BenchError("В БД уже есть данные (укажите --truncate, чтобы удалить их)")
+        cursor.execute(sql.SQL("TRUNCATE {} RESTART IDENTITY CASCADE").format(
+            sql.SQL(", ").join(map(sql.Identifier, TABLES))))
+
+    rng = random.Random(seed)
+    today = date.today()
+    workshops = max(3, cars // 2000)
+    teams = max(5, cars // 200)
+    faults = 50
+    counts = {}
+
+    def load(table, columns, rows):
+        counts[table] = _copy(cursor, table, columns, rows)
+        if on_table is not None:
+            on_table(table, counts[table])
+
+    cursor.execute("SELECT 1 FROM pg_attribute WHERE attrelid = 'spare_parts'::regclass"
+                   " AND attname = 'repair_id' AND NOT attisdropped")
+    link_parts = cursor.fetchone() is not None
+    if partitioning_installed(conn):
+        cursor.execute("""
+            SELECT car_repair_create_partition(day::date)
+            FROM generate_series(%s::date, %s::date, INTERVAL '1 month') AS day
+        """, (today - timedelta(days=HISTORY_DAYS + 31), today))
+    for table in ("car_repair", "spare_parts"):
+        cursor.execute(sql.SQL("ALTER TABLE {} DISABLE TRIGGER USER").format(sql.Identifier(table)))
+
+    load("workshops", ("workshop_id", "name"),
+         ((i, f"Цех {i}") for i in range(1, workshops + 1)))
+    load("teams", ("team_id", "name"),
+         ((i, f"Бригада {i}") for i in range(1, teams + 1)))
+    load("personnel", ("workshop_id", "inn", "team_id"),
+         ((rng.randint(1, workshops), f"{i:012d}", rng.randint(1, teams))
+          for i in range(1, teams * 6 + 1)))
+    load("faults", ("fault_id", "name", "work_cost"),
+         ((i, f"{FAULTS[(i - 1) % len(FAULTS)]} ({(i - 1) // len(FAULTS) + 1})",
+           f"{rng.uniform(500, 20000):.2f}") for i in range(1, faults + 1)))
+    # Владельцев меньше, чем машин: у части владельцев несколько машин
+    load("cars", ("car_id", "body_number", "engine_number", "owner", "factory_number"),
+         ((i, f"B{i}", f"E{i}",
+           f"{rng.choice(SURNAMES)} {rng.randint(1, max(1, cars // 25))}", f"F{i}")
+          for i in range(1, cars + 1)))
+    load("car_repair",
+         ("repair_id", "car_id", "fault_id", "admission_date", "completion_date", "team_id"),
+         _repairs(seed + 1, cars, faults, teams, today))
+    part_columns = ("car_id", "fault_id", "name", "price", "quantity")
+    load("spare_parts", ("repair_id",) + part_columns if link_parts else part_columns,
+         _parts(seed + 2, _repairs(seed + 1, cars, faults, teams, today), link_parts))
+
+    for table in ("car_repair", "spare_parts"):
+        cursor.execute(sql.SQL("ALTER TABLE {} ENABLE TRIGGER USER").format(sql.Identifier(table)))
+    for table, column in (("workshops", "workshop_id"), ("teams", "team_id"), ("cars", "car_id"),
+                          ("faults", "fault_id"), ("car_repair", "repair_id"),
+                          ("spare_parts", "part_id")):
+        cursor.execute(sql.SQL(
+            "SELECT setval(pg_get_serial_sequence(%s, %s), (SELECT max({}) FROM {}))"
+        ).format(sql.Identifier(column), sql.Identifier(table)), (table, column))
+    if rollups_installed(conn):
+        cursor.execute("SELECT report_rollup_rebuild()")
+    conn.commit()
+
+    # ANALYZE - вне транзакции загрузки, чтобы замеры шли по свежей статистике
+    conn.autocommit = True
+    try:
+        cursor.execute(sql.SQL("ANALYZE {}").format(sql.SQL(", ").join(map(sql.Identifier, TABLES))))
+    finally:
+        conn.autocommit = False
+    return counts
+
+
+# --- Замеры ---
+
+@dataclass
+class Measurement:
+    """Результат замера одной операции"""
+    name: str
+    times: list        # секунды по запускам
+    rows: int          # строк прочитано/записано за все запуски
+    peak_rss_kb: int = None
+
+    def summary(self):
+        times = sorted(self.times)
+        total = sum(times)
+        return {
+            "name": self.name,
+            "runs": len(times),
+            "p50_ms": round(_percentile(times, 0.5) * 1000, 3),
+            "p95_ms": round(_percentile(times, 0.95) * 1000, 3),
+            "max_ms": round(times[-1] * 1000, 3),
+            "rows": self.rows,
+            "rows_per_s": round(self.rows / total, 1) if total else None,
+            "peak_rss_kb": self.peak_rss_kb,
+        }
+
+
+def _percentile(sorted_values, fraction):
+    """Перцентиль по ближайшему рангу"""
+    return sorted_values[max(0, ceil(fraction * len(sorted_values)) - 1)]
+
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _first_chunk(conn, query, params=None):
+    """Первая порция результата через серверный курсор - как при открытии в таблице"""
+    cursor = conn.cursor(name="bench_browse", scrollable=True)
+    try:
+        cursor.execute(query, params)
+        cursor.scroll(0, mode="absolute")
+        return len(cursor.fetchmany(CHUNK_SIZE))
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+def _measure(name, fn, repeat, warmup, after=None):
+    """fn(номер запуска) возвращает число строк; прогревочные запуски не учитываются.
+
+    after() вызывается после каждого запуска вне замера.
+    """
+    for i in range(warmup):
+        fn(-1 - i)
+        if after is not None:
+            after()
+    times = []
+    rows = 0
+    for i in range(repeat):
+        started = time.perf_counter()
+        rows += fn(i)
+        times.append(time.perf_counter() - started)
+        if after is not None:
+            after()
+    return Measurement(name, times, rows, _peak_rss_kb())
+
+
+def run_benchmarks(conn, schema, repeat=5, parts=10, on_result=None):
+    """Замер операций главного окна на текущих данных.
+
+    Запросы строятся теми же функциями, что и в приложении: открытие
+    таблиц, фильтр, поиск, три отчета, сохранение ремонта с parts
+    запчастями и каскадное удаление машины (удаление откатывается, чтобы
+    данные не менялись между запусками). on_result(Measurement)
+    вызывается после каждого замера. Возвращает словарь для JSON.
+    """
+    cursor = conn.cursor()
+    schema.check(conn)
+    search_mode = prepare_search(conn, schema)
+    use_rollups = rollups_installed(conn)
+    cursor.execute("SHOW server_version")
+    server_version = cursor.fetchone()[0]
+    table_rows = {}
+    for table in TABLES:
+        cursor.execute(sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(table)))
+        table_rows[table] = cursor.fetchone()[0]
+    cursor.execute("SELECT owner FROM cars ORDER BY car_id LIMIT 1")
+    owner = cursor.fetchone()
+    cursor.execute("""
+        SELECT car_id FROM car_repair GROUP BY car_id ORDER BY count(*) DESC, car_id LIMIT %s
+    """, (repeat,))
+    busy_cars = [row[0] for row in cursor.fetchall()]
+    conn.rollback()
+    if owner is None or not busy_cars:
+        raise BenchError("Нет данных для замеров (python cli.py generate)")
+    owner_word = owner[0].split()[0]
+
+    results = []
+
+    def add(measurement):
+        results.append(measurement)
+        if on_result is not None:
+            on_result(measurement)
+
+    def load_table(table):
+        def run(i):
+            schema.check(conn)
+            return _first_chunk(conn, browse_query(table))
+        return run
+
+    for table in TABLES:
+        add(_measure(f"load_table:{table}", load_table(table), repeat, warmup=1))
+
+    condition, params = condition_sql(schema.table("cars"), Condition("owner", CONTAINS, owner_word),
+                                      search_mode)
+    add(_measure("apply_filter:cars.owner",
+                 lambda i: _first_chunk(conn, browse_query("cars", condition), params),
+                 repeat, warmup=1))
+
+    for table, text in (("cars", owner_word), ("spare_parts", PARTS[0].split()[0])):
+        condition, params = search_condition(schema.table(table), text, search_mode)
+        add(_measure(f"search_data:{table}",
+                     lambda i, t=table, c=condition, p=params:
+                         _first_chunk(conn, browse_query(t, c), p),
+                     repeat, warmup=1))
+
+    today = date.today()
+    period = report_params(today - timedelta(days=365), today)
+    for number, report in enumerate(REPORTS, 1):
+        query = report_query(report, use_rollups)
+        params = period if report.dated else None
+        add(_measure(f"report:{number}",
+                     lambda i, q=query, p=params: _first_chunk(conn, q, p),
+                     repeat, warmup=1))
+
+    link_parts = schema.table("spare_parts").column("repair_id") is not None
+
+    def save_complex(i):
+        order = RepairOrder(busy_cars[0], 1, today.isoformat(),
+                            parts=[(PARTS[n % len(PARTS)], 100, 1) for n in range(parts)])
+        save_orders(conn, [order], link_parts)
+        return parts + 1
+    add(_measure(f"save_complex:{parts}_parts", save_complex, repeat, warmup=0))
+
+    delete = sql.SQL("DELETE FROM cars WHERE {}").format(key_condition(("car_id",)))
+
+    def delete_record(i):
+        cursor.execute(delete, (busy_cars[i % len(busy_cars)],))
+        return cursor.rowcount
+    add(_measure("delete_record:cars", delete_record, repeat, warmup=0, after=conn.rollback))
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "server_version": server_version,
+        "search_mode": search_mode,
+        "report_rollups": use_rollups,
+        "repeat": repeat,
+        "tables": table_rows,
+        "results": [m.summary() for m in results],
+        "peak_rss_kb": _peak_rss_kb(),
+    }
+
+
+def _git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
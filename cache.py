@@ -0,0 +1,143 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+CACHE_ENTRIES = 64      # результатов в кэше
+CACHE_TTL = 300         # секунды хранения результата
+CACHE_MAX_ROWS = 10000  # большие результаты не кэшируются
+
+_SPACE = re.compile(r"\s+")
+
+
+class QueryCache:
+    """Кэш результатов запросов (справочники, отчеты).
+
+    Ключ - текст запроса без лишних пробелов и параметры. Хранится не
+    больше max_entries результатов (давно не использованные вытесняются),
+    каждый не дольше ttl секунд. У результата есть список таблиц, из
+    которых он получен: invalidate(таблица) удаляет все результаты,
+    зависящие от нее.
+
+    Чтобы результат запроса, начатого до изменения таблицы, не попал в
+    кэш после сброса, put принимает отметку stamp(), взятую до выполнения
+    запроса.
+    """
+
+    def __init__(self, max_entries=CACHE_ENTRIES, ttl=CACHE_TTL, max_rows=CACHE_MAX_ROWS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # ключ -> (срок, таблицы, результат)
+        self._counter = 0              # номер последнего сброса
+        self._invalidated = {}         # таблица -> номер ее последнего сброса
+        self._cleared = 0              # номер последнего сброса всего кэша
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(query, params=None):
+        """Ключ кэша для запроса с параметрами"""
+        return _SPACE.sub(" ", str(query)).strip(), _freeze(params)
+
+    def stamp(self):
+        """Отметка, которую нужно взять перед выполнением запроса для put"""
+        with self._lock:
+            return self._counter
+
+    def get(self, key):
+        """Результат из кэша или None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, result, tables, stamp, rows=None):
+        """Сохранение результата, полученного из таблиц tables.
+
+        rows - число строк результата (по умолчанию len(result)).
+        Результат не сохраняется, если он слишком большой или какая-либо
+        из таблиц изменилась после stamp.
+        """
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        if (len(result) if rows is None else rows) > self.max_rows:
+            return
+        tables = frozenset(tables)
+        with self._lock:
+            if self._cleared > stamp or any(self._invalidated.get(table, 0) > stamp
+                                            for table in tables):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, tables, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def fetchall(self, db, query, params=None, tables=()):
+        """Строки запроса из кэша; при промахе запрос выполняется на
+        соединении из пула db и результат сохраняется.
+        """
+        key = self.key(query, params)
+        rows = self.get(key)
+        if rows is not None:
+            return rows
+        stamp = self.stamp()
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            conn.rollback()
+        self.put(key, rows, tables, stamp)
+        return rows
+
+    def invalidate(self, *tables):
+        """Удаление результатов, зависящих от указанных таблиц"""
+        with self._lock:
+            self._counter += 1
+            for table in tables:
+                self._invalidated[table] = self._counter
+            stale = [key for key, entry in self._entries.items()
+                     if not entry[1].isdisjoint(tables)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        """Удаление всех результатов"""
+        with self._lock:
+            self._counter += 1
+            self._cleared = self._counter
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        """Статистика: записей, попаданий, промахов, вытеснений, сбросов"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def _freeze(value):
+    """Параметры запроса в виде, пригодном для ключа словаря"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
@@ -1,43 +1,188 @@
 import sys
-import psycopg2
+import time
+
+# Начало загрузки модулей - для замеров запуска (--profile-startup)
+_IMPORT_STARTED = time.perf_counter()
+
+if __name__ == "__main__" and len(sys.argv) > 1 and not sys.argv[1].startswith("-"):
+    # python -m car_service <команда> выполняется без загрузки PyQt6
+    from cli import main
+    sys.exit(main())
+
 from datetime import datetime
-from PyQt6.QtWidgets import *
-from PyQt6.QtCore import Qt, QDate
+from PyQt6.QtWidgets import (QAbstractItemView, QApplication, QCheckBox, QComboBox, QDateEdit,
+                             QDialog, QDialogButtonBox, QFileDialog, QFormLayout, QHBoxLayout,
+                             QInputDialog, QLabel, QLineEdit, QMainWindow, QMessageBox,
+                             QProgressBar, QPushButton, QSpinBox, QTabWidget, QTableView,
+                             QTableWidget, QTableWidgetItem, QVBoxLayout, QWidget)
+from PyQt6.QtCore import Qt, QDate, QTimer
 from PyQt6.QtGui import QFont
 
+from psycopg2 import sql
+
+# Модули диалогов и команд меню (отчеты, импорт, правка, диагностика,
+# локальная копия) загружаются в своих обработчиках при первом вызове
+from cache import QueryCache
+from db import Database, load_config
+from filters import (AND, BETWEEN, IN, IS_NULL, NOT_NULL, OPERATOR_LABELS, OR, Condition, Filter,
+                     FilterError, SavedFilters, condition_predicate, filter_sql, operators,
+                     parse_value)
+from listener import ChangeListener, notify_triggers_installed
+from queries import browse_query, key_in_condition, keyset_page_query, typed_keys_query
+from repairs import OrderQueue, RepairOrder, save_orders
+from schema import SchemaCache
+from search import ILIKE, prepare_search, search_condition
+from sorting import (SORT_INDEX_MIN_ROWS, SortError, create_sort_index, order_label, sort_order,
+                     supporting_index)
+from table_model import QueryTableModel
+from workers import QueryRunner, is_cancelled, is_connection_error
+
+_IMPORTED = time.perf_counter()
+
+
+class StartupProfile:
+    """Замеры запуска: время от начала загрузки модулей до этапов запуска"""
+    
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.marks = {}
+        self.mark("Загрузка модулей", _IMPORTED)
+    
+    def mark(self, stage, moment=None):
+        """Отметка этапа (учитывается только первая отметка этапа)"""
+        if not self.enabled or stage in self.marks:
+            return
+        self.marks[stage] = (moment or time.perf_counter()) - _IMPORT_STARTED
+        print(f"{stage}: {self.marks[stage] * 1000:.0f} мс", file=sys.stderr)
+
+
 class SimpleDBApp:
     
-    def __init__(self):
+    def __init__(self, profile=False):
+        self.profile = StartupProfile(profile)
         self.app = QApplication(sys.argv)
         self.window = QMainWindow()
         self.window.setWindowTitle("Автосервис - Управление БД")
         self.window.setGeometry(100, 100, 1000, 600)
         
-        # Подключение к БД
-        self.conn = None
-        self.connect_db()
+        # Пул соединений создается в фоне при первом запросе (connect_db),
+        # окно показывается, не дожидаясь БД
+        self.db = Database(load_config(), connect=False)
+        
+        # Все запросы выполняются в фоновых потоках на соединениях из пула
+        self.runner = QueryRunner(self.db)
+        
+        # Структура таблиц загружается один раз и обновляется после DDL
+        self.schema = SchemaCache()
+        
+        # Ремонты, сохраненные без связи с БД
+        self.order_queue = OrderQueue()
+        self.saved_filters = SavedFilters()
+        
+        # Изменения других рабочих мест приходят через LISTEN/NOTIFY
+        self.listener = ChangeListener(self.runner)
+        
+        # Результаты отчетов и справочников; сбрасываются при записи в таблицы
+        self.query_cache = QueryCache(self.db.config["cache_entries"],
+                                      self.db.config["cache_ttl"])
+        
+        # Панель диагностики запросов создается при первом открытии
+        self.diagnostics = None
+        
+        # Локальная копия таблиц (mirror_tables в настройках): таблицы и
+        # справочники читаются из нее без задержек и без связи с БД
+        self.mirror = None
+        if self.db.config["mirror_tables"].strip():
+            from mirror import open_mirror
+            self.mirror = open_mirror(self.db.config)
+        self.mirror_timer = QTimer(self.window)
+        self.mirror_timer.setInterval(self.db.config["mirror_sync_interval"] * 1000)
+        self.mirror_timer.timeout.connect(self.sync_mirror)
         
         self.setup_ui()
+        self.connect_db()
         
     def connect_db(self):
-        """Подключение к базе данных"""
-        try:
-            self.conn = psycopg2.connect(
-                host="localhost",
-                database="car_service",
-                user="postgres",
-                password="postgres",  
-                port="5432"
-            )
-            print("Успешное подключение к БД")
-        except Exception as e:
-            print(f"Ошибка подключения: {e}")
-            QMessageBox.critical(None, "Ошибка", 
-                f"Не удалось подключиться к БД:\n{str(e)}")
-            sys.exit(1)
+        """Подключение к базе данных в фоне"""
+        self.runner.submit(
+            lambda conn: None,
+            on_result=self.on_connected,
+            on_error=self.on_connect_failed,
+            description="Подключение к БД")
+    
+    def on_connected(self, result):
+        """БД доступна - загрузка первой таблицы и фоновые проверки"""
+        print("Успешное подключение к БД")
+        self.profile.mark("Подключение к БД")
+        self.offline = False
+        # Таблица, выбранная до подключения, загружается заново
+        self.current_table = ""
+        self.load_table()
+        self.prepare_search()
+        self.check_report_rollups()
+        self.check_partitions()
+        
+        self.listener.changed.connect(self.on_table_changed)
+        # Оповещения за время разрыва связи потеряны - перечитываем таблицу
+        self.listener.reconnected.connect(self.reload_view)
+        self.listener.start()
+        self.check_live_updates()
+        if self.mirror is not None:
+            self.sync_mirror()
+            self.mirror_timer.start()
+    
+    def on_connect_failed(self, error):
+        print(f"Ошибка подключения: {error}")
+        self.status_label.setText("Нет подключения к БД")
+        if self.mirror is not None and self.mirror.structures():
+            reply = QMessageBox.question(self.window, "Нет подключения к БД",
+                f"Не удалось подключиться к БД:\n{error}\n\n"
+                "Работать с локальной копией таблиц? Изменения будут отправлены "
+                "после восстановления связи.")
+            if reply == QMessageBox.StandardButton.Yes:
+                self.start_offline()
+                return
+        reply = QMessageBox.critical(self.window, "Ошибка",
+            f"Не удалось подключиться к БД:\n{error}",
+            QMessageBox.StandardButton.Retry | QMessageBox.StandardButton.Cancel)
+        if reply == QMessageBox.StandardButton.Retry:
+            self.connect_db()
+        else:
+            self.window.close()
+    
+    def start_offline(self):
+        """Работа без связи с БД: таблицы из локальной копии, запись - в очередь.
+        
+        Копия продолжает синхронизироваться по таймеру; первая удачная
+        синхронизация возвращает окно к работе с БД.
+        """
+        self.offline = True
+        self.schema.restore(self.mirror.structures())
+        self.current_table = ""
+        self.load_table()
+        self.mirror_timer.start()
     
     def setup_ui(self):
         """Создание интерфейса"""
+        # Меню
+        file_menu = self.window.menuBar().addMenu("Файл")
+        import_action = file_menu.addAction("Импорт из CSV...")
+        import_action.triggered.connect(self.import_csv)
+        export_action = file_menu.addAction("Экспорт в CSV...")
+        export_action.triggered.connect(self.export_csv)
+        
+        service_menu = self.window.menuBar().addMenu("Сервис")
+        refresh_schema_action = service_menu.addAction("Обновить структуру БД")
+        refresh_schema_action.triggered.connect(self.refresh_schema)
+        rebuild_rollups_action = service_menu.addAction("Пересчитать агрегаты отчетов")
+        rebuild_rollups_action.triggered.connect(self.rebuild_report_rollups)
+        flush_queue_action = service_menu.addAction("Отправить отложенные ремонты")
+        flush_queue_action.triggered.connect(self.flush_order_queue)
+        diagnostics_action = service_menu.addAction("Диагностика запросов")
+        diagnostics_action.triggered.connect(self.show_diagnostics)
+        mirror_action = service_menu.addAction("Локальная копия...")
+        mirror_action.triggered.connect(self.show_mirror_status)
+        
         central_widget = QWidget()
         self.window.setCentralWidget(central_widget)
         layout = QVBoxLayout(central_widget)
@@ -58,7 +203,7 @@ class SimpleDBApp:
         self.table_combo.currentIndexChanged.connect(self.load_table)
         
         refresh_btn = QPushButton("Обновить")
-        refresh_btn.clicked.connect(self.load_table)
+        refresh_btn.clicked.connect(self.refresh_table)
         
         add_btn = QPushButton("+ Добавить")
         add_btn.clicked.connect(self.add_record)
@@ -69,12 +214,24 @@ class SimpleDBApp:
         delete_btn = QPushButton("🗑 Удалить")
         delete_btn.clicked.connect(self.delete_record)
         
+        update_field_btn = QPushButton("Изменить поле...")
+        update_field_btn.setToolTip("Записать значение поля во все выбранные записи")
+        update_field_btn.clicked.connect(self.update_field)
+        
+        # Удаление и изменение поля применяются ко всем строкам, подходящим
+        # под фильтр и поиск, а не только к загруженным в таблицу
+        self.select_all_btn = QPushButton("Все по фильтру")
+        self.select_all_btn.setCheckable(True)
+        self.select_all_btn.toggled.connect(self.toggle_select_all)
+        
         top_panel.addWidget(QLabel("Таблица:"))
         top_panel.addWidget(self.table_combo)
         top_panel.addWidget(refresh_btn)
         top_panel.addWidget(add_btn)
         top_panel.addWidget(edit_btn)
         top_panel.addWidget(delete_btn)
+        top_panel.addWidget(update_field_btn)
+        top_panel.addWidget(self.select_all_btn)
         
         layout.addLayout(top_panel)
         
@@ -83,13 +240,31 @@ class SimpleDBApp:
         
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("Поиск по всем полям...")
-        self.search_input.textChanged.connect(self.search_data)
+        # Поиск выполняется на сервере после паузы в наборе текста
+        self.search_timer = QTimer(self.window)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(300)
+        self.search_timer.timeout.connect(self.search_data)
+        self.search_input.textChanged.connect(self.search_timer.start)
         
         self.filter_field = QComboBox()
+        self.filter_field.currentIndexChanged.connect(self.update_filter_operators)
+        self.filter_op = QComboBox()
+        self.filter_op.currentIndexChanged.connect(self.update_filter_value_hint)
         self.filter_value = QLineEdit()
         self.filter_value.setPlaceholderText("Значение для фильтра")
+        self.filter_value.returnPressed.connect(self.apply_filter)
         filter_btn = QPushButton("Фильтровать")
         filter_btn.clicked.connect(self.apply_filter)
+        add_condition_btn = QPushButton("+ Условие")
+        add_condition_btn.setToolTip("Добавить условие к текущему фильтру")
+        add_condition_btn.clicked.connect(self.add_filter_condition)
+        self.filter_combine = QComboBox()
+        self.filter_combine.addItem("И", AND)
+        self.filter_combine.addItem("ИЛИ", OR)
+        self.filter_combine.currentIndexChanged.connect(self.on_filter_combine_changed)
+        self.local_filter_check = QCheckBox("В загруженных")
+        self.local_filter_check.setToolTip("Отбирать строки среди уже загруженных, без запроса к БД")
         
         clear_btn = QPushButton("Сбросить фильтры")
         clear_btn.clicked.connect(self.clear_filters)
@@ -98,16 +273,94 @@ class SimpleDBApp:
         filter_panel.addWidget(self.search_input)
         filter_panel.addWidget(QLabel("Поле:"))
         filter_panel.addWidget(self.filter_field)
+        filter_panel.addWidget(self.filter_op)
         filter_panel.addWidget(self.filter_value)
         filter_panel.addWidget(filter_btn)
+        filter_panel.addWidget(add_condition_btn)
+        filter_panel.addWidget(self.filter_combine)
+        filter_panel.addWidget(self.local_filter_check)
         filter_panel.addWidget(clear_btn)
         
         layout.addLayout(filter_panel)
         
+        # Текущий фильтр и сохраненные фильтры
+        saved_panel = QHBoxLayout()
+        self.filter_label = QLabel("")
+        self.saved_filter_combo = QComboBox()
+        self.saved_filter_combo.setMinimumWidth(180)
+        self.saved_filter_combo.activated.connect(self.load_saved_filter)
+        save_filter_btn = QPushButton("Сохранить фильтр...")
+        save_filter_btn.clicked.connect(self.save_filter)
+        delete_filter_btn = QPushButton("Удалить фильтр")
+        delete_filter_btn.clicked.connect(self.delete_saved_filter)
+        saved_panel.addWidget(QLabel("Фильтр:"))
+        saved_panel.addWidget(self.filter_label, 1)
+        saved_panel.addWidget(self.saved_filter_combo)
+        saved_panel.addWidget(save_filter_btn)
+        saved_panel.addWidget(delete_filter_btn)
+        
+        layout.addLayout(saved_panel)
+        
+        # Панель постраничного просмотра
+        page_panel = QHBoxLayout()
+        
+        self.page_mode_check = QCheckBox("Постранично")
+        self.page_mode_check.toggled.connect(self.toggle_page_mode)
+        
+        self.page_size_spin = QSpinBox()
+        self.page_size_spin.setRange(10, 10000)
+        self.page_size_spin.setSingleStep(50)
+        self.page_size_spin.setValue(100)
+        
+        self.first_page_btn = QPushButton("⏮")
+        self.first_page_btn.clicked.connect(lambda: self.load_page("first"))
+        self.prev_page_btn = QPushButton("◀ Назад")
+        self.prev_page_btn.clicked.connect(lambda: self.load_page("prev"))
+        self.next_page_btn = QPushButton("Вперед ▶")
+        self.next_page_btn.clicked.connect(lambda: self.load_page("next"))
+        self.last_page_btn = QPushButton("⏭")
+        self.last_page_btn.clicked.connect(lambda: self.load_page("last"))
+        
+        self.jump_key_input = QLineEdit()
+        self.jump_key_input.setPlaceholderText("Ключ (для составного - через запятую)")
+        self.jump_key_input.returnPressed.connect(self.jump_to_key)
+        jump_btn = QPushButton("Перейти")
+        jump_btn.clicked.connect(self.jump_to_key)
+        
+        self.page_label = QLabel("")
+        
+        page_panel.addWidget(self.page_mode_check)
+        page_panel.addWidget(QLabel("Строк на странице:"))
+        page_panel.addWidget(self.page_size_spin)
+        page_panel.addWidget(self.first_page_btn)
+        page_panel.addWidget(self.prev_page_btn)
+        page_panel.addWidget(self.next_page_btn)
+        page_panel.addWidget(self.last_page_btn)
+        page_panel.addWidget(self.jump_key_input)
+        page_panel.addWidget(jump_btn)
+        page_panel.addWidget(self.page_label)
+        page_panel.addStretch()
+        
+        layout.addLayout(page_panel)
+        
         # Таблица
-        self.table = QTableWidget()
+        self.model = QueryTableModel(self.runner)
+        self.model.loaded.connect(self.on_model_loaded)
+        self.model.progress.connect(self.update_row_count)
+        self.model.failed.connect(lambda e: self.show_db_error("Ошибка загрузки", e))
+        
+        self.table = QTableView()
+        self.table.setModel(self.model)
         self.table.setAlternatingRowColors(True)
-        self.table.cellDoubleClicked.connect(self.edit_record)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.doubleClicked.connect(self.edit_record)
+        # Выбор строк вручную отменяет выбор всех по фильтру
+        self.table.pressed.connect(lambda index: self.select_all_btn.setChecked(False))
+        # Щелчок по заголовку сортирует строки (с Shift - по нескольким полям)
+        self.table.horizontalHeader().setSectionsClickable(True)
+        self.table.horizontalHeader().sectionClicked.connect(self.sort_by_column)
         layout.addWidget(self.table)
         
         # Нижняя панель
@@ -116,15 +369,34 @@ class SimpleDBApp:
         self.status_label = QLabel("Готово")
         self.row_count_label = QLabel("Записей: 0")
         
+        # Индикатор выполнения фонового запроса
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setMaximumWidth(120)
+        self.progress_bar.hide()
+        
+        self.cancel_btn = QPushButton("Отменить запрос")
+        self.cancel_btn.clicked.connect(self.runner.cancel)
+        self.cancel_btn.hide()
+        
+        self.runner.busy_changed.connect(self.on_busy_changed)
+        
         reports_btn = QPushButton("📊 Отчеты")
         reports_btn.clicked.connect(self.show_reports)
         
+        totals_btn = QPushButton("Итоги...")
+        totals_btn.setToolTip("Число строк и суммы по значениям поля (по загруженным строкам)")
+        totals_btn.clicked.connect(self.show_totals)
+        
         complex_form_btn = QPushButton("➕ Сложная форма (ремонт+запчасти)")
         complex_form_btn.clicked.connect(self.complex_form)
         
         bottom_panel.addWidget(self.status_label)
+        bottom_panel.addWidget(self.progress_bar)
+        bottom_panel.addWidget(self.cancel_btn)
         bottom_panel.addStretch()
         bottom_panel.addWidget(self.row_count_label)
+        bottom_panel.addWidget(totals_btn)
         bottom_panel.addWidget(reports_btn)
         bottom_panel.addWidget(complex_form_btn)
         
@@ -132,8 +404,27 @@ class SimpleDBApp:
         
         # Загружаем первую таблицу
         self.current_table = ""
-        self.current_data = []
-        self.load_table()
+        self.current_pk = []
+        self.current_filter = None
+        self.filter_conditions = []  # условия фильтра (filters.Condition)
+        self.sort_columns = []  # сортировка по щелчку на заголовке: (поле, по убыванию)
+        self.query_order = None  # порядок, в котором строки пришли с сервера
+        self.declined_sort_indexes = set()  # (таблица, сортировка), для которых индекс не нужен
+        self.sort_index_table = None  # таблица, для которой строится индекс сортировки
+        self.current_search = None
+        self.search_mode = ILIKE
+        self.use_report_rollups = False
+        self.live_updates = False
+        self.batch_table = None  # таблица, в которой выполняется групповое изменение
+        self.view_version = 0
+        self.filtered = False
+        self.offline = False  # нет связи с БД, работа с локальной копией
+        self.mirror_syncing = False
+        self.mirror_resync = False  # синхронизацию запросили, пока шла предыдущая
+        self.mirror_callbacks = []  # вызываются после следующей синхронизации
+        self.page_keys = None
+        self.page_direction = "first"
+        self.update_page_controls()
         
     def get_table_name(self):
         """Получаем имя таблицы из комбобокса"""
@@ -147,175 +438,871 @@ class SimpleDBApp:
             return
             
         self.current_table = table_name
+        self.current_filter = None
+        self.filter_conditions = []
+        self.sort_columns = []
+        self.filter_label.setText("")
+        self.current_search = None
+        self.filtered = False
+        self.search_timer.stop()
+        self.search_input.blockSignals(True)
+        self.search_input.clear()
+        self.search_input.blockSignals(False)
+        
+        if self.offline:
+            # Структура - из локальной копии (SchemaCache.restore)
+            if table_name in self.schema:
+                self.on_structure_loaded(table_name, self.schema.table(table_name))
+            else:
+                self.model.clear()
+                self.status_label.setText(f"Таблицы {table_name} нет в локальной копии")
+            return
+        
+        def load_structure(conn):
+            # Структура берется из кэша; он перезагружается, только если
+            # таблицы изменились
+            self.schema.check(conn)
+            return self.schema.table(table_name)
+        
+        self.runner.submit(
+            load_structure,
+            on_result=lambda table: self.on_structure_loaded(table_name, table),
+            on_error=lambda e: self.show_db_error("Ошибка загрузки", e),
+            description=f"Загрузка таблицы {table_name}",
+            readonly=True)
+    
+    def on_structure_loaded(self, table_name, table):
+        """Структура таблицы получена - загружаем данные"""
+        if table_name != self.current_table:
+            return
         
+        # Заполняем комбобокс фильтров
+        self.filter_field.clear()
+        for column in table.columns:
+            self.filter_field.addItem(column.name)
+        self.update_saved_filters()
+        
+        self.current_pk = list(table.primary_key)
+        self.reload_view()
+    
+    def refresh_schema(self):
+        """Сброс кэша структуры и перезагрузка текущей таблицы"""
+        self.schema.invalidate()
+        self.current_table = ""
+        self.load_table()
+    
+    def on_model_loaded(self):
+        """Первая порция данных получена"""
+        self.profile.mark("Первые строки таблицы")
+        self.table.resizeColumnsToContents()
+        if self.page_mode_check.isChecked():
+            self.on_page_loaded()
+        if not self.filtered:
+            self.status_label.setText(f"Загружена таблица: {self.current_table}")
+    
+    def on_busy_changed(self, busy, description):
+        """Отображение выполняющегося фонового запроса"""
+        self.progress_bar.setVisible(busy)
+        self.cancel_btn.setVisible(busy)
+        if busy:
+            self.status_label.setText(f"{description}...")
+    
+    def show_db_error(self, title, error, parent=None):
+        """Сообщение об ошибке фонового запроса"""
+        if is_cancelled(error):
+            self.status_label.setText("Запрос отменен")
+            return
+        QMessageBox.critical(parent or self.window, "Ошибка", f"{title}: {str(error)}")
+    
+    def toggle_page_mode(self, checked):
+        """Переключение между потоковым и постраничным просмотром"""
+        self.update_page_controls()
+        self.reload_view()
+    
+    def refresh_table(self):
+        """Принудительная перезагрузка текущей таблицы (кнопка Обновить)"""
+        if self.current_table != self.get_table_name():
+            self.load_table()
+        else:
+            self.reload_view()
+    
+    def reload_view(self):
+        """Перезагрузка текущей таблицы с учетом фильтра и режима просмотра"""
+        self.select_all_btn.setChecked(False)
         try:
-            # Получаем структуру таблицы
-            cursor = self.conn.cursor()
-            cursor.execute(f"""
-                SELECT column_name, data_type 
-                FROM information_schema.columns 
-                WHERE table_name = '{table_name}'
-                ORDER BY ordinal_position
-            """)
-            columns = cursor.fetchall()
-            
-            # Заполняем комбобокс фильтров
-            self.filter_field.clear()
-            for col_name, col_type in columns:
-                self.filter_field.addItem(col_name)
-            
-            # Загружаем данные
-            cursor.execute(f"SELECT * FROM {table_name} ORDER BY 1")
-            self.current_data = cursor.fetchall()
-            
-            # Настраиваем таблицу
-            self.table.setColumnCount(len(columns))
-            self.table.setRowCount(len(self.current_data))
-            
-            # Заголовки
-            headers = [col[0] for col in columns]
-            self.table.setHorizontalHeaderLabels(headers)
-            
-            # Данные
-            for row_idx, row in enumerate(self.current_data):
-                for col_idx, value in enumerate(row):
-                    item = QTableWidgetItem(str(value) if value is not None else "")
-                    item.setFlags(item.flags() & ~Qt.ItemFlag.ItemIsEditable)
-                    self.table.setItem(row_idx, col_idx, item)
-            
-            self.table.resizeColumnsToContents()
-            self.row_count_label.setText(f"Записей: {len(self.current_data)}")
-            self.status_label.setText(f"Загружена таблица: {table_name}")
-            
-        except Exception as e:
-            QMessageBox.critical(self.window, "Ошибка", f"Ошибка загрузки: {str(e)}")
+            self.query_order = self.sort_order()
+        except SortError as e:
+            # Поле пропало после изменения структуры - сортировка сбрасывается
+            self.sort_columns = []
+            self.query_order = None
+            self.status_label.setText(str(e))
+        self.update_sort_indicator()
+        if self.use_mirror():
+            self.load_from_mirror()
+        elif self.page_mode_check.isChecked():
+            self.load_page("first")
+        elif self.current_condition() is not None:
+            condition, params = self.current_condition()
+            self.display_filtered_data(
+                browse_query(self.current_table, condition, self.query_order), params)
+        else:
+            # Загружаем данные порциями через серверный курсор
+            self.view_version += 1
+            self.model.set_query(
+                browse_query(self.current_table, order=self.query_order),
+                description=f"Загрузка таблицы {self.current_table}",
+                key_columns=self.current_pk)
+    
+    def use_mirror(self):
+        """Показывается ли текущая таблица из локальной копии.
+        
+        Копия заменяет потоковый просмотр; постраничный просмотр без
+        связи с БД тоже переходит на нее.
+        """
+        return (self.mirror is not None and self.current_table in self.mirror
+                and (self.offline or not self.page_mode_check.isChecked()))
+    
+    def load_from_mirror(self):
+        """Загрузка текущей таблицы из локальной копии с фильтром, поиском и сортировкой"""
+        if self.current_table not in self.schema:
+            return
+        table = self.schema.table(self.current_table)
+        flt = None
+        if self.current_filter is not None:
+            flt = Filter(tuple(self.filter_conditions), self.filter_combine.currentData())
+        search = self.search_input.text() if self.current_search is not None else None
+        order = self.query_order or ()
+        mirror = self.mirror
+        self.view_version += 1
+        self.model.set_rows(
+            lambda: mirror.select(table, flt, search, order),
+            description=f"Загрузка таблицы {table.name} из локальной копии",
+            key_columns=self.current_pk)
+    
+    def sort_order(self):
+        """Порядок строк запроса (с первичным ключом) или None без сортировки"""
+        if not self.sort_columns or self.current_table not in self.schema:
+            return None
+        return sort_order(self.schema.table(self.current_table), self.sort_columns)
+    
+    def update_page_controls(self):
+        """Доступность кнопок постраничного просмотра"""
+        enabled = self.page_mode_check.isChecked()
+        for widget in (self.page_size_spin, self.first_page_btn, self.prev_page_btn,
+                       self.next_page_btn, self.last_page_btn, self.jump_key_input):
+            widget.setEnabled(enabled)
+        if not enabled:
+            self.page_keys = None
+            self.page_label.setText("")
+    
+    def row_key(self, row):
+        """Значение первичного ключа строки результата"""
+        headers = self.model.headers()
+        return tuple(row[headers.index(col)] for col in self.current_pk)
+    
+    def page_key(self, row):
+        """Значения строки, по которым ищется соседняя страница: поля
+        сортировки и первичный ключ
+        """
+        if self.query_order is None:
+            return self.row_key(row)
+        headers = self.model.headers()
+        return tuple(row[headers.index(col)] for col, descending in self.query_order)
+    
+    def load_page(self, direction, key=None):
+        """Загрузка страницы с пагинацией по первичному ключу"""
+        if not self.current_pk:
+            QMessageBox.warning(self.window, "Предупреждение", 
+                f"У таблицы {self.current_table} нет первичного ключа")
+            return
+        
+        page_size = self.page_size_spin.value()
+        condition, condition_params = self.current_condition() or (None, ())
+        
+        kwargs = {}
+        if direction == "next" and self.page_keys:
+            kwargs["after"] = self.page_keys[1]
+        elif direction == "prev" and self.page_keys:
+            kwargs["before"] = self.page_keys[0]
+        elif direction == "jump":
+            kwargs["start"] = key
+        elif direction == "last":
+            kwargs["last"] = True
+        
+        query, params = keyset_page_query(
+            self.current_table, self.current_pk, page_size,
+            condition=condition, condition_params=condition_params, order=self.query_order,
+            not_null=[col.name for col in self.schema.table(self.current_table).columns
+                      if not col.nullable],
+            **kwargs)
+        self.page_direction = direction
+        self.view_version += 1
+        # Страница ограничена по размеру - читаем ее целиком
+        self.model.set_query(query, params, fetch_all=True, description="Загрузка страницы",
+                             key_columns=self.current_pk)
+    
+    def on_page_loaded(self):
+        """Страница загружена - запоминаем ее граничные ключи"""
+        if self.model.rowCount() == 0 and self.page_direction in ("next", "prev"):
+            # Дальше строк нет - остаемся на крайней странице
+            self.load_page("last" if self.page_direction == "next" else "first")
+            return
+        
+        if self.model.rowCount():
+            self.model.load_rows([0, self.model.rowCount() - 1], self.set_page_keys)
+        else:
+            self.page_keys = None
+            self.page_label.setText("Нет записей")
+    
+    def set_page_keys(self, rows):
+        """Граничные ключи страницы по ее первой и последней строкам"""
+        self.page_keys = tuple(self.page_key(row) for row in rows)
+        first, last = (", ".join(map(str, k)) for k in self.page_keys)
+        self.page_label.setText(f"Ключи: {first} … {last}")
+    
+    def jump_to_key(self):
+        """Переход к странице, начинающейся с указанного ключа"""
+        text = self.jump_key_input.text().strip()
+        if not text:
+            self.load_page("first")
+            return
+        if self.query_order is not None:
+            QMessageBox.information(self.window, "Переход к ключу",
+                "Переход к ключу работает без сортировки по полям: отмените ее "
+                "повторными щелчками по заголовку")
+            return
+        
+        values = [value.strip() for value in text.split(",")]
+        if len(values) > len(self.current_pk):
+            QMessageBox.warning(self.window, "Предупреждение",
+                f"Ключ таблицы состоит из полей: {', '.join(self.current_pk)}")
+            return
+        self.load_page("jump", values)
+    
+    def update_row_count(self, loaded=None):
+        """Обновление счетчика записей"""
+        count = str(self.model.rowCount())
+        if self.model.canFetchMore():
+            count += "+"
+        if self.filtered:
+            self.row_count_label.setText(f"Записей (отфильтровано): {count}")
+        else:
+            self.row_count_label.setText(f"Записей: {count}")
+    
+    def prepare_search(self):
+        """Фоновая подготовка индексов поиска"""
+        def on_prepared(mode):
+            self.search_mode = mode
+            if self.search_input.text().strip():
+                self.search_data()
+        
+        self.runner.submit(
+            lambda conn: prepare_search(conn, self.schema),
+            on_result=on_prepared,
+            # Без индексов поиск работает, только медленнее
+            on_error=lambda e: self.status_label.setText(f"Индексы поиска не созданы: {e}"),
+            description="Подготовка индексов поиска")
     
     def search_data(self):
-        """Поиск по всем полям"""
-        search_text = self.search_input.text().lower()
-        if not search_text:
-            self.load_table()
+        """Поиск по всем полям (на сервере)"""
+        if self.current_table not in self.schema:
             return
-            
-        for row in range(self.table.rowCount()):
-            found = False
-            for col in range(self.table.columnCount()):
-                item = self.table.item(row, col)
-                if item and search_text in item.text().lower():
-                    found = True
-                    break
-            self.table.setRowHidden(row, not found)
+        self.current_search = search_condition(
+            self.schema.table(self.current_table), self.search_input.text(), self.search_mode)
+        self.filtered = self.current_filter is not None or self.current_search is not None
+        # Новый запрос отменяет еще выполняющийся предыдущий
+        self.reload_view()
     
-    def apply_filter(self):
-        """Применение фильтра по выбранному полю"""
+    def current_condition(self):
+        """Условие отбора строк: фильтр по полю и поиск по всем полям"""
+        conditions = [c for c in (self.current_filter, self.current_search) if c is not None]
+        if not conditions:
+            return None
+        condition = sql.SQL(" AND ").join(
+            sql.SQL("({})").format(condition) for condition, params in conditions)
+        return condition, [param for condition, params in conditions for param in params]
+    
+    def update_filter_operators(self):
+        """Операции фильтра, применимые к типу выбранного поля"""
+        self.filter_op.clear()
+        if self.current_table not in self.schema:
+            return
+        column = self.schema.table(self.current_table).column(self.filter_field.currentText())
+        if column is None:
+            return
+        for op in operators(column):
+            self.filter_op.addItem(OPERATOR_LABELS[op], op)
+    
+    def update_filter_value_hint(self):
+        """Подсказка формата значения для выбранной операции"""
+        op = self.filter_op.currentData()
+        self.filter_value.setEnabled(op not in (IS_NULL, NOT_NULL))
+        if op == BETWEEN:
+            self.filter_value.setPlaceholderText("от..до")
+        elif op == IN:
+            self.filter_value.setPlaceholderText("значения через запятую")
+        else:
+            self.filter_value.setPlaceholderText("Значение для фильтра")
+    
+    def typed_condition(self):
+        """Условие, заданное полем, операцией и значением (None, если не задано)"""
         field = self.filter_field.currentText()
-        value = self.filter_value.text()
+        op = self.filter_op.currentData()
+        value = self.filter_value.text().strip()
+        if not field or op is None:
+            return None
+        if op in (IS_NULL, NOT_NULL):
+            return Condition(field, op)
+        return Condition(field, op, value) if value else None
+    
+    def apply_filter(self):
+        """Применение фильтра из одного условия по выбранному полю"""
+        condition = self.typed_condition()
+        if condition is not None:
+            self.set_filter([condition])
+    
+    def add_filter_condition(self):
+        """Добавление условия к текущему фильтру"""
+        condition = self.typed_condition()
+        if condition is not None:
+            self.set_filter(self.filter_conditions + [condition])
+    
+    def on_filter_combine_changed(self):
+        """Переключение И/ИЛИ между условиями фильтра"""
+        if len(self.filter_conditions) > 1:
+            self.set_filter(self.filter_conditions)
+    
+    def set_filter(self, conditions):
+        """Установка условий фильтра и перезагрузка таблицы.
         
-        if not field or not value:
+        Поля и значения проверяются по структуре таблицы; при ошибке
+        фильтр не меняется.
+        """
+        if self.current_table not in self.schema:
             return
-            
+        table = self.schema.table(self.current_table)
+        flt = Filter(tuple(conditions), self.filter_combine.currentData())
         try:
-            cursor = self.conn.cursor()
-            query = f"SELECT * FROM {self.current_table} WHERE {field}::text ILIKE %s ORDER BY 1"
-            cursor.execute(query, (f'%{value}%',))
-            
-            data = cursor.fetchall()
-            self.display_filtered_data(data)
-            
-        except Exception as e:
-            QMessageBox.warning(self.window, "Ошибка", f"Ошибка фильтрации: {str(e)}")
+            condition = filter_sql(table, flt, self.search_mode)
+            if self.local_filter_check.isChecked():
+                headers = self.model.headers()
+                predicates = [(headers.index(c.column), condition_predicate(table, c))
+                              for c in conditions if c.column in headers]
+        except FilterError as e:
+            QMessageBox.warning(self.window, "Фильтр", str(e))
+            return
+        
+        if self.local_filter_check.isChecked():
+            # Отбор среди загруженных строк без запроса; фильтр запроса не меняется
+            if not self.model.fully_loaded():
+                QMessageBox.warning(self.window, "Фильтр", 
+                    "Отбор в загруженных доступен, когда прочитаны все строки "
+                    "(прокрутите таблицу до конца)")
+                return
+            self.filter_conditions = list(conditions)
+            self.model.filter_loaded(predicates, flt.combine == OR)
+            self.filter_label.setText(f"{flt.label()} (в загруженных)")
+            self.update_row_count()
+            return
+        
+        self.filter_conditions = list(conditions)
+        self.current_filter = condition
+        self.filter_label.setText(flt.label())
+        self.filtered = self.current_filter is not None or self.current_search is not None
+        self.reload_view()
     
-    def display_filtered_data(self, data):
-        """Отображение отфильтрованных данных"""
-        self.table.setRowCount(len(data))
-        for row_idx, row in enumerate(data):
-            for col_idx, value in enumerate(row):
-                item = QTableWidgetItem(str(value) if value is not None else "")
-                item.setFlags(item.flags() & ~Qt.ItemFlag.ItemIsEditable)
-                self.table.setItem(row_idx, col_idx, item)
+    def sort_by_column(self, column):
+        """Сортировка по щелчку на заголовке.
+        
+        Щелчок сортирует по полю по возрастанию, повторный - по убыванию,
+        третий отменяет сортировку; с Shift поле добавляется к уже
+        выбранным. Прочитанный целиком результат сортируется в памяти,
+        иначе запрос повторяется с ORDER BY на сервере.
+        """
+        headers = self.model.headers()
+        if column >= len(headers):
+            return
+        name = headers[column]
+        shift = QApplication.keyboardModifiers() & Qt.KeyboardModifier.ShiftModifier
+        order = list(self.sort_columns)
+        if not shift:
+            order = [(col, descending) for col, descending in order if col == name]
+        current = dict(order)
+        if name not in current:
+            order.append((name, False))
+        elif not current[name]:
+            order[[col for col, descending in order].index(name)] = (name, True)
+        else:
+            order = [(col, descending) for col, descending in order if col != name]
+        self.sort_columns = order
+        
+        if (self.model.fully_loaded() and not self.page_mode_check.isChecked()
+                and (order or self.query_order is None)):
+            self.model.sort_loaded([(headers.index(col), descending) for col, descending in order])
+            self.update_sort_indicator()
+            return
+        self.reload_view()
+        self.check_sort_index()
+    
+    def update_sort_indicator(self):
+        """Значок сортировки в заголовке (у первого поля) и порядок в строке состояния"""
+        header = self.table.horizontalHeader()
+        headers = self.model.headers()
+        if not self.sort_columns or self.sort_columns[0][0] not in headers:
+            header.setSortIndicatorShown(False)
+            return
+        name, descending = self.sort_columns[0]
+        header.setSortIndicatorShown(True)
+        header.setSortIndicator(headers.index(name), Qt.SortOrder.DescendingOrder if descending
+                                else Qt.SortOrder.AscendingOrder)
+        self.status_label.setText(f"Сортировка: {order_label(self.sort_columns)}")
+    
+    def check_sort_index(self):
+        """Проверка индекса для сортировки; для большой таблицы без него
+        предлагается создать индекс
+        """
+        table_name = self.current_table
+        order = list(self.sort_columns)
+        declined = (table_name, tuple(order))
+        if (not order or declined in self.declined_sort_indexes
+                or table_name == self.sort_index_table):
+            return
+        
+        def on_checked(result):
+            index_name, rows = result
+            if (index_name is not None or rows < SORT_INDEX_MIN_ROWS
+                    or table_name != self.current_table or order != self.sort_columns):
+                return
+            self.declined_sort_indexes.add(declined)
+            reply = QMessageBox.question(self.window, "Сортировка",
+                f"Для сортировки по {order_label(order)} нет индекса: сервер будет "
+                f"сортировать все подходящие строки таблицы {table_name} "
+                f"(около {rows}) при каждом запросе.\n\n"
+                "Создать индекс? Таблица при этом не блокируется, но построение "
+                "может занять время.")
+            if reply == QMessageBox.StandardButton.Yes:
+                self.create_sort_index(table_name, order)
+        
+        self.runner.submit(
+            lambda conn: supporting_index(conn, table_name, order),
+            on_result=on_checked,
+            on_error=lambda e: None,
+            description="Проверка индекса сортировки",
+            readonly=True)
+    
+    def create_sort_index(self, table_name, order):
+        """Создание индекса для сортировки (в фоне)"""
+        full_order = sort_order(self.schema.table(table_name), order)
+        self.sort_index_table = table_name
+        
+        def on_created(index_name):
+            self.sort_index_table = None
+            self.status_label.setText(f"Создан индекс {index_name}")
+            if table_name == self.current_table:
+                self.reload_view()
+        
+        def on_error(e):
+            self.sort_index_table = None
+            self.show_db_error("Ошибка создания индекса", e)
+        
+        self.runner.submit(
+            lambda conn: create_sort_index(conn, table_name, full_order),
+            on_result=on_created,
+            on_error=on_error,
+            description=f"Создание индекса для {table_name}",
+            dialog_parent=self.window,
+            writes=True)
+    
+    def show_totals(self):
+        """Число строк и суммы числовых полей по значениям выбранного поля"""
+        if not self.model.fully_loaded():
+            QMessageBox.information(self.window, "Итоги", 
+                "Итоги доступны, когда прочитаны все строки (прокрутите таблицу до конца)")
+            return
+        headers = self.model.headers()
+        name, ok = QInputDialog.getItem(self.window, "Итоги", "Группировать по:", headers, 0, False)
+        if not ok:
+            return
+        # Суммируются числовые поля, кроме ключей и ссылок
+        table = self.schema.table(self.current_table) if self.current_table in self.schema else None
+        sum_columns = [i for i in self.model.numeric_columns()
+                       if table is None or (headers[i] not in table.primary_key
+                                            and table.foreign_key(headers[i]) is None)]
+        groups = self.model.group_loaded(headers.index(name), sum_columns)
         
-        self.row_count_label.setText(f"Записей (отфильтровано): {len(data)}")
+        dialog = QDialog(self.window)
+        dialog.setWindowTitle(f"Итоги по {name}")
+        dialog.resize(600, 400)
+        layout = QVBoxLayout(dialog)
+        result = QTableWidget(len(groups), 2 + len(sum_columns))
+        result.setHorizontalHeaderLabels(
+            [name, "Строк"] + [f"Сумма {headers[i]}" for i in sum_columns])
+        result.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        for row_idx, group in enumerate(groups):
+            for col_idx, value in enumerate(group):
+                result.setItem(row_idx, col_idx,
+                               QTableWidgetItem("" if value is None else str(value)))
+        result.resizeColumnsToContents()
+        layout.addWidget(result)
+        layout.addWidget(QLabel(f"Групп: {len(groups)}, строк: "
+                                f"{sum(group[1] for group in groups)}"))
+        dialog.exec()
+    
+    def update_saved_filters(self):
+        """Список сохраненных фильтров текущей таблицы"""
+        self.saved_filter_combo.clear()
+        self.saved_filter_combo.addItem("Сохраненные фильтры")
+        try:
+            names = self.saved_filters.names(self.current_table)
+        except (OSError, ValueError) as e:
+            self.status_label.setText(f"Не удалось прочитать сохраненные фильтры: {e}")
+            names = []
+        self.saved_filter_combo.addItems(names)
+    
+    def load_saved_filter(self, index):
+        """Применение сохраненного фильтра"""
+        if index <= 0:
+            return
+        name = self.saved_filter_combo.itemText(index)
+        try:
+            table_name, flt = self.saved_filters.get(name)
+        except (FilterError, OSError, ValueError) as e:
+            QMessageBox.warning(self.window, "Фильтр", str(e))
+            return
+        if table_name != self.current_table:
+            return
+        self.filter_combine.blockSignals(True)
+        self.filter_combine.setCurrentIndex(self.filter_combine.findData(flt.combine))
+        self.filter_combine.blockSignals(False)
+        self.set_filter(list(flt.conditions))
+    
+    def save_filter(self):
+        """Сохранение текущего фильтра под именем"""
+        if not self.filter_conditions:
+            QMessageBox.warning(self.window, "Фильтр", "Нет условий фильтра")
+            return
+        name, ok = QInputDialog.getText(self.window, "Сохранение фильтра", "Имя фильтра:")
+        name = name.strip()
+        if not ok or not name:
+            return
+        try:
+            self.saved_filters.save(name, self.current_table, Filter(
+                tuple(self.filter_conditions), self.filter_combine.currentData()))
+        except OSError as e:
+            QMessageBox.critical(self.window, "Ошибка", f"Не удалось сохранить фильтр: {e}")
+            return
+        self.update_saved_filters()
+        self.saved_filter_combo.setCurrentText(name)
+        self.status_label.setText(f"Фильтр {name} сохранен")
+    
+    def delete_saved_filter(self):
+        """Удаление выбранного сохраненного фильтра"""
+        if self.saved_filter_combo.currentIndex() <= 0:
+            return
+        name = self.saved_filter_combo.currentText()
+        try:
+            self.saved_filters.delete(name)
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self.window, "Ошибка", f"Не удалось удалить фильтр: {e}")
+            return
+        self.update_saved_filters()
+    
+    def display_filtered_data(self, query, params):
+        """Отображение отфильтрованных данных"""
+        self.filtered = True
+        self.view_version += 1
+        self.model.set_query(query, params, description="Фильтрация",
+                             key_columns=self.current_pk)
     
     def clear_filters(self):
         """Сброс всех фильтров"""
         self.search_input.clear()
+        self.search_timer.stop()
         self.filter_value.clear()
-        self.load_table()
+        self.current_filter = None
+        self.filter_conditions = []
+        self.filter_label.setText("")
+        self.saved_filter_combo.setCurrentIndex(0)
+        self.current_search = None
+        self.filtered = False
+        self.reload_view()
     
     def add_record(self):
         """Добавление новой записи"""
         self.show_edit_dialog()
     
     def edit_record(self):
-        """Редактирование выбранной записи"""
-        selected_row = self.table.currentRow()
-        if selected_row < 0:
+        """Редактирование выбранных записей.
+        
+        Текущие значения и версии строк читаются из БД, а не берутся из
+        таблицы на экране: они могли измениться после ее загрузки.
+        """
+        rows = sorted({index.row() for index in self.table.selectionModel().selectedRows()})
+        if not rows and self.table.currentIndex().row() >= 0:
+            rows = [self.table.currentIndex().row()]
+        if not rows:
             QMessageBox.warning(self.window, "Предупреждение", "Выберите запись для редактирования")
             return
-            
-        self.show_edit_dialog(selected_row)
+        if self.current_table not in self.schema:
+            QMessageBox.warning(self.window, "Предупреждение", "Структура таблицы еще не загружена")
+            return
+        if not self.current_pk:
+            QMessageBox.warning(self.window, "Предупреждение", 
+                f"У таблицы {self.current_table} нет первичного ключа")
+            return
+        
+        table = self.schema.table(self.current_table)
+        if self.offline and table.name not in self.mirror:
+            QMessageBox.warning(self.window, "Предупреждение", 
+                f"Нет связи с БД, а таблицы {table.name} нет в локальной копии")
+            return
+        # Вытесненные из памяти строки дочитываются в фоне
+        self.model.load_rows(
+            rows, lambda loaded: self.read_for_edit(table, [self.row_key(row) for row in loaded]),
+            on_error=lambda e: self.show_db_error("Ошибка чтения записи", e))
+    
+    def read_for_edit(self, table, keys):
+        """Чтение строк по ключам и открытие диалога редактирования"""
+        from edits import read_rows
+        if table.name != self.current_table:
+            return
+        
+        def on_read(states):
+            if table.name != self.current_table:
+                return
+            if not states:
+                QMessageBox.warning(self.window, "Предупреждение", 
+                    "Запись удалена другим пользователем")
+                self.reload_view()
+                return
+            self.show_edit_dialog(states)
+        
+        if self.offline:
+            # Без связи строки берутся из копии; версия строк в ней неизвестна
+            read, conn = (lambda conn: self.mirror.read_rows(table, keys)), (lambda: None)
+        else:
+            read, conn = (lambda conn: read_rows(conn, table, keys)), None
+        self.runner.submit(
+            read,
+            on_result=on_read,
+            on_error=lambda e: self.show_db_error("Ошибка чтения записи", e),
+            description="Чтение записи",
+            conn=conn)
+    
+    def toggle_select_all(self, checked):
+        """Выбор всех строк, подходящих под фильтр и поиск"""
+        if checked:
+            self.table.selectAll()
+            self.status_label.setText("Выбраны все записи" + (" по фильтру" if self.filtered else ""))
+        else:
+            self.table.clearSelection()
+    
+    def selection_target(self, on_target):
+        """Выбранные строки: on_target((ключи, условие, параметры)).
+        
+        При выборе всех по фильтру ключи - None и строки отбираются
+        условием текущего фильтра на сервере. Ключи строк, вытесненных из
+        памяти, дочитываются в фоне. Возвращает False, если ничего не
+        выбрано.
+        """
+        if self.select_all_btn.isChecked():
+            condition = self.current_condition()
+            on_target((None,) + (condition if condition is not None else (None, [])))
+            return True
+        rows = sorted({index.row() for index in self.table.selectionModel().selectedRows()})
+        if not rows:
+            return False
+        table_name = self.current_table
+        
+        def on_loaded(loaded):
+            if table_name == self.current_table:
+                on_target(([self.row_key(row) for row in loaded], None, []))
+        
+        self.model.load_rows(rows, on_loaded,
+                             on_error=lambda e: self.show_db_error("Ошибка чтения записей", e))
+        return True
+    
+    def confirm_batch(self, target, question, action):
+        """Подтверждение группового изменения с числом затронутых строк.
+        
+        question - текст вопроса с {} на месте числа строк; action(число
+        строк) выполняется после подтверждения.
+        """
+        from batch import count_rows
+        keys, condition, params = target
+        table_name = self.current_table
+        
+        def ask(count):
+            if count == 0:
+                QMessageBox.information(self.window, "Подтверждение", "Нет подходящих записей")
+                return
+            reply = QMessageBox.question(
+                self.window, "Подтверждение", question.format(count),
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+            if reply == QMessageBox.StandardButton.Yes and table_name == self.current_table:
+                action(count)
+        
+        if keys is not None:
+            ask(len(keys))
+            return
+        self.runner.submit(
+            lambda conn: count_rows(conn, table_name, condition, params),
+            on_result=ask,
+            on_error=lambda e: self.show_db_error("Ошибка подсчета записей", e),
+            description="Подсчет записей",
+            dialog_parent=self.window,
+            readonly=True)
+    
+    def run_batch(self, fn, count, description, done_message, changed):
+        """Выполнение группового изменения порциями и одно обновление таблицы в конце.
+        
+        fn(conn, progress) возвращает число измененных строк; changed -
+        таблицы, которые могут измениться.
+        """
+        # Оповещения о каждой порции не обрабатываются - таблица
+        # перечитывается один раз по завершении
+        self.batch_table = self.current_table
+        
+        def finish():
+            self.batch_table = None
+            self.query_cache.invalidate(*changed)
+            self.reload_view()
+        
+        def on_done(rows):
+            finish()
+            self.status_label.setText(done_message.format(rows))
+        
+        def on_error(e):
+            # Порции, выполненные до ошибки или отмены, уже зафиксированы
+            finish()
+            self.show_db_error(f"Ошибка: {description.lower()}", e)
+        
+        self.runner.submit(
+            fn,
+            on_result=on_done,
+            on_error=on_error,
+            on_progress=lambda done, total: self.status_label.setText(
+                f"{description}: {done} из {count}"),
+            description=description,
+            dialog_parent=self.window,
+            writes=True)
     
     def delete_record(self):
-        """Удаление выбранной записи"""
-        selected_row = self.table.currentRow()
-        if selected_row < 0:
+        """Удаление выбранных записей (или всех, подходящих под фильтр)"""
+        if not self.current_pk:
+            QMessageBox.warning(self.window, "Предупреждение", 
+                f"У таблицы {self.current_table} нет первичного ключа")
+            return
+        if not self.selection_target(self.confirm_delete):
             QMessageBox.warning(self.window, "Предупреждение", "Выберите запись для удаления")
+    
+    def confirm_delete(self, target):
+        """Подтверждение и удаление записей target (см. selection_target)"""
+        from batch import batch_delete
+        keys, condition, params = target
+        table_name, key_columns = self.current_table, list(self.current_pk)
+        # Удаление может затронуть ссылающиеся таблицы (каскад, обнуление ссылок)
+        changed = self.schema.dependent_tables(table_name)
+        
+        def delete(count):
+            self.run_batch(
+                lambda conn, progress: batch_delete(conn, table_name, key_columns, keys,
+                                                    condition, params, progress=progress),
+                count, "Удаление записей", "Удалено записей: {}", changed)
+        
+        self.confirm_batch(target, "Удалить записей: {}?", delete)
+    
+    def update_field(self):
+        """Запись значения поля во все выбранные записи"""
+        if not self.current_pk or self.current_table not in self.schema:
+            return
+        if not self.selection_target(self.ask_field_update):
+            QMessageBox.warning(self.window, "Предупреждение", "Выберите записи для изменения")
+    
+    def ask_field_update(self, target):
+        """Выбор поля и значения и запись его в записи target (см. selection_target)"""
+        from batch import batch_update
+        table = self.schema.table(self.current_table)
+        columns = [column.name for column in table.columns
+                   if table.editable(column.name) and not column.serial]
+        column, ok = QInputDialog.getItem(self.window, "Изменение поля", "Поле:", columns, 0, False)
+        if not ok:
+            return
+        value, ok = QInputDialog.getText(self.window, "Изменение поля",
+                                         f"Новое значение {column} (пусто - NULL):")
+        if not ok:
+            return
+        value = value.strip() or None
+        if value is None and not table.column(column).nullable:
+            QMessageBox.warning(self.window, "Предупреждение", f"Поле {column} обязательно")
             return
-            
-        reply = QMessageBox.question(
-            self.window, "Подтверждение",
-            "Вы уверены, что хотите удалить эту запись?",
-            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
-        )
         
-        if reply == QMessageBox.StandardButton.Yes:
-            try:
-                cursor = self.conn.cursor()
-                # Получаем имя первого столбца (обычно ID)
-                pk_column = self.table.horizontalHeaderItem(0).text()
-                pk_value = self.table.item(selected_row, 0).text()
-                
-                query = f"DELETE FROM {self.current_table} WHERE {pk_column} = %s"
-                cursor.execute(query, (pk_value,))
-                self.conn.commit()
-                
-                self.load_table()
-                self.status_label.setText("Запись удалена")
-                
-            except Exception as e:
-                self.conn.rollback()
-                QMessageBox.critical(self.window, "Ошибка", f"Ошибка удаления: {str(e)}")
+        keys, condition, params = target
+        key_columns = list(self.current_pk)
+        
+        def update(count):
+            self.run_batch(
+                lambda conn, progress: batch_update(conn, table.name, key_columns, column, value,
+                                                    keys, condition, params, progress=progress),
+                count, "Изменение записей", "Изменено записей: {}", [table.name])
+        
+        shown = "NULL" if value is None else value
+        self.confirm_batch(target, f"Записать {column} = {shown} в записей: {{}}?", update)
+    
+    @staticmethod
+    def execute_write(conn, query, params=None):
+        """Выполнение изменяющего запроса и фиксация транзакции (в фоновом потоке)"""
+        if query is not None:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+        conn.commit()
     
-    def show_edit_dialog(self, row_idx=None):
-        """Диалог добавления/редактирования записи"""
+    def show_edit_dialog(self, rows=None):
+        """Диалог добавления/редактирования записи.
+        
+        rows - строки для редактирования (edits.RowState); если их
+        несколько, между ними переходят кнопками, а сохраняются все
+        измененные строки одной транзакцией.
+        """
+        from edits import RowEdit
+        from fk_picker import ForeignKeyPicker
+        if self.current_table not in self.schema:
+            QMessageBox.warning(self.window, "Предупреждение", "Структура таблицы еще не загружена")
+            return
+        
         dialog = QDialog(self.window)
-        dialog.setWindowTitle("Добавить запись" if row_idx is None else "Редактировать запись")
+        dialog.setWindowTitle("Добавить запись" if rows is None else "Редактировать запись")
         dialog.setModal(True)
         
         layout = QVBoxLayout(dialog)
         
-        # Получаем информацию о столбцах
-        cursor = self.conn.cursor()
-        cursor.execute(f"""
-            SELECT column_name, data_type, is_nullable
-            FROM information_schema.columns 
-            WHERE table_name = '{self.current_table}'
-            ORDER BY ordinal_position
-        """)
-        columns = cursor.fetchall()
+        # Информация о столбцах берется из кэша структуры
+        table = self.schema.table(self.current_table)
         
         # Создаем поля ввода
         inputs = {}
         form_layout = QFormLayout()
         
-        for i, (col_name, col_type, is_nullable) in enumerate(columns):
+        for column in table.columns:
+            col_name, col_type = column.name, column.type
+            
             # Пропускаем автоинкрементные поля при добавлении
-            if row_idx is None and "serial" in col_type:
+            if rows is None and column.serial:
                 continue
                 
-            if "date" in col_type:
+            fk = table.foreign_key(col_name)
+            if fk is not None and len(fk.columns) == 1 and fk.ref_table in self.schema:
+                # Строка справочника ищется по мере ввода
+                input_widget = ForeignKeyPicker(self.runner, self.schema.table(fk.ref_table),
+                                                fk.ref_columns[0], self.search_mode,
+                                                mirror=self.mirror)
+            elif "date" in col_type:
                 input_widget = QDateEdit()
                 input_widget.setCalendarPopup(True)
+                if column.nullable:
+                    # Пустое значение - минимальная дата, она показывается пустой
+                    input_widget.setMinimumDate(QDate(1900, 1, 1))
+                    input_widget.setSpecialValueText(" ")
                 input_widget.setDate(QDate.currentDate())
             elif "numeric" in col_type or "int" in col_type:
                 input_widget = QLineEdit()
@@ -323,103 +1310,297 @@ class SimpleDBApp:
             else:
                 input_widget = QLineEdit()
             
-            inputs[col_name] = input_widget
-            form_layout.addRow(col_name, input_widget)
+            if fk is not None:
+                input_widget.setToolTip(f"Ссылка на {fk.ref_table}")
+            if rows is not None and not table.editable(col_name):
+                input_widget.setEnabled(False)
             
-            # Заполняем данные при редактировании
-            if row_idx is not None and i < len(self.current_data[row_idx]):
-                value = self.current_data[row_idx][i]
-                if value:
-                    if isinstance(input_widget, QDateEdit):
-                        try:
-                            date = QDate.fromString(str(value), "yyyy-MM-dd")
-                            input_widget.setDate(date)
-                        except:
-                            pass
-                    else:
-                        input_widget.setText(str(value))
+            inputs[col_name] = input_widget
+            # Обязательные поля отмечаются звездочкой
+            form_layout.addRow(f"{col_name} *" if column.required else col_name, input_widget)
         
         layout.addLayout(form_layout)
         
+        edits = [RowEdit(row) for row in rows or ()]
+        current = [0]  # номер показанной строки
+        
+        if len(edits) > 1:
+            nav_layout = QHBoxLayout()
+            prev_btn = QPushButton("◀")
+            next_btn = QPushButton("▶")
+            position_label = QLabel()
+            nav_layout.addWidget(prev_btn)
+            nav_layout.addWidget(position_label)
+            nav_layout.addStretch()
+            nav_layout.addWidget(next_btn)
+            layout.insertLayout(0, nav_layout)
+            
+            def show_row(i):
+                position_label.setText(f"Запись {i + 1} из {len(edits)}: "
+                                       f"{', '.join(map(str, edits[i].row.key))}")
+                prev_btn.setEnabled(i > 0)
+                next_btn.setEnabled(i < len(edits) - 1)
+                current[0] = i
+                self.fill_inputs(inputs, edits[i])
+            
+            def move(step):
+                # Изменения показанной строки запоминаются до перехода
+                try:
+                    self.collect_changes(inputs, table, edits[current[0]])
+                except FilterError as e:
+                    QMessageBox.warning(dialog, "Предупреждение", str(e))
+                    return
+                show_row(current[0] + step)
+            
+            prev_btn.clicked.connect(lambda: move(-1))
+            next_btn.clicked.connect(lambda: move(1))
+            show_row(0)
+        elif edits:
+            self.fill_inputs(inputs, edits[0])
+        
         # Кнопки
         button_box = QDialogButtonBox(
             QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
         )
-        button_box.accepted.connect(lambda: self.save_record(dialog, inputs, columns, row_idx))
+        button_box.accepted.connect(
+            lambda: self.save_record(dialog, inputs, table, edits, current[0]))
         button_box.rejected.connect(dialog.reject)
         
         layout.addWidget(button_box)
         dialog.resize(400, 300)
         dialog.exec()
     
-    def save_record(self, dialog, inputs, columns, row_idx):
-        """Сохранение записи"""
+    def fill_inputs(self, inputs, edit):
+        """Значения строки (с еще не сохраненными изменениями) в поля ввода"""
+        from fk_picker import ForeignKeyPicker
+        values = {**edit.row.values, **edit.changes}
+        for col_name, widget in inputs.items():
+            value = values.get(col_name)
+            if isinstance(widget, ForeignKeyPicker):
+                widget.set_value(value)
+            elif isinstance(widget, QDateEdit):
+                if value is None:
+                    widget.setDate(widget.minimumDate())
+                else:
+                    widget.setDate(QDate(value.year, value.month, value.day))
+            else:
+                widget.setText("" if value is None else str(value))
+    
+    @staticmethod
+    def read_input(widget, column):
+        """Значение поля ввода, приведенное к типу столбца (None - пусто).
+        
+        При неверном значении - FilterError.
+        """
+        from fk_picker import ForeignKeyPicker
+        if isinstance(widget, ForeignKeyPicker):
+            if widget.text().strip() and widget.value() is None:
+                raise FilterError(f"Выберите значение {column.name} из списка")
+            return widget.value()
+        if isinstance(widget, QDateEdit):
+            if widget.specialValueText() and widget.date() == widget.minimumDate():
+                return None
+            return parse_value(column, widget.date().toString("yyyy-MM-dd"))
+        if not widget.text().strip():
+            return None
+        return parse_value(column, widget.text())
+    
+    def collect_changes(self, inputs, table, edit):
+        """Запоминание в edit полей, значения которых изменены в полях ввода"""
+        from edits import changed_fields
+        values = {col_name: self.read_input(widget, table.column(col_name))
+                  for col_name, widget in inputs.items() if table.editable(col_name)}
+        edit.changes = changed_fields(edit.row, values)
+    
+    def save_record(self, dialog, inputs, table, edits, current=0):
+        """Сохранение записи.
+        
+        При редактировании записываются только измененные поля (см.
+        edits.save_edits).
+        """
         try:
-            cursor = self.conn.cursor()
-            
-            if row_idx is None:
-                # Добавление
-                fields = []
-                values = []
-                placeholders = []
-                
-                for col_name, col_type, is_nullable in columns:
-                    if col_name in inputs:
-                        widget = inputs[col_name]
-                        value = None
-                        
-                        if isinstance(widget, QDateEdit):
-                            value = widget.date().toString("yyyy-MM-dd")
-                        elif widget.text():
-                            value = widget.text()
-                        
-                        if value is not None:
-                            fields.append(col_name)
-                            values.append(value)
-                            placeholders.append("%s")
-                
-                if fields:
-                    query = f"INSERT INTO {self.current_table} ({','.join(fields)}) VALUES ({','.join(placeholders)})"
-                    cursor.execute(query, values)
-                    
+            if edits:
+                self.collect_changes(inputs, table, edits[current])
             else:
-                # Редактирование
-                pk_column = columns[0][0]
-                pk_value = self.current_data[row_idx][0]
-                
-                set_clause = []
-                values = []
-                
-                for col_name, col_type, is_nullable in columns:
-                    if col_name in inputs and col_name != pk_column:
-                        widget = inputs[col_name]
-                        value = None
-                        
-                        if isinstance(widget, QDateEdit):
-                            value = widget.date().toString("yyyy-MM-dd")
-                        elif widget.text():
-                            value = widget.text()
-                        
-                        if value is not None:
-                            set_clause.append(f"{col_name} = %s")
-                            values.append(value)
-                
-                if set_clause:
-                    values.append(pk_value)
-                    query = f"UPDATE {self.current_table} SET {', '.join(set_clause)} WHERE {pk_column} = %s"
-                    cursor.execute(query, values)
-            
-            self.conn.commit()
-            self.load_table()
+                values = {col_name: self.read_input(widget, table.column(col_name))
+                          for col_name, widget in inputs.items()}
+        except FilterError as e:
+            QMessageBox.warning(dialog, "Предупреждение", str(e))
+            return
+        
+        if edits:
+            changed = [edit for edit in edits if edit.changes]
+            if not changed:
+                dialog.accept()
+                self.status_label.setText("Изменений нет")
+                return
+            self.submit_edits(dialog, table, changed)
+            return
+        
+        # Добавление: пустые поля не указываются - для них действуют значения по умолчанию
+        fields = [col_name for col_name in table.column_names()
+                  if values.get(col_name) is not None]
+        query = None
+        if fields:
+            query = sql.SQL("INSERT INTO {} ({}) VALUES ({})").format(
+                sql.Identifier(table.name),
+                sql.SQL(",").join(map(sql.Identifier, fields)),
+                sql.SQL(",").join(sql.Placeholder() for _ in fields))
+        params = [values[col_name] for col_name in fields]
+        inserted = dict(zip(fields, params))
+        if self.offline and self.mirror is not None:
+            self.queue_write(dialog, table, values=inserted)
+            return
+        
+        def on_saved(result):
+            self.after_write(table.name)
             dialog.accept()
             self.status_label.setText("Запись сохранена")
-            
-        except Exception as e:
-            self.conn.rollback()
-            QMessageBox.critical(dialog, "Ошибка", f"Ошибка сохранения: {str(e)}")
+        
+        def on_error(e):
+            if not self.offer_queue_write(dialog, e, table, values=inserted):
+                self.show_db_error("Ошибка сохранения", e, dialog)
+        
+        self.runner.submit(
+            lambda conn: self.execute_write(conn, query, params),
+            on_result=on_saved,
+            on_error=on_error,
+            description="Сохранение записи",
+            dialog_parent=dialog,
+            writes=True)
+    
+    def submit_edits(self, dialog, table, edits):
+        """Запись изменений строк одной транзакцией (в фоне)"""
+        from edits import EditConflict, save_edits
+        if self.offline and self.mirror is not None:
+            self.queue_write(dialog, table, edits=edits)
+            return
+        
+        def on_saved(count):
+            self.after_write(table.name)
+            dialog.accept()
+            self.status_label.setText(
+                "Запись сохранена" if count == 1 else f"Сохранено записей: {count}")
+        
+        def on_error(e):
+            if isinstance(e, EditConflict):
+                self.resolve_conflicts(dialog, table, edits, e.conflicts)
+            elif not self.offer_queue_write(dialog, e, table, edits=edits):
+                self.show_db_error("Ошибка сохранения", e, dialog)
+        
+        self.runner.submit(
+            lambda conn: save_edits(conn, table, edits),
+            on_result=on_saved,
+            on_error=on_error,
+            description="Сохранение записи",
+            dialog_parent=dialog,
+            writes=True)
+    
+    def offer_queue_write(self, dialog, error, table, edits=None, values=None):
+        """Предложение отложить запись, если нет связи с БД и есть локальная копия.
+        
+        Возвращает False, если ошибка не связана с отсутствием связи.
+        """
+        if self.mirror is None or not is_connection_error(error):
+            return False
+        reply = QMessageBox.question(dialog, "Нет связи с БД",
+            f"{error}\n\nОтложить изменения и отправить их позже?")
+        if reply == QMessageBox.StandardButton.Yes:
+            self.queue_write(dialog, table, edits, values)
+        return True
+    
+    def queue_write(self, dialog, table, edits=None, values=None):
+        """Запись изменений (edits) или новой строки (values) в очередь локальной копии"""
+        if edits:
+            self.mirror.queue_edits(table, edits)
+        else:
+            self.mirror.queue_insert(table, values)
+        dialog.accept()
+        self.status_label.setText(f"Изменения отложены, в очереди: {self.mirror.queued()}")
+        if edits and self.use_mirror():
+            # Измененные строки уже записаны в копию
+            self.reload_view()
+    
+    def resolve_conflicts(self, dialog, table, edits, conflicts):
+        """Объединение изменений с записанными другим пользователем.
+        
+        Поля, измененные только одной стороной, объединяются сами; для
+        полей, которые изменены обеими, пользователь выбирает значение.
+        Затем изменения записываются заново поверх текущих строк. При
+        отмене изменения остаются как были - следующее сохранение снова
+        найдет конфликт, а не перезапишет чужие значения.
+        """
+        choices = []  # (изменение поверх текущей строки, поле, выбор)
+        deleted = []
+        merged = []  # (изменение, оно же поверх текущей строки)
+        for conflict in conflicts:
+            edit = conflict.edit
+            if conflict.current is None:
+                deleted.append(edit)
+                continue
+            rebased, fields = conflict.merge()
+            merged.append((edit, rebased))
+            for col_name, (mine, theirs) in fields.items():
+                choices.append((rebased, col_name, mine, theirs))
+        
+        if deleted:
+            QMessageBox.warning(dialog, "Конфликт изменений", 
+                f"Записи удалены другим пользователем: "
+                f"{'; '.join(', '.join(map(str, edit.row.key)) for edit in deleted)}")
+        
+        if choices:
+            merge_dialog = QDialog(dialog)
+            merge_dialog.setWindowTitle("Конфликт изменений")
+            merge_layout = QVBoxLayout(merge_dialog)
+            merge_layout.addWidget(QLabel(
+                "Эти поля изменил другой пользователь после того, как вы открыли запись.\n"
+                "Выберите значения, которые нужно сохранить."))
+            form = QFormLayout()
+            combos = []
+            for edit, col_name, mine, theirs in choices:
+                combo = QComboBox()
+                combo.addItem(f"Мое: {'пусто' if mine is None else mine}")
+                combo.addItem(f"Текущее: {'пусто' if theirs is None else theirs}")
+                label = col_name if len(edits) == 1 else \
+                    f"{', '.join(map(str, edit.row.key))}: {col_name}"
+                form.addRow(label, combo)
+                combos.append(combo)
+            merge_layout.addLayout(form)
+            buttons = QDialogButtonBox(
+                QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+            buttons.accepted.connect(merge_dialog.accept)
+            buttons.rejected.connect(merge_dialog.reject)
+            merge_layout.addWidget(buttons)
+            if merge_dialog.exec() != QDialog.DialogCode.Accepted:
+                # Диалог редактирования остается открытым с прочитанными ранее строками
+                self.status_label.setText("Сохранение отменено")
+                return
+            for (rebased, col_name, mine, theirs), combo in zip(choices, combos):
+                if combo.currentIndex() == 1:
+                    del rebased.changes[col_name]
+        
+        for edit in deleted:
+            edit.changes = {}
+        for edit, rebased in merged:
+            edit.row, edit.changes = rebased.row, rebased.changes
+        
+        changed = [edit for edit in edits if edit.changes]
+        if not changed:
+            self.after_write(table.name)
+            dialog.accept()
+            self.status_label.setText("Изменений нет: записи уже содержат эти значения")
+            return
+        if merged:
+            self.status_label.setText("Изменения объединены с изменениями другого пользователя")
+        self.submit_edits(dialog, table, changed)
     
     def complex_form(self):
         """Сложная форма: ремонт + запчасти (1:М)"""
+        from fk_picker import ForeignKeyPicker
+        if not all(name in self.schema for name in ("cars", "faults", "teams")):
+            QMessageBox.warning(self.window, "Предупреждение", "Структура таблиц еще не загружена")
+            return
+        
         dialog = QDialog(self.window)
         dialog.setWindowTitle("Добавление ремонта с запчастями")
         dialog.setModal(True)
@@ -434,22 +1615,11 @@ class SimpleDBApp:
         repair_tab = QWidget()
         repair_layout = QFormLayout(repair_tab)
         
-        # Выбор автомобиля
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT car_id, body_number, owner FROM cars ORDER BY owner")
-        cars = cursor.fetchall()
-        
-        car_combo = QComboBox()
-        for car_id, body_number, owner in cars:
-            car_combo.addItem(f"{owner} ({body_number})", car_id)
-        
-        # Выбор неисправности
-        cursor.execute("SELECT fault_id, name, work_cost FROM faults ORDER BY name")
-        faults = cursor.fetchall()
-        
-        fault_combo = QComboBox()
-        for fault_id, name, cost in faults:
-            fault_combo.addItem(f"{name} ({cost} руб.)", fault_id)
+        # Строки справочников ищутся по мере ввода, а не загружаются целиком
+        car_picker = ForeignKeyPicker(self.runner, self.schema.table("cars"), "car_id",
+                                      self.search_mode, mirror=self.mirror)
+        fault_picker = ForeignKeyPicker(self.runner, self.schema.table("faults"), "fault_id",
+                                        self.search_mode, mirror=self.mirror)
         
         # Даты
         admission_date = QDateEdit()
@@ -460,20 +1630,15 @@ class SimpleDBApp:
         completion_date.setDate(QDate.currentDate().addDays(1))
         completion_date.setCalendarPopup(True)
         
-        # Выбор бригады
-        cursor.execute("SELECT team_id, name FROM teams ORDER BY name")
-        teams = cursor.fetchall()
-        
-        team_combo = QComboBox()
-        team_combo.addItem("Не назначена", None)
-        for team_id, name in teams:
-            team_combo.addItem(name, team_id)
+        team_picker = ForeignKeyPicker(self.runner, self.schema.table("teams"), "team_id",
+                                       self.search_mode, mirror=self.mirror)
+        team_picker.setPlaceholderText("Не назначена")
         
-        repair_layout.addRow("Автомобиль:", car_combo)
-        repair_layout.addRow("Неисправность:", fault_combo)
+        repair_layout.addRow("Автомобиль:", car_picker)
+        repair_layout.addRow("Неисправность:", fault_picker)
         repair_layout.addRow("Дата поступления:", admission_date)
         repair_layout.addRow("Дата завершения:", completion_date)
-        repair_layout.addRow("Бригада:", team_combo)
+        repair_layout.addRow("Бригада:", team_picker)
         
         # Вкладка 2: Запчасти
         parts_tab = QWidget()
@@ -523,57 +1688,443 @@ class SimpleDBApp:
             QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
         )
         
-        def save_complex():
-            try:
-                cursor = self.conn.cursor()
-                
-                # 1. Сохраняем ремонт
-                car_id = car_combo.currentData()
-                fault_id = fault_combo.currentData()
-                admission = admission_date.date().toString("yyyy-MM-dd")
-                completion = completion_date.date().toString("yyyy-MM-dd")
-                team_id = team_combo.currentData()
-                
-                query = """
-                    INSERT INTO car_repair 
-                    (car_id, fault_id, admission_date, completion_date, team_id)
-                    VALUES (%s, %s, %s, %s, %s) RETURNING repair_id
-                """
-                
-                cursor.execute(query, (car_id, fault_id, admission, completion, team_id))
-                # repair_id = cursor.fetchone()[0]
-                
-                # 2. Сохраняем запчасти
-                for row in range(parts_table.rowCount()):
-                    name = parts_table.item(row, 0).text()
-                    price = parts_table.item(row, 1).text()
-                    quantity = parts_table.item(row, 2).text()
-                    
-                    if name and price and quantity:
-                        query = """
-                            INSERT INTO spare_parts 
-                            (car_id, fault_id, name, price, quantity)
-                            VALUES (%s, %s, %s, %s, %s)
-                        """
-                        cursor.execute(query, (car_id, fault_id, name, price, quantity))
-                
-                self.conn.commit()
-                self.load_table()
-                dialog.accept()
-                self.status_label.setText("Ремонт с запчастями сохранен")
+        def read_order():
+            parts = []
+            for row in range(parts_table.rowCount()):
+                name = parts_table.item(row, 0).text()
+                price = parts_table.item(row, 1).text()
+                quantity = parts_table.item(row, 2).text()
                 
-            except Exception as e:
-                self.conn.rollback()
-                QMessageBox.critical(dialog, "Ошибка", f"Ошибка сохранения: {str(e)}")
+                if name and price and quantity:
+                    parts.append((name, price.replace(",", "."), quantity))
+            
+            if (car_picker.value() is None or fault_picker.value() is None
+                    or (team_picker.text().strip() and team_picker.value() is None)):
+                QMessageBox.warning(dialog, "Предупреждение",
+                    "Выберите автомобиль, неисправность и бригаду из списка")
+                return None
+            
+            try:
+                return RepairOrder(
+                    car_id=car_picker.value(),
+                    fault_id=fault_picker.value(),
+                    admission_date=admission_date.date().toString("yyyy-MM-dd"),
+                    completion_date=completion_date.date().toString("yyyy-MM-dd"),
+                    team_id=team_picker.value(),
+                    parts=parts)
+            except (ArithmeticError, ValueError):
+                QMessageBox.warning(dialog, "Предупреждение", 
+                    "Цена и количество запчастей должны быть числами")
+                return None
+        
+        def queue_order(order):
+            self.order_queue.append(order)
+            dialog.accept()
+            self.status_label.setText(
+                f"Ремонт отложен, в очереди: {len(self.order_queue)}")
         
+        def save_complex():
+            order = read_order()
+            if order is None:
+                return
+            
+            def on_saved(repair_ids):
+                self.after_write("car_repair", "spare_parts")
+                dialog.accept()
+                self.status_label.setText(f"Ремонт №{repair_ids[0]} с запчастями сохранен")
+            
+            def on_error(e):
+                if is_connection_error(e):
+                    reply = QMessageBox.question(dialog, "Нет связи с БД",
+                        f"{e}\n\nОтложить ремонт и отправить его позже?")
+                    if reply == QMessageBox.StandardButton.Yes:
+                        queue_order(order)
+                    return
+                self.show_db_error("Ошибка сохранения", e, dialog)
+            
+            # Ремонт и запчасти пишутся одним запросом
+            self.runner.submit(
+                lambda conn: save_orders(conn, [order], self.link_parts_to_repairs()),
+                on_result=on_saved,
+                on_error=on_error,
+                description="Сохранение ремонта",
+                dialog_parent=dialog,
+                writes=True)
+        
+        def postpone_complex():
+            order = read_order()
+            if order is not None:
+                queue_order(order)
+        
+        postpone_btn = button_box.addButton("Отложить", QDialogButtonBox.ButtonRole.ActionRole)
+        postpone_btn.setToolTip("Сохранить ремонт в очередь для отправки позже")
+        postpone_btn.clicked.connect(postpone_complex)
         button_box.accepted.connect(save_complex)
         button_box.rejected.connect(dialog.reject)
         
         layout.addWidget(button_box)
         dialog.exec()
     
+    def after_write(self, *tables):
+        """Обновление таблицы после записи в БД в таблицы tables"""
+        self.query_cache.invalidate(*tables)
+        # При обновлении в реальном времени измененные строки придут
+        # оповещением, иначе таблица перечитывается целиком
+        reload = not (self.live_updates and self.listener.is_active())
+        if self.mirror is not None and any(name in self.mirror.tables for name in tables):
+            # Записанное сразу переносится в локальную копию; таблица из
+            # копии перечитывается после синхронизации
+            from_mirror = self.use_mirror()
+            self.sync_mirror(self.reload_view if reload and from_mirror else None)
+            if from_mirror:
+                return
+        if reload:
+            self.reload_view()
+    
+    def sync_mirror(self, on_synced=None):
+        """Отправка отложенных изменений и синхронизация локальной копии (в фоне).
+        
+        on_synced вызывается после синхронизации, начатой позже вызова:
+        текущая могла не увидеть только что записанные строки.
+        """
+        if on_synced is not None:
+            self.mirror_callbacks.append(on_synced)
+        if self.mirror_syncing:
+            self.mirror_resync = True
+            return
+        self.mirror_syncing = True
+        self.mirror_resync = False
+        callbacks, self.mirror_callbacks = self.mirror_callbacks, []
+        mirror = self.mirror
+        
+        def sync(conn):
+            replayed = mirror.replay(conn, self.schema) if mirror.queued() else (0, 0)
+            return replayed, mirror.sync(conn, self.schema)
+        
+        def finish():
+            self.mirror_syncing = False
+            if self.mirror_resync:
+                self.sync_mirror()
+        
+        def on_result(result):
+            (sent, conflicts), received = result
+            finish()
+            if self.offline:
+                # Связь восстановлена - окно возвращается к работе с БД
+                self.on_connected(None)
+            if sent:
+                self.query_cache.clear()
+                self.status_label.setText(
+                    f"Отправлено отложенных изменений: {sent}, конфликтов: {conflicts}")
+                if self.use_mirror():
+                    self.reload_view()
+            for callback in callbacks:
+                callback()
+        
+        def on_error(e):
+            mirror.sync_failed(e)
+            finish()
+            if not self.offline and not is_connection_error(e) and not is_cancelled(e):
+                self.status_label.setText(f"Ошибка синхронизации локальной копии: {e}")
+        
+        # Запись на сервер - только отправка отложенных изменений
+        self.runner.submit(sync, on_result=on_result, on_error=on_error,
+                           description="Синхронизация локальной копии", writes=mirror.queued())
+    
+    def show_mirror_status(self):
+        """Состояние локальной копии: таблицы, отставание, очередь, конфликты"""
+        from mirror import age_label
+        if self.mirror is None:
+            QMessageBox.information(self.window, "Локальная копия",
+                "Локальная копия не настроена: укажите таблицы в параметре mirror_tables "
+                "файла car_service.ini")
+            return
+        status = self.mirror.status()
+        
+        dialog = QDialog(self.window)
+        dialog.setWindowTitle("Локальная копия")
+        dialog.resize(600, 350)
+        layout = QVBoxLayout(dialog)
+        
+        tables = QTableWidget(len(status.tables), 4)
+        tables.setHorizontalHeaderLabels(["Таблица", "Строк", "Синхронизирована", "Обновление"])
+        tables.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        for row, (name, rows, synced_at, logged) in enumerate(status.tables):
+            tables.setItem(row, 0, QTableWidgetItem(name))
+            tables.setItem(row, 1, QTableWidgetItem(str(rows)))
+            tables.setItem(row, 2, QTableWidgetItem(age_label(time.time() - synced_at)))
+            tables.setItem(row, 3, QTableWidgetItem(
+                "по журналу изменений" if logged else "целиком"))
+        tables.resizeColumnsToContents()
+        layout.addWidget(tables)
+        
+        stats = status.stats
+        lag = status.lag()
+        info = [
+            f"Отставание: {age_label(lag) if lag is not None else 'копия не загружена'}"
+            + (" (нет связи с БД)" if self.offline else ""),
+            f"Синхронизаций: {stats.get('syncs', 0)}, получено строк: {stats.get('received', 0)}",
+            f"Отложенных изменений: {status.queued}, отправлено: {stats.get('replayed', 0)}",
+            f"Конфликтов при отправке: {stats.get('conflicts', 0)}",
+        ]
+        if stats.get("last_conflict"):
+            info.append(f"Последний конфликт: {stats['last_conflict']}")
+        if stats.get("last_error"):
+            info.append(f"Ошибка синхронизации: {stats['last_error']}")
+        label = QLabel("\n".join(info))
+        label.setWordWrap(True)
+        layout.addWidget(label)
+        
+        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        sync_btn = button_box.addButton("Синхронизировать", QDialogButtonBox.ButtonRole.ActionRole)
+        
+        def sync_now():
+            dialog.accept()
+            self.sync_mirror(self.reload_view if self.use_mirror() else None)
+        
+        sync_btn.clicked.connect(sync_now)
+        button_box.rejected.connect(dialog.reject)
+        layout.addWidget(button_box)
+        dialog.exec()
+    
+    def check_live_updates(self):
+        """Проверка наличия триггеров оповещения об изменениях"""
+        def on_checked(installed):
+            self.live_updates = installed
+        
+        self.runner.submit(
+            notify_triggers_installed,
+            on_result=on_checked,
+            on_error=lambda e: None,
+            description="Проверка триггеров оповещения",
+            readonly=True)
+    
+    def show_diagnostics(self):
+        """Панель с журналом запросов, их временем и планами"""
+        from diagnostics import DiagnosticsDock
+        if self.diagnostics is None:
+            self.diagnostics = DiagnosticsDock(self.runner, self.query_cache, self.window)
+            self.window.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, self.diagnostics)
+        self.diagnostics.show()
+        self.diagnostics.raise_()
+    
+    def on_table_changed(self, table_name, op, keys, old_keys):
+        """Оповещение об изменении строк: правка только затронутых строк таблицы"""
+        self.query_cache.invalidate(table_name)
+        if (table_name != self.current_table or not self.current_pk
+                or table_name == self.batch_table):
+            return
+        if op == "RELOAD":
+            self.reload_view()
+            return
+        
+        if op == "UPDATE" and old_keys:
+            # Изменился ключ строки (например, дата ремонта в секционированной
+            # таблице) - положение строки в таблице меняется
+            self.reload_view()
+            return
+        
+        view_version = self.view_version
+        table = self.schema.table(table_name)
+        key_types = [table.column(col).type for col in self.current_pk]
+        
+        def fetch_rows(conn):
+            cursor = conn.cursor()
+            # Значения ключей из JSON приводятся к типам столбцов
+            all_keys = [tuple(key) for key in keys + old_keys]
+            if all_keys:
+                cursor.execute(*typed_keys_query(key_types, all_keys))
+                all_keys = cursor.fetchall()
+            typed_keys, typed_old_keys = all_keys[:len(keys)], all_keys[len(keys):]
+            if not typed_keys:
+                return [], typed_keys, typed_old_keys
+            condition, params = key_in_condition(self.current_pk, typed_keys)
+            current = self.current_condition()
+            if current is not None:
+                condition = sql.SQL("({}) AND {}").format(current[0], condition)
+                params = list(current[1]) + params
+            cursor.execute(sql.SQL("SELECT * FROM {} WHERE {}").format(
+                sql.Identifier(table_name), condition), params)
+            return cursor.fetchall(), typed_keys, typed_old_keys
+        
+        def on_fetched(result):
+            if view_version != self.view_version:
+                return
+            rows, keys, old_keys = result
+            # Строки, которые больше не подходят под фильтр, скрываются
+            found = {self.row_key(row) for row in rows}
+            removed = old_keys + [key for key in keys if key not in found]
+            self.model.apply_changes(rows, removed, insert_missing=(op == "INSERT"))
+            self.update_row_count()
+        
+        self.runner.submit(
+            fetch_rows,
+            on_result=on_fetched,
+            # Не удалось прочитать строки - перечитываем таблицу целиком
+            on_error=lambda e: None if is_cancelled(e) else self.reload_view(),
+            description="Обновление измененных строк")
+    
+    def import_csv(self):
+        """Загрузка CSV-файла в текущую таблицу"""
+        from transfer import import_table, read_header
+        if self.current_table not in self.schema:
+            return
+        table = self.schema.table(self.current_table)
+        path, _ = QFileDialog.getOpenFileName(
+            self.window, f"Импорт в {table.name}", "", "CSV (*.csv);;Все файлы (*)")
+        if not path:
+            return
+        
+        try:
+            with open(path, "rb") as f:
+                columns, delimiter = read_header(f)
+        except (OSError, UnicodeDecodeError) as e:
+            QMessageBox.critical(self.window, "Ошибка", f"Не удалось прочитать файл: {e}")
+            return
+        
+        # Режим: только добавление или обновление по уникальному ключу из файла
+        keys = [key for key in table.unique_keys if set(key) <= set(columns)]
+        modes = ["Только добавлять строки"] + [f"Обновлять по ключу: {', '.join(key)}" for key in keys]
+        mode, ok = QInputDialog.getItem(
+            self.window, "Импорт", f"Столбцы файла: {', '.join(columns)}\n\nРежим загрузки:",
+            modes, 0, False)
+        if not ok:
+            return
+        key = keys[modes.index(mode) - 1] if modes.index(mode) else None
+        
+        def load(conn, progress):
+            with open(path, "rb") as f:
+                return import_table(conn, table, f, key, delimiter, progress)
+        
+        def on_loaded(result):
+            inserted, updated = result
+            self.after_write(table.name)
+            QMessageBox.information(self.window, "Импорт", 
+                f"Таблица {table.name}: добавлено {inserted}, обновлено {updated}")
+        
+        self.runner.submit(
+            load,
+            on_result=on_loaded,
+            on_error=lambda e: self.show_db_error("Ошибка импорта", e),
+            on_progress=lambda done, total: self.status_label.setText(
+                f"Импорт: {done * 100 // total if total else 0}%"),
+            description=f"Импорт в {table.name}",
+            dialog_parent=self.window,
+            writes=True)
+    
+    def export_csv(self):
+        """Выгрузка текущей таблицы в CSV-файл"""
+        from transfer import export_table
+        if self.current_table not in self.schema:
+            return
+        table = self.schema.table(self.current_table)
+        path, _ = QFileDialog.getSaveFileName(
+            self.window, f"Экспорт {table.name}", f"{table.name}.csv", "CSV (*.csv)")
+        if not path:
+            return
+        
+        def unload(conn, progress):
+            with open(path, "wb") as f:
+                export_table(conn, table, f, progress=progress)
+        
+        self.runner.submit(
+            unload,
+            on_result=lambda result: self.status_label.setText(f"Таблица {table.name} выгружена в {path}"),
+            on_error=lambda e: self.show_db_error("Ошибка экспорта", e),
+            on_progress=lambda done, total: self.status_label.setText(
+                f"Экспорт: {done // 1024} КБ"),
+            description=f"Экспорт {table.name}",
+            dialog_parent=self.window,
+            readonly=True)
+    
+    def link_parts_to_repairs(self):
+        """Есть ли в spare_parts столбец repair_id (добавляется миграцией 0002)"""
+        return ("spare_parts" in self.schema
+                and self.schema.table("spare_parts").column("repair_id") is not None)
+    
+    def flush_order_queue(self):
+        """Отправка отложенных ремонтов одним пакетом"""
+        count = len(self.order_queue)
+        if not count:
+            QMessageBox.information(self.window, "Отложенные ремонты", "Очередь пуста")
+            return
+        
+        def flush(conn):
+            self.schema.check(conn)
+            return self.order_queue.flush(conn, self.link_parts_to_repairs())
+        
+        def on_flushed(repair_ids):
+            self.after_write("car_repair", "spare_parts")
+            self.status_label.setText(f"Отправлено отложенных ремонтов: {len(repair_ids)}")
+        
+        self.runner.submit(
+            flush,
+            on_result=on_flushed,
+            on_error=lambda e: self.show_db_error("Ошибка отправки отложенных ремонтов", e),
+            description=f"Отправка отложенных ремонтов ({count})",
+            dialog_parent=self.window,
+            writes=True)
+    
+    def check_report_rollups(self):
+        """Проверка наличия агрегатов для отчетов"""
+        from reports import rollups_installed
+        def on_checked(installed):
+            self.use_report_rollups = installed
+        
+        self.runner.submit(
+            rollups_installed,
+            on_result=on_checked,
+            # Без агрегатов отчеты строятся по исходным таблицам
+            on_error=lambda e: None,
+            description="Проверка агрегатов отчетов",
+            readonly=True)
+    
+    def check_partitions(self):
+        """Предупреждение о месяцах без секций car_repair.
+
+        Секции создает команда python cli.py partitions ensure (по
+        расписанию); приложение их только проверяет.
+        """
+        from partitions import missing_partitions
+        def on_checked(months):
+            if months:
+                listed = ", ".join(month.strftime("%m.%Y") for month in months)
+                QMessageBox.warning(self.window, "Секции car_repair",
+                    f"Нет секций car_repair за {listed}.\n"
+                    "Ремонты этих месяцев попадут в секцию по умолчанию. "
+                    "Выполните python cli.py partitions ensure (или настройте "
+                    "ее запуск по расписанию).")
+        
+        self.runner.submit(
+            missing_partitions,
+            on_result=on_checked,
+            on_error=lambda e: None,
+            description="Проверка секций car_repair",
+            readonly=True)
+    
+    def rebuild_report_rollups(self):
+        """Полный пересчет агрегатов отчетов"""
+        from reports import rebuild_rollups
+        if not self.use_report_rollups:
+            QMessageBox.information(self.window, "Агрегаты отчетов",
+                "Агрегаты отчетов не созданы: выполните python cli.py migrate")
+            return
+        
+        def on_rebuilt(result):
+            self.query_cache.clear()
+            self.status_label.setText("Агрегаты отчетов пересчитаны")
+        
+        self.runner.submit(
+            rebuild_rollups,
+            on_result=on_rebuilt,
+            on_error=lambda e: self.show_db_error("Ошибка пересчета агрегатов", e),
+            description="Пересчет агрегатов отчетов",
+            dialog_parent=self.window,
+            writes=True)
+    
     def show_reports(self):
         """Показ отчетов"""
+        from reports import REPORTS, report_params, report_query, verify_report
         dialog = QDialog(self.window)
         dialog.setWindowTitle("Отчеты")
         dialog.setModal(True)
@@ -583,11 +2134,7 @@ class SimpleDBApp:
         
         # Выбор отчета
         report_combo = QComboBox()
-        report_combo.addItems([
-            "1. Ремонты по датам",
-            "2. Бригады и персонал", 
-            "3. Финансовый отчет"
-        ])
+        report_combo.addItems([f"{i}. {report.title}" for i, report in enumerate(REPORTS, 1)])
         
         layout.addWidget(QLabel("Выберите отчет:"))
         layout.addWidget(report_combo)
@@ -619,91 +2166,34 @@ class SimpleDBApp:
         
         def generate_report():
             try:
-                report_type = report_combo.currentIndex()
-                
-                if report_type == 0:  # Ремонты по датам
-                    query = """
-                        SELECT 
-                            cr.admission_date,
-                            c.owner,
-                            c.body_number,
-                            f.name,
-                            f.work_cost,
-                            COALESCE(SUM(sp.price * sp.quantity), 0) as parts_cost,
-                            f.work_cost + COALESCE(SUM(sp.price * sp.quantity), 0) as total_cost
-                        FROM car_repair cr
-                        JOIN cars c ON cr.car_id = c.car_id
-                        JOIN faults f ON cr.fault_id = f.fault_id
-                        LEFT JOIN spare_parts sp ON cr.car_id = sp.car_id AND cr.fault_id = sp.fault_id
-                        WHERE cr.admission_date BETWEEN %s AND %s
-                        GROUP BY cr.admission_date, c.owner, c.body_number, f.name, f.work_cost
-                        ORDER BY cr.admission_date
-                    """
-                    
-                elif report_type == 1:  # Бригады и персонал
-                    query = """
-                        SELECT 
-                            t.name as team_name,
-                            COUNT(p.inn) as person_count,
-                            w.name as workshop_name,
-                            STRING_AGG(p.inn, ', ') as inn_list
-                        FROM teams t
-                        LEFT JOIN personnel p ON t.team_id = p.team_id
-                        LEFT JOIN workshops w ON p.workshop_id = w.workshop_id
-                        GROUP BY t.team_id, t.name, w.name
-                        ORDER BY person_count DESC
-                    """
-                    
-                else:  # Финансовый отчет
-                    query = """
-                        SELECT 
-                            TO_CHAR(cr.admission_date, 'YYYY-MM') as month,
-                            COUNT(*) as repair_count,
-                            SUM(f.work_cost) as work_total,
-                            COALESCE(SUM(sp.price * sp.quantity), 0) as parts_total,
-                            SUM(f.work_cost) + COALESCE(SUM(sp.price * sp.quantity), 0) as total_income
-                        FROM car_repair cr
-                        JOIN faults f ON cr.fault_id = f.fault_id
-                        LEFT JOIN spare_parts sp ON cr.car_id = sp.car_id AND cr.fault_id = sp.fault_id
-                        WHERE cr.admission_date BETWEEN %s AND %s
-                        GROUP BY TO_CHAR(cr.admission_date, 'YYYY-MM')
-                        ORDER BY month
-                    """
+                report = REPORTS[report_combo.currentIndex()]
+                query = report_query(report, self.use_report_rollups)
                 
-                cursor = self.conn.cursor()
-                
-                if report_type in [0, 2]:
-                    cursor.execute(query, (
-                        start_date.date().toString("yyyy-MM-dd"),
-                        end_date.date().toString("yyyy-MM-dd")
-                    ))
+                if report.dated:
+                    params = report_params(start_date.date().toPyDate(), end_date.date().toPyDate())
                 else:
-                    cursor.execute(query)
-                
-                data = cursor.fetchall()
+                    params = None
                 
                 # Показываем результат
                 result_dialog = QDialog(dialog)
                 result_dialog.setWindowTitle("Результат отчета")
                 result_dialog.resize(700, 500)
                 
-                result_layout = QVBoxLayout(result_dialog)
+                # Результат читается в фоне порциями через серверный курсор
+                model = QueryTableModel(self.runner, parent=result_dialog)
+                model.failed.connect(lambda e: self.show_db_error("Ошибка генерации отчета", e, result_dialog))
+                model.failed.connect(result_dialog.reject)
+                result_dialog.finished.connect(model.close)
+                # Повторный отчет с теми же параметрами берется из кэша
+                model.set_query(query, params, description="Формирование отчета",
+                                dialog_parent=result_dialog, cache=self.query_cache,
+                                cache_tables=report.tables)
                 
-                table = QTableWidget()
-                table.setRowCount(len(data))
+                result_layout = QVBoxLayout(result_dialog)
                 
-                if data:
-                    table.setColumnCount(len(data[0]))
-                    
-                    # Заголовки
-                    cursor.description
-                    headers = [desc[0] for desc in cursor.description]
-                    table.setHorizontalHeaderLabels(headers)
-                    
-                    # Данные
-                    for row_idx, row in enumerate(data):
-                        for col_idx, value in enumerate(row):
-                            table.setItem(row_idx, col_idx, QTableWidgetItem(str(value)))
+                table = QTableView()
+                table.setModel(model)
+                table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
                 
                 result_layout.addWidget(table)
                 
@@ -717,6 +2207,36 @@ class SimpleDBApp:
             except Exception as e:
                 QMessageBox.critical(dialog, "Ошибка", f"Ошибка генерации отчета: {str(e)}")
         
+        def verify():
+            report = REPORTS[report_combo.currentIndex()]
+            if report.rollup_query is None or not self.use_report_rollups:
+                QMessageBox.information(dialog, "Сверка", "Отчет строится по исходным таблицам")
+                return
+            params = report_params(start_date.date().toPyDate(), end_date.date().toPyDate())
+            
+            def on_verified(result):
+                count, missing, extra = result
+                if not missing and not extra:
+                    QMessageBox.information(dialog, "Сверка",
+                        f"Отчет по агрегатам совпадает с исходным запросом ({count} строк)")
+                    return
+                lines = [f"Нет в агрегатах: {len(missing)}, лишних строк: {len(extra)}"]
+                lines += [f"- {row}" for row in missing[:5]]
+                lines += [f"+ {row}" for row in extra[:5]]
+                QMessageBox.warning(dialog, "Сверка",
+                    "\n".join(lines) + "\n\nПересчитайте агрегаты: Сервис - Пересчитать агрегаты отчетов")
+            
+            self.runner.submit(
+                lambda conn: verify_report(conn, report, params),
+                on_result=on_verified,
+                on_error=lambda e: self.show_db_error("Ошибка сверки", e, dialog),
+                description="Сверка отчета с исходными данными",
+                dialog_parent=dialog,
+                readonly=True)
+        
+        verify_btn = button_box.addButton("Сверить с исходными данными",
+                                          QDialogButtonBox.ButtonRole.ActionRole)
+        verify_btn.clicked.connect(verify)
         button_box.accepted.connect(generate_report)
         button_box.rejected.connect(dialog.reject)
         
@@ -726,9 +2246,16 @@ class SimpleDBApp:
     def run(self):
         """Запуск приложения"""
         self.window.show()
-        sys.exit(self.app.exec())
+        self.profile.mark("Окно показано")
+        code = self.app.exec()
+        self.listener.stop()
+        self.runner.cancel()
+        self.runner.pool.waitForDone()
+        self.model.close()
+        self.db.close()
+        sys.exit(code)
 
 # Запуск приложения
 if __name__ == "__main__":
-    app = SimpleDBApp()
+    app = SimpleDBApp(profile="--profile-startup" in sys.argv)
     app.run()
\ No newline at end of file
@@ -0,0 +1,428 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from bench import BenchError, generate, run_benchmarks
+from db import Database, load_config
+from filters import AND, OR, Filter, FilterError, SavedFilters, filter_sql, parse_condition
+from migrations import (MigrationError, applied_versions, available_migrations, migrate,
+                        missing_fk_indexes, rollback)
+from mirror import age_label, open_mirror
+from partitions import (MONTHS_AHEAD, archive_partitions, ensure_partitions, list_partitions,
+                        partitioning_installed)
+from reports import (REPORT_FORMATS, REPORTS, ReportError, find_report, report_params,
+                     rollups_installed, stream_report)
+from schema import SchemaCache
+from transfer import TransferError, export_table, import_table
+
+
+class Progress:
+    """Вывод прогресса в stderr не чаще раза в секунду"""
+
+    def __init__(self, label):
+        self.label = label
+        self.started = time.monotonic()
+        self.shown = 0
+
+    def __call__(self, done, total):
+        now = time.monotonic()
+        if now - self.shown < 1:
+            return
+        self.shown = now
+        message = f"{self.label}: {done / 1048576:.1f} МБ"
+        if total:
+            message += f" из {total / 1048576:.1f} МБ ({done * 100 // total}%)"
+        print(f"\r{message}", end="", file=sys.stderr, flush=True)
+
+    def finish(self, message):
+        print(f"\r{self.label}: {message} за {time.monotonic() - self.started:.1f} с",
+              file=sys.stderr)
+
+
+def open_table(conn, schema, name):
+    schema.check(conn)
+    if name not in schema:
+        raise TransferError(f"Неизвестная таблица: {name}")
+    return schema.table(name)
+
+
+def read_filter(args, table_name):
+    """Фильтр из --filter (сохраненный) или --where/--or"""
+    if args.filter:
+        saved_table, flt = SavedFilters().get(args.filter)
+        if saved_table != table_name:
+            raise FilterError(f"Фильтр {args.filter} задан для таблицы {saved_table}")
+        return flt
+    return Filter(tuple(parse_condition(text) for text in args.where or ()),
+                  OR if args.any else AND)
+
+
+def add_filter_arguments(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--where", action="append", metavar="COND",
+                       help='условие "поле операция значение", например "car_id = 5", '
+                            '"admission_date between 2024-01-01..2024-03-31", '
+                            '"fault_id in 1,2,3", "owner prefix Иван", "leader is null" '
+                            '(можно повторять)')
+    group.add_argument("--filter", help="имя сохраненного фильтра")
+    parser.add_argument("--or", dest="any", action="store_true",
+                        help="объединять условия --where через OR (по умолчанию AND)")
+
+
+def cmd_export(db, schema, args):
+    columns = args.columns.split(",") if args.columns else None
+    with db.connection(readonly=True) as conn:
+        table = open_table(conn, schema, args.table)
+        condition = filter_sql(table, read_filter(args, table.name))
+        progress = Progress(f"Экспорт {args.table}")
+        if args.file == "-":
+            export_table(conn, table, sys.stdout.buffer, columns, args.delimiter, progress,
+                         condition)
+        else:
+            with open(args.file, "wb") as f:
+                export_table(conn, table, f, columns, args.delimiter, progress, condition)
+    progress.finish("готово")
+
+
+def cmd_filters(db, schema, args):
+    saved = SavedFilters()
+    if args.action == "list":
+        for name in saved.names(args.table):
+            table_name, flt = saved.get(name)
+            print(f"{name}\t{table_name}\t{flt.label()}")
+        return
+    if not args.name:
+        print("Укажите имя фильтра", file=sys.stderr)
+        return 1
+    if args.action == "delete":
+        if not saved.delete(args.name):
+            raise FilterError(f"Нет сохраненного фильтра {args.name}")
+        return
+    # save: условия проверяются по структуре таблицы до сохранения
+    if not args.table or not args.where:
+        print("Укажите --table и хотя бы одно условие --where", file=sys.stderr)
+        return 1
+    flt = read_filter(args, args.table)
+    with db.connection() as conn:
+        filter_sql(open_table(conn, schema, args.table), flt)
+    saved.save(args.name, args.table, flt)
+    print(f"Фильтр {args.name} сохранен: {flt.label()}", file=sys.stderr)
+
+
+def cmd_import(db, schema, args):
+    key = args.key.split(",") if args.key else None
+    with db.connection() as conn:
+        table = open_table(conn, schema, args.table)
+        progress = Progress(f"Импорт {args.table}")
+        if args.file == "-":
+            inserted, updated = import_table(conn, table, sys.stdin.buffer, key,
+                                             args.delimiter, progress)
+        else:
+            with open(args.file, "rb") as f:
+                inserted, updated = import_table(conn, table, f, key, args.delimiter, progress)
+    progress.finish(f"добавлено {inserted}, обновлено {updated}")
+
+
+def cmd_generate(db, schema, args):
+    started = time.monotonic()
+    with db.connection() as conn:
+        generate(conn, args.cars, args.seed, args.truncate,
+                 on_table=lambda table, rows: print(f"{table}: {rows} строк", file=sys.stderr))
+    print(f"Готово за {time.monotonic() - started:.1f} с", file=sys.stderr)
+
+
+def cmd_bench(db, schema, args):
+    def show(measurement):
+        summary = measurement.summary()
+        print(f"{summary['name']:<28} p50 {summary['p50_ms']:>9.1f} мс  "
+              f"p95 {summary['p95_ms']:>9.1f} мс  max {summary['max_ms']:>9.1f} мс",
+              file=sys.stderr)
+
+    with db.connection() as conn:
+        result = run_benchmarks(conn, schema, args.repeat, args.parts, on_result=show)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+def show_step(action):
+    return lambda migration: print(f"{action} {migration.version:04d}_{migration.name}",
+                                   file=sys.stderr)
+
+
+def cmd_migrate(db, schema, args):
+    with db.connection() as conn:
+        done = migrate(conn, args.to, on_step=show_step("Применение"))
+        if not done:
+            print("Схема БД актуальна", file=sys.stderr)
+        return report_fk_indexes(conn)
+
+
+def cmd_rollback(db, schema, args):
+    with db.connection() as conn:
+        target = args.to
+        if target is None:
+            # По умолчанию откатывается последняя примененная миграция
+            applied = applied_versions(conn)
+            target = applied[-2] if len(applied) > 1 else 0
+        done = rollback(conn, target, on_step=show_step("Откат"))
+        if not done:
+            print("Нечего откатывать", file=sys.stderr)
+
+
+def cmd_migrations(db, schema, args):
+    with db.connection() as conn:
+        applied = set(applied_versions(conn))
+    for migration in available_migrations():
+        mark = "+" if migration.version in applied else " "
+        print(f"[{mark}] {migration.version:04d}_{migration.name}")
+
+
+def cmd_check_indexes(db, schema, args):
+    with db.connection() as conn:
+        if report_fk_indexes(conn):
+            return 1
+    print("Все внешние ключи проиндексированы", file=sys.stderr)
+
+
+def cmd_partitions(db, schema, args):
+    with db.connection() as conn:
+        if not partitioning_installed(conn):
+            print("Таблица car_repair не секционирована (python cli.py migrate)", file=sys.stderr)
+            return 1
+        if args.action == "ensure":
+            created = ensure_partitions(conn, args.ahead)
+            print(f"Создано секций: {created}", file=sys.stderr)
+        elif args.action == "archive":
+            if args.before is None:
+                print("Укажите --before", file=sys.stderr)
+                return 1
+            for name in archive_partitions(conn, args.before, args.tablespace):
+                print(f"В архиве: {name}", file=sys.stderr)
+        else:
+            for name, bound, rows in list_partitions(conn):
+                print(f"{name}\t{bound}\t~{max(rows, 0)}")
+
+
+def cmd_mirror(db, schema, args):
+    mirror = open_mirror(db.config)
+    if mirror is None:
+        print("Таблицы локальной копии не заданы (mirror_tables в car_service.ini)",
+              file=sys.stderr)
+        return 1
+    try:
+        if args.action == "sync":
+            with db.connection() as conn:
+                if mirror.queued():
+                    sent, conflicts = mirror.replay(conn, schema)
+                    print(f"Отправлено отложенных изменений: {sent}, конфликтов: {conflicts}",
+                          file=sys.stderr)
+                received = mirror.sync(conn, schema)
+            print(f"Получено строк: {received}", file=sys.stderr)
+        status = mirror.status()
+        for name, rows, synced_at, logged in status.tables:
+            print(f"{name}\t{rows}\t{age_label(time.time() - synced_at)}\t"
+                  f"{'журнал' if logged else 'целиком'}")
+        print(f"Отложенных изменений: {status.queued}, "
+              f"конфликтов: {status.stats.get('conflicts', 0)}", file=sys.stderr)
+        if status.stats.get("last_error"):
+            print(f"Ошибка синхронизации: {status.stats['last_error']}", file=sys.stderr)
+    finally:
+        mirror.close()
+
+
+def cmd_replicas(db, schema, args):
+    if not db.replicas:
+        print("Реплики не заданы (replica_dsn в car_service.ini)", file=sys.stderr)
+        return 1
+    unavailable = 0
+    for replica, usable in db.check_replicas():
+        if replica.error is not None:
+            unavailable += 1
+            state = f"недоступна: {replica.error}"
+        elif replica.lsn is None:
+            state = "не реплика (сервер не в режиме восстановления)"
+        else:
+            state = f"отставание {replica.lag:.1f} с"
+            if not usable:
+                state += f" - больше {replica.max_lag} с, чтение идет на основной сервер"
+        print(f"{replica.name}\t{state}")
+    return 1 if unavailable else 0
+
+
+def cmd_report(db, schema, args):
+    if not args.reports:
+        for report in REPORTS:
+            period = " (--from, --to)" if report.dated else ""
+            print(f"{report.name:<12} {report.title}{period}")
+        return
+    reports = [find_report(name) for name in dict.fromkeys(args.reports)]
+    if any(report.dated for report in reports) and (args.date_from is None or args.date_to is None):
+        raise ReportError("Укажите период отчета: --from и --to")
+    params = report_params(args.date_from, args.date_to) if args.date_from else None
+
+    def run(report, f):
+        with db.connection(readonly=True) as conn:
+            use_rollups = not args.no_rollups and rollups_installed(conn)
+            rows = stream_report(conn, report, params if report.dated else None, f,
+                                 args.format, use_rollups)
+        print(f"{report.name}: {rows} строк", file=sys.stderr)
+
+    if len(reports) == 1 and args.output in (None, "-"):
+        run(reports[0], sys.stdout.buffer)
+        return
+    if len(reports) == 1 and not os.path.isdir(args.output):
+        with open(args.output, "wb") as f:
+            run(reports[0], f)
+        return
+
+    # Несколько отчетов строятся одновременно, каждый на своем соединении
+    directory = args.output or "."
+    os.makedirs(directory, exist_ok=True)
+
+    def run_to_file(report):
+        suffix = f"_{args.date_from}_{args.date_to}" if report.dated else ""
+        with open(os.path.join(directory, f"{report.name}{suffix}.{args.format}"), "wb") as f:
+            run(report, f)
+
+    with ThreadPoolExecutor(max_workers=min(len(reports), db.config["pool_max"])) as executor:
+        for future in [executor.submit(run_to_file, report) for report in reports]:
+            future.result()
+
+
+def report_fk_indexes(conn):
+    """Вывод внешних ключей без индексов; 1, если такие есть"""
+    missing = missing_fk_indexes(conn)
+    for table, name, columns in missing:
+        print(f"Нет индекса для внешнего ключа {table}.{name} ({', '.join(columns)})",
+              file=sys.stderr)
+    return 1 if missing else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Автосервис: работа с БД из командной строки")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="выгрузка таблицы в CSV (COPY TO)")
+    export_parser.add_argument("table")
+    export_parser.add_argument("file", help="файл CSV или - для stdout")
+    export_parser.add_argument("--columns", help="столбцы через запятую (по умолчанию все)")
+    export_parser.add_argument("--delimiter", default=",")
+    add_filter_arguments(export_parser)
+    export_parser.set_defaults(handler=cmd_export)
+
+    import_parser = commands.add_parser("import", help="загрузка CSV с заголовком (COPY FROM)")
+    import_parser.add_argument("table")
+    import_parser.add_argument("file", help="файл CSV или - для stdin")
+    import_parser.add_argument("--key", help="уникальный ключ для обновления существующих "
+                                             "строк, столбцы через запятую")
+    import_parser.add_argument("--delimiter", help="разделитель полей (по умолчанию "
+                                                   "определяется по заголовку)")
+    import_parser.set_defaults(handler=cmd_import)
+
+    migrate_parser = commands.add_parser("migrate", help="применение миграций схемы БД")
+    migrate_parser.add_argument("--to", type=int, help="номер последней применяемой миграции")
+    migrate_parser.set_defaults(handler=cmd_migrate)
+
+    rollback_parser = commands.add_parser("rollback", help="откат миграций схемы БД")
+    rollback_parser.add_argument("--to", type=int, help="номер миграции, до которой откатить "
+                                                        "(0 - все; по умолчанию - последняя)")
+    rollback_parser.set_defaults(handler=cmd_rollback)
+
+    migrations_parser = commands.add_parser("migrations", help="список миграций")
+    migrations_parser.set_defaults(handler=cmd_migrations)
+
+    check_parser = commands.add_parser("check-indexes",
+                                       help="поиск внешних ключей без индексов")
+    check_parser.set_defaults(handler=cmd_check_indexes)
+
+    partitions_parser = commands.add_parser("partitions", help="секции таблицы car_repair")
+    partitions_parser.add_argument("action", nargs="?", default="list",
+                                   choices=("list", "ensure", "archive"),
+                                   help="list - список, ensure - создать будущие секции, "
+                                        "archive - перенести старые секции в архив")
+    partitions_parser.add_argument("--ahead", type=int, default=MONTHS_AHEAD,
+                                   help="на сколько месяцев вперед создавать секции")
+    partitions_parser.add_argument("--before", type=datetime.date.fromisoformat,
+                                   help="архивировать секции до этой даты (ГГГГ-ММ-ДД)")
+    partitions_parser.add_argument("--tablespace", help="табличное пространство для архива")
+    partitions_parser.set_defaults(handler=cmd_partitions)
+
+    generate_parser = commands.add_parser("generate", help="заполнение БД синтетическими данными")
+    generate_parser.add_argument("--cars", type=int, default=10000,
+                                 help="число машин (от него зависят остальные таблицы)")
+    generate_parser.add_argument("--seed", type=int, default=1)
+    generate_parser.add_argument("--truncate", action="store_true",
+                                 help="удалить существующие данные всех таблиц")
+    generate_parser.set_defaults(handler=cmd_generate)
+
+    bench_parser = commands.add_parser("bench", help="замер операций приложения (JSON)")
+    bench_parser.add_argument("--repeat", type=int, default=5, help="запусков каждой операции")
+    bench_parser.add_argument("--parts", type=int, default=10,
+                              help="запчастей в сохраняемом ремонте")
+    bench_parser.add_argument("--output", default="-", help="файл JSON или - для stdout")
+    bench_parser.set_defaults(handler=cmd_bench)
+
+    report_parser = commands.add_parser("report", help="построение отчетов в файл "
+                                                       "(без списка отчетов - список)")
+    report_parser.add_argument("reports", nargs="*", metavar="report",
+                               help=", ".join(report.name for report in REPORTS))
+    report_parser.add_argument("--from", dest="date_from", type=datetime.date.fromisoformat,
+                               help="начало периода (ГГГГ-ММ-ДД)")
+    report_parser.add_argument("--to", dest="date_to", type=datetime.date.fromisoformat,
+                               help="конец периода (ГГГГ-ММ-ДД)")
+    report_parser.add_argument("--format", choices=REPORT_FORMATS, default="csv")
+    report_parser.add_argument("--output", help="файл или - для stdout (один отчет), каталог "
+                                                "(несколько отчетов, по умолчанию текущий)")
+    report_parser.add_argument("--no-rollups", action="store_true",
+                               help="строить по исходным таблицам, а не по агрегатам")
+    report_parser.set_defaults(handler=cmd_report)
+
+    replicas_parser = commands.add_parser("replicas", help="состояние реплик для чтения")
+    replicas_parser.set_defaults(handler=cmd_replicas)
+
+    mirror_parser = commands.add_parser("mirror", help="локальная копия таблиц (SQLite)")
+    mirror_parser.add_argument("action", nargs="?", default="status", choices=("status", "sync"),
+                               help="sync - отправить отложенные изменения и обновить копию")
+    mirror_parser.set_defaults(handler=cmd_mirror)
+
+    filters_parser = commands.add_parser("filters", help="сохраненные фильтры (общие с окном "
+                                                         "программы)")
+    filters_parser.add_argument("action", nargs="?", default="list",
+                                choices=("list", "save", "delete"))
+    filters_parser.add_argument("name", nargs="?", help="имя фильтра (save, delete)")
+    filters_parser.add_argument("--table", help="таблица фильтра (save; для list - отбор)")
+    filters_parser.add_argument("--where", action="append", metavar="COND",
+                                help="условие фильтра (save), как в export")
+    filters_parser.add_argument("--or", dest="any", action="store_true",
+                                help="объединять условия через OR")
+    filters_parser.set_defaults(handler=cmd_filters, filter=None)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # Пул создается при первом запросе: "mirror" показывает копию и без связи с БД
+    db = Database(load_config(), connect=False)
+    try:
+        return args.handler(db, SchemaCache(), args) or 0
+    except (TransferError, MigrationError, BenchError, ReportError, FilterError,
+            psycopg2.Error) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+import datetime
+import decimal
+from array import array
+
+
+# Типы PostgreSQL (OID), значения которых хранятся в массивах
+_INTEGER_TYPES = {21: "h", 23: "i", 20: "q"}   # smallint, integer, bigint
+_FLOAT_TYPES = (700, 701)                      # real, double precision
+_BOOL, _DATE, _NUMERIC = 16, 1082, 1700
+
+_MAX_NUMERIC_PRECISION = 18  # NUMERIC с такой точностью помещается в int64
+
+# Строки кодируются словарем, если различных значений в первой порции не
+# больше этой доли (owner, name); иначе (номера кузова, ИНН) словарь
+# только занимал бы место
+DICTIONARY_RATIO = 0.5
+
+
+class StringDictionary:
+    """Словарь строк столбца, общий для всех порций результата.
+
+    Код 0 - NULL.
+    """
+
+    def __init__(self):
+        self.values = [None]
+        self._codes = {None: 0}
+
+    def code(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def ranks(self):
+        """Код -> место значения в порядке сортировки"""
+        order = sorted(range(1, len(self.values)), key=self.values.__getitem__)
+        ranks = array("I", bytes(4 * len(self.values)))
+        for rank, code in enumerate(order, 1):
+            ranks[code] = rank
+        return ranks
+
+
+class ColumnType:
+    """Способ хранения столбца результата.
+
+    Значения хранятся ключами: в массиве typecode (числа, даты как номер
+    дня, NUMERIC как целое со сдвигом на scale знаков), кодами словаря
+    или, если typecode не задан, списком значений. Ключи упорядочены так
+    же, как значения, поэтому по ним можно сортировать и сравнивать.
+    """
+
+    def __init__(self, typecode=None, encode=None, decode=None, dictionary=None, numeric=False):
+        self.typecode = typecode
+        self.encode = encode
+        self.decode = decode
+        self.dictionary = dictionary
+        self.numeric = numeric  # сумма ключей - ключ суммы значений
+        if dictionary is not None:
+            self.typecode = "I"
+            self.encode = dictionary.code
+            self.decode = dictionary.values.__getitem__
+
+    def pack(self, values):
+        """Значения столбца порции: (ключи, отметки NULL или None)"""
+        nulls = bytearray(value is None for value in values) if None in values else None
+        if self.typecode is None:
+            return list(values), nulls
+        encode = self.encode
+        if self.dictionary is not None:
+            keys = map(encode, values)
+        elif encode is None:
+            keys = values if nulls is None else [0 if v is None else v for v in values]
+        else:
+            keys = [0 if v is None else encode(v) for v in values]
+        return array(self.typecode, keys), nulls
+
+    def key(self, value):
+        """Ключ значения (для значений, не хранящихся в порции)"""
+        if value is None or self.encode is None:
+            return value
+        return self.encode(value)
+
+    def value(self, key):
+        """Значение по ключу"""
+        return key if self.decode is None else self.decode(key)
+
+
+class ColumnarChunk:
+    """Порция строк результата, хранимая по столбцам.
+
+    Доступ к строке (chunk[i]) собирает кортеж значений; для показа
+    ячейки достаточно value(i, столбец).
+    """
+
+    __slots__ = ("types", "columns", "length")
+
+    def __init__(self, types, columns, length):
+        self.types = types
+        self.columns = columns  # по столбцу: (ключи, отметки NULL или None)
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        return tuple(self.value(i, column) for column in range(len(self.columns)))
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield self[i]
+
+    def value(self, i, column):
+        """Значение столбца column строки i"""
+        keys, nulls = self.columns[column]
+        if nulls is not None and nulls[i]:
+            return None
+        return self.types[column].value(keys[i])
+
+    def keys(self, column):
+        """Ключи столбца и отметки NULL (или None)"""
+        return self.columns[column]
+
+
+class ColumnarBuilder:
+    """Перевод порций строк одного результата в ColumnarChunk.
+
+    Способ хранения каждого столбца выбирается по типу (description
+    курсора) и первой порции; словари строк общие для всех порций.
+    """
+
+    def __init__(self, description):
+        self.description = description
+        self.types = None
+
+    def build(self, rows):
+        columns = list(zip(*rows)) if rows else [()] * len(self.description)
+        if self.types is None:
+            self.types = [_column_type(column, values)
+                          for column, values in zip(self.description, columns)]
+        packed = []
+        for i, values in enumerate(columns):
+            try:
+                packed.append(self.types[i].pack(values))
+            except (ArithmeticError, OverflowError, TypeError, ValueError):
+                # Значение не помещается в массив (например, NaN в NUMERIC) -
+                # дальше столбец хранится списком значений
+                self.types[i] = ColumnType(numeric=self.types[i].numeric)
+                packed.append(self.types[i].pack(values))
+        return ColumnarChunk(tuple(self.types), packed, len(rows))
+
+
+def _column_type(column, values):
+    code = column.type_code
+    if code in _INTEGER_TYPES:
+        return ColumnType(_INTEGER_TYPES[code], numeric=True)
+    if code in _FLOAT_TYPES:
+        return ColumnType("d", numeric=True)
+    if code == _BOOL:
+        return ColumnType("b", int, bool)
+    if code == _DATE:
+        return ColumnType("i", datetime.date.toordinal, datetime.date.fromordinal)
+    if (code == _NUMERIC and column.scale is not None and column.precision is not None
+            and column.precision <= _MAX_NUMERIC_PRECISION):
+        scale = column.scale
+        return ColumnType("q", lambda value: int(value.scaleb(scale)),
+                          lambda key: decimal.Decimal(key).scaleb(-scale), numeric=True)
+    if code == _NUMERIC:
+        # NUMERIC без модификатора (например, результат SUM) - списком значений
+        return ColumnType(numeric=True)
+    present = [value for value in values if value is not None]
+    if (present and all(isinstance(value, str) for value in present)
+            and len(set(present)) <= len(values) * DICTIONARY_RATIO):
+        return ColumnType(dictionary=StringDictionary())
+    return ColumnType()
@@ -0,0 +1,332 @@
+import configparser
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+
+from instrument import InstrumentedCursor, query_log
+
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "car_service.ini")
+SLOW_QUERY_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "car_service_slow.log")
+
+DEFAULT_CONFIG = {
+    "dsn": "host=localhost port=5432 dbname=car_service user=postgres password=postgres",
+    "pool_min": 1,
+    "pool_max": 8,
+    "connect_timeout": 5,          # секунды
+    "statement_timeout": 300000,   # миллисекунды, 0 - без ограничения
+    "check_interval": 30,          # секунды простоя, после которых соединение проверяется
+    "acquire_timeout": 30,         # секунды ожидания свободного соединения
+    "slow_query_ms": 500,          # порог медленного запроса, 0 - не записывать
+    "slow_query_log": SLOW_QUERY_LOG,  # файл медленных запросов (JSON по строке)
+    "cache_entries": 64,           # результатов в кэше отчетов и справочников, 0 - без кэша
+    "cache_ttl": 300,              # секунды хранения результата в кэше
+    "mirror_tables": "",           # таблицы локальной копии через запятую, пусто - без копии
+    "mirror_path": "",             # файл локальной копии (SQLite), пусто - рядом с программой
+    "mirror_sync_interval": 60,    # секунды между синхронизациями копии
+    "replica_dsn": "",             # реплики для чтения через «;», пусто - все на основном сервере
+    "replica_max_lag": 10,         # секунды отставания, после которых реплика не используется
+}
+
+# Переменные окружения переопределяют файл настроек
+ENV_VARIABLES = {
+    "dsn": "CAR_SERVICE_DSN",
+    "pool_min": "CAR_SERVICE_POOL_MIN",
+    "pool_max": "CAR_SERVICE_POOL_MAX",
+    "connect_timeout": "CAR_SERVICE_CONNECT_TIMEOUT",
+    "statement_timeout": "CAR_SERVICE_STATEMENT_TIMEOUT",
+    "check_interval": "CAR_SERVICE_CHECK_INTERVAL",
+    "acquire_timeout": "CAR_SERVICE_ACQUIRE_TIMEOUT",
+    "slow_query_ms": "CAR_SERVICE_SLOW_QUERY_MS",
+    "slow_query_log": "CAR_SERVICE_SLOW_QUERY_LOG",
+    "cache_entries": "CAR_SERVICE_CACHE_ENTRIES",
+    "cache_ttl": "CAR_SERVICE_CACHE_TTL",
+    "mirror_tables": "CAR_SERVICE_MIRROR_TABLES",
+    "mirror_path": "CAR_SERVICE_MIRROR",
+    "mirror_sync_interval": "CAR_SERVICE_MIRROR_SYNC_INTERVAL",
+    "replica_dsn": "CAR_SERVICE_REPLICA_DSN",
+    "replica_max_lag": "CAR_SERVICE_REPLICA_MAX_LAG",
+}
+
+# Состояние реплики перепроверяется не чаще раза в REPLICA_CHECK_INTERVAL
+# секунд (и всегда, если она может не содержать записей этого приложения);
+# недоступная реплика не используется REPLICA_RETRY секунд
+REPLICA_CHECK_INTERVAL = 1.0
+REPLICA_RETRY = 30
+
+_REPLICA_STATUS_SQL = """
+    SELECT pg_is_in_recovery(),
+           pg_last_wal_replay_lsn()::text,
+           CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+           END
+"""
+
+
+def load_config(path=None):
+    """Параметры подключения.
+
+    Порядок приоритета: переменные окружения CAR_SERVICE_*, секция
+    [database] файла car_service.ini (путь можно задать в
+    CAR_SERVICE_CONFIG), значения по умолчанию.
+    """
+    config = dict(DEFAULT_CONFIG)
+
+    parser = configparser.ConfigParser()
+    parser.read(path or os.environ.get("CAR_SERVICE_CONFIG", CONFIG_FILE), encoding="utf-8")
+    if parser.has_section("database"):
+        for key in config:
+            if parser.has_option("database", key):
+                config[key] = parser.get("database", key)
+
+    for key, variable in ENV_VARIABLES.items():
+        if variable in os.environ:
+            config[key] = os.environ[variable]
+
+    for key, default in DEFAULT_CONFIG.items():
+        if isinstance(default, int):
+            config[key] = int(config[key])
+    return config
+
+
+def parse_lsn(text):
+    """Позиция в журнале WAL ("16/B374D848") в виде числа для сравнения"""
+    high, low = text.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+class Replica:
+    """Реплика для чтения: свой пул соединений и последнее известное состояние"""
+
+    def __init__(self, db, max_lag):
+        self.db = db                # Database с DSN реплики
+        self.max_lag = max_lag
+        self.lag = None             # секунды отставания при последней проверке
+        self.lsn = None             # воспроизведенная позиция WAL (None - не реплика)
+        self.error = None           # последняя ошибка подключения
+        self._checked = 0           # время последней проверки
+        self._down_until = 0        # до этого времени реплика не используется
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.db.config["dsn"]
+
+    def available(self):
+        return time.monotonic() >= self._down_until
+
+    def failed(self, error):
+        """Реплика недоступна - чтение на REPLICA_RETRY секунд уходит на другие серверы"""
+        with self._lock:
+            self.error = str(error).strip()
+            self._down_until = time.monotonic() + REPLICA_RETRY
+
+    def is_fresh(self, conn, write_lsn=None):
+        """Можно ли читать с реплики: отставание не больше max_lag и, если
+        известна позиция последней записи приложения (write_lsn), она уже
+        воспроизведена.
+
+        Сервер не в режиме восстановления (например, копия БД для
+        проверки) считается актуальным.
+        """
+        with self._lock:
+            stale = time.monotonic() - self._checked >= REPLICA_CHECK_INTERVAL
+            behind = write_lsn is not None and self.lsn is not None and self.lsn < write_lsn
+            if stale or behind:
+                cursor = conn.cursor()
+                cursor.execute(_REPLICA_STATUS_SQL)
+                in_recovery, lsn, lag = cursor.fetchone()
+                conn.rollback()
+                self.lsn = parse_lsn(lsn) if in_recovery and lsn else None
+                self.lag = float(lag or 0) if in_recovery else 0.0
+                self.error = None
+                self._checked = time.monotonic()
+            if write_lsn is not None and self.lsn is not None and self.lsn < write_lsn:
+                return False
+            return self.lag <= self.max_lag
+
+
+class Database:
+    """Пул соединений с проверкой при выдаче и автоматическим переподключением.
+
+    Соединение, простоявшее дольше check_interval, перед выдачей
+    проверяется запросом SELECT 1; разорванное соединение закрывается и
+    заменяется новым. Если все соединения заняты, getconn ждет
+    освобождения до acquire_timeout секунд.
+
+    При connect=False пул (и первые соединения) создается при первом
+    getconn - например, в фоновом потоке, пока окно уже показано.
+
+    Чтение (getconn(readonly=True)) направляется на реплики replica_dsn
+    по очереди. Реплика пропускается, если недоступна, отстает больше
+    replica_max_lag секунд или еще не воспроизвела последнюю запись этого
+    приложения (note_write) - тогда чтение идет на основной сервер.
+    """
+
+    def __init__(self, config=None, connect=True):
+        self.config = config or load_config()
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        query_log.configure(self.config["slow_query_ms"], self.config["slow_query_log"])
+        self._slots = threading.BoundedSemaphore(self.config["pool_max"])
+        self._last_used = {}  # id соединения -> время возврата в пул
+        self.replicas = [
+            Replica(Database(dict(self.config, dsn=dsn.strip(), replica_dsn=""), connect=False),
+                    self.config["replica_max_lag"])
+            for dsn in self.config["replica_dsn"].split(";") if dsn.strip()]
+        self._replica_conns = {}  # id соединения реплики -> Replica
+        self._next_replica = 0
+        self._write_lsn = None  # позиция WAL после последней записи приложения
+        if connect:
+            self._create_pool()
+
+    def _create_pool(self):
+        with self._pool_lock:
+            if self.pool is not None:
+                return self.pool
+            options = ""
+            if self.config["statement_timeout"]:
+                options = f"-c statement_timeout={self.config['statement_timeout']}"
+            self.pool = pool.ThreadedConnectionPool(
+                self.config["pool_min"], self.config["pool_max"], self.config["dsn"],
+                connect_timeout=self.config["connect_timeout"], options=options,
+                cursor_factory=InstrumentedCursor)
+            return self.pool
+
+    def getconn(self, readonly=False):
+        """Выдача проверенного соединения из пула.
+
+        readonly - соединение только для чтения: с реплики, если есть
+        подходящая, иначе с основного сервера.
+        """
+        if readonly:
+            for _ in range(len(self.replicas)):
+                replica = self.replicas[self._next_replica % len(self.replicas)]
+                self._next_replica += 1
+                conn = self._replica_conn(replica)
+                if conn is not None:
+                    self._replica_conns[id(conn)] = replica
+                    return conn
+        if not self._slots.acquire(timeout=self.config["acquire_timeout"]):
+            raise pool.PoolError("Нет свободных соединений с БД")
+        try:
+            connections = self.pool or self._create_pool()
+            # Каждое соединение пула может оказаться разорванным - пробуем
+            # все, последним будет новое соединение
+            for _ in range(self.config["pool_max"] + 1):
+                conn = connections.getconn()
+                if self._is_alive(conn):
+                    return conn
+                self.pool.putconn(conn, close=True)
+            raise psycopg2.OperationalError("Не удалось получить рабочее соединение с БД")
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _replica_conn(self, replica):
+        """Соединение с реплики, если она доступна и достаточно свежа"""
+        if not replica.available():
+            return None
+        try:
+            conn = replica.db.getconn()
+        except (psycopg2.OperationalError, pool.PoolError) as e:
+            replica.failed(e)
+            return None
+        try:
+            fresh = replica.is_fresh(conn, self._write_lsn)
+        except psycopg2.Error as e:
+            replica.failed(e)
+            replica.db.putconn(conn, close=True)
+            return None
+        if not fresh:
+            replica.db.putconn(conn)
+            return None
+        return conn
+
+    def note_write(self, conn):
+        """Запоминание позиции WAL после записи на соединении conn основного
+        сервера: чтение с реплик начнется, когда они ее воспроизведут.
+        Без реплик ничего не делает.
+        """
+        if not self.replicas or conn.closed or id(conn) in self._replica_conns:
+            return
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_current_wal_lsn()::text")
+            lsn = parse_lsn(cursor.fetchone()[0])
+            conn.rollback()
+        except psycopg2.Error:
+            return
+        if self._write_lsn is None or lsn > self._write_lsn:
+            self._write_lsn = lsn
+
+    def check_replicas(self):
+        """Проверка всех реплик: список пар (Replica, пригодна ли сейчас для чтения)"""
+        result = []
+        for replica in self.replicas:
+            conn = self._replica_conn(replica)
+            if conn is not None:
+                replica.db.putconn(conn)
+            result.append((replica, conn is not None))
+        return result
+
+    def putconn(self, conn, close=False):
+        """Возврат соединения в пул (незавершенная транзакция откатывается)"""
+        replica = self._replica_conns.pop(id(conn), None)
+        if replica is not None:
+            if conn.closed:
+                replica.failed("соединение разорвано")
+            replica.db.putconn(conn, close)
+            return
+        try:
+            if conn.closed:
+                # Разорванное соединение - вероятно, сервер перезапускался:
+                # остальные простаивающие соединения проверим при выдаче
+                self._last_used.clear()
+                close = True
+            if close:
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+            self.pool.putconn(conn, close=close)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, readonly=False):
+        """Соединение из пула на время блока with"""
+        conn = self.getconn(readonly)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def check(self):
+        """Проверка доступности БД"""
+        with self.connection():
+            pass
+
+    def close(self):
+        """Закрытие всех соединений пула (и пулов реплик)"""
+        for replica in self.replicas:
+            replica.db.close()
+        if self.pool is not None:
+            self.pool.closeall()
+
+    def _is_alive(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.config["check_interval"]:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
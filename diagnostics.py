@@ -0,0 +1,227 @@
+from PyQt6.QtCore import Qt, QRectF, QTimer
+from PyQt6.QtGui import QFont, QPainter
+from PyQt6.QtWidgets import (QAbstractItemView, QDialog, QDockWidget, QHBoxLayout, QLabel,
+                             QMessageBox, QPlainTextEdit, QPushButton, QSplitter, QTableWidget,
+                             QTableWidgetItem, QVBoxLayout, QWidget)
+
+from instrument import HISTOGRAM_BOUNDS, explain, histogram, query_log, summarize
+
+
+RECENT_ROWS = 200       # сколько последних запросов показывается в панели
+REFRESH_INTERVAL = 1000  # мс
+
+
+class HistogramWidget(QWidget):
+    """Гистограмма времени выполнения запросов"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.counts = []
+        labels = [f"<{bound}" for bound in HISTOGRAM_BOUNDS]
+        self.labels = labels + [f"≥{HISTOGRAM_BOUNDS[-1]}"]
+        self.setMinimumHeight(110)
+
+    def set_counts(self, counts):
+        self.counts = counts
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        width = self.width() / len(self.labels)
+        height = self.height() - 32
+        peak = max(self.counts or [0]) or 1
+        for i, label in enumerate(self.labels):
+            count = self.counts[i] if i < len(self.counts) else 0
+            bar = height * count / peak
+            x = i * width
+            painter.fillRect(QRectF(x + 3, 16 + height - bar, width - 6, bar),
+                             self.palette().highlight())
+            painter.drawText(QRectF(x, 0, width, 16), Qt.AlignmentFlag.AlignCenter, str(count))
+            painter.drawText(QRectF(x, self.height() - 16, width, 16),
+                             Qt.AlignmentFlag.AlignCenter, label)
+        painter.end()
+
+
+class DiagnosticsDock(QDockWidget):
+    """Панель диагностики: сводка по запросам, гистограмма времени,
+    последние запросы и EXPLAIN (ANALYZE, BUFFERS) выбранного запроса.
+    """
+
+    SUMMARY_COLUMNS = ("Запрос", "Источник", "Вызовов", "Всего, мс", "p50, мс", "p95, мс",
+                       "Макс, мс", "Строк", "Байт", "Ошибок")
+    RECENT_COLUMNS = ("Время", "Источник", "мс", "Строк", "Байт", "Ошибка", "SQL")
+
+    def __init__(self, runner, cache=None, parent=None):
+        super().__init__("Диагностика запросов", parent)
+        self.runner = runner
+        self.cache = cache
+        self.selected_fingerprint = None
+        self.recent = []
+
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+
+        self.summary_table = self._table(self.SUMMARY_COLUMNS)
+        self.summary_table.itemSelectionChanged.connect(self.on_summary_selected)
+        self.histogram = HistogramWidget()
+        self.recent_table = self._table(self.RECENT_COLUMNS)
+        self.recent_table.doubleClicked.connect(self.explain_selected)
+
+        splitter = QSplitter(Qt.Orientation.Vertical)
+        splitter.addWidget(self.summary_table)
+        splitter.addWidget(self.histogram)
+        splitter.addWidget(self.recent_table)
+        layout.addWidget(splitter)
+
+        buttons = QHBoxLayout()
+        explain_btn = QPushButton("EXPLAIN ANALYZE")
+        explain_btn.clicked.connect(self.explain_selected)
+        buttons.addWidget(explain_btn)
+        all_btn = QPushButton("Все запросы")
+        all_btn.clicked.connect(self.summary_table.clearSelection)
+        buttons.addWidget(all_btn)
+        clear_btn = QPushButton("Очистить")
+        clear_btn.clicked.connect(self.clear)
+        buttons.addWidget(clear_btn)
+        if cache is not None:
+            clear_cache_btn = QPushButton("Сбросить кэш")
+            clear_cache_btn.clicked.connect(self.clear_cache)
+            buttons.addWidget(clear_cache_btn)
+        buttons.addStretch()
+        self.cache_label = QLabel()
+        buttons.addWidget(self.cache_label)
+        self.slow_label = QLabel()
+        buttons.addWidget(self.slow_label)
+        layout.addLayout(buttons)
+
+        self.setWidget(widget)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(REFRESH_INTERVAL)
+        self.timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.on_visibility_changed)
+
+    @staticmethod
+    def _table(columns):
+        table = QTableWidget(0, len(columns))
+        table.setHorizontalHeaderLabels(columns)
+        table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        table.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        table.horizontalHeader().setStretchLastSection(True)
+        table.verticalHeader().setVisible(False)
+        return table
+
+    def on_visibility_changed(self, visible):
+        if visible:
+            self.refresh()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def refresh(self):
+        """Обновление панели по журналу запросов"""
+        records = query_log.records()
+        if query_log.slow_query_ms and query_log.slow_query_log:
+            self.slow_label.setText(f"Медленные (≥ {query_log.slow_query_ms} мс): "
+                                    f"{query_log.slow_query_log}")
+        else:
+            self.slow_label.setText("Журнал медленных запросов выключен")
+
+        if self.cache is not None:
+            stats = self.cache.stats()
+            requests = stats["hits"] + stats["misses"]
+            ratio = f" ({stats['hits'] * 100 // requests}%)" if requests else ""
+            self.cache_label.setText(
+                f"Кэш: записей {stats['entries']}, попаданий {stats['hits']}{ratio}, "
+                f"промахов {stats['misses']}, вытеснено {stats['evictions']}, "
+                f"сброшено {stats['invalidations']}")
+
+        summary = summarize(records)
+        self.summary_table.blockSignals(True)
+        self.summary_table.setRowCount(len(summary))
+        for row, item in enumerate(summary):
+            values = (item["fingerprint"], ", ".join(item["origins"]), item["calls"],
+                      _ms(item["total"]), _ms(item["p50"]), _ms(item["p95"]), _ms(item["max"]),
+                      item["rows"], item["bytes"], item["errors"])
+            for col, value in enumerate(values):
+                cell = QTableWidgetItem(str(value))
+                if col == 0:
+                    cell.setToolTip(item["fingerprint"])
+                self.summary_table.setItem(row, col, cell)
+            if item["fingerprint"] == self.selected_fingerprint:
+                self.summary_table.selectRow(row)
+        self.summary_table.blockSignals(False)
+
+        if self.selected_fingerprint is not None:
+            records = [r for r in records if r.fingerprint == self.selected_fingerprint]
+        self.histogram.set_counts(histogram(record.duration for record in records))
+
+        self.recent = records[-RECENT_ROWS:][::-1]
+        self.recent_table.setRowCount(len(self.recent))
+        for row, record in enumerate(self.recent):
+            values = (record.started.strftime("%H:%M:%S.%f")[:-3], record.origin or "",
+                      _ms(record.duration), record.rows, record.bytes, record.error or "",
+                      record.sql)
+            for col, value in enumerate(values):
+                cell = QTableWidgetItem(str(value))
+                if col == len(values) - 1:
+                    cell.setToolTip(record.sql)
+                self.recent_table.setItem(row, col, cell)
+
+    def on_summary_selected(self):
+        rows = self.summary_table.selectionModel().selectedRows()
+        self.selected_fingerprint = (self.summary_table.item(rows[0].row(), 0).text()
+                                     if rows else None)
+        self.refresh()
+
+    def clear(self):
+        query_log.clear()
+        self.selected_fingerprint = None
+        self.refresh()
+
+    def clear_cache(self):
+        self.cache.clear()
+        self.refresh()
+
+    def explain_selected(self):
+        """EXPLAIN (ANALYZE, BUFFERS) выбранного последнего запроса"""
+        row = self.recent_table.currentRow()
+        if row < 0 or row >= len(self.recent):
+            QMessageBox.warning(self, "Предупреждение", "Выберите запрос в списке последних")
+            return
+        record = self.recent[row]
+        if not record.sql.lstrip().upper().startswith(("SELECT", "WITH", "TABLE", "VALUES")):
+            reply = QMessageBox.question(
+                self, "Подтверждение",
+                "Запрос изменяет данные. Он будет выполнен и отменен откатом транзакции. "
+                "Продолжить?",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+            if reply != QMessageBox.StandardButton.Yes:
+                return
+
+        self.runner.submit(
+            lambda conn: explain(conn, record),
+            on_result=lambda plan: self.show_plan(record, plan),
+            on_error=lambda e: QMessageBox.critical(self, "Ошибка", f"Ошибка EXPLAIN: {e}"),
+            description="Построение плана запроса",
+            dialog_parent=self)
+
+    def show_plan(self, record, plan):
+        dialog = QDialog(self)
+        dialog.setWindowTitle("План запроса")
+        dialog.resize(800, 500)
+        layout = QVBoxLayout(dialog)
+        text = QPlainTextEdit()
+        text.setReadOnly(True)
+        text.setFont(QFont("Monospace"))
+        text.setPlainText(f"{record.sql}\n\n{plan}")
+        layout.addWidget(text)
+        close_btn = QPushButton("Закрыть")
+        close_btn.clicked.connect(dialog.accept)
+        layout.addWidget(close_btn)
+        dialog.show()
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.1f}"
@@ -0,0 +1,124 @@
+from dataclasses import dataclass, field
+
+from psycopg2 import sql
+
+from queries import key_condition, key_in_condition
+
+
+@dataclass(frozen=True)
+class RowState:
+    """Строка, прочитанная для редактирования"""
+    key: tuple        # значения первичного ключа
+    version: str      # xmin строки: меняется при каждом ее изменении
+    values: dict      # поле -> значение
+
+
+@dataclass
+class RowEdit:
+    """Изменение строки: только поля, значения которых изменились"""
+    row: RowState
+    changes: dict = field(default_factory=dict)  # поле -> новое значение
+
+
+@dataclass
+class RowConflict:
+    """Строка, измененная или удаленная другим пользователем после чтения"""
+    edit: RowEdit
+    current: RowState = None  # строка сейчас (None - удалена)
+
+    def merge(self):
+        """Объединение своих изменений с чужими по полям.
+
+        Возвращает пару (RowEdit поверх текущей строки, конфликты:
+        поле -> (свое значение, чужое значение)). Поле, которое изменил
+        только один из двух, или оба - на одно значение, конфликтом не
+        считается; в RowEdit остаются только свои изменения, еще не
+        записанные в строку.
+        """
+        changes = {}
+        conflicts = {}
+        for name, mine in self.edit.changes.items():
+            base = self.edit.row.values.get(name)
+            theirs = self.current.values.get(name)
+            if same_value(theirs, mine):
+                continue
+            if not same_value(theirs, base):
+                conflicts[name] = (mine, theirs)
+            changes[name] = mine
+        return RowEdit(self.current, changes), conflicts
+
+
+class EditConflict(Exception):
+    """Строки изменены другими пользователями; ничего не записано"""
+
+    def __init__(self, conflicts):
+        super().__init__(f"Записи изменены другим пользователем: {len(conflicts)}")
+        self.conflicts = conflicts  # список RowConflict
+
+
+def same_value(a, b):
+    """Равенство значений поля; пустая строка и NULL не различаются (поле ввода)"""
+    return a == b or a in (None, "") and b in (None, "")
+
+
+def changed_fields(row, values):
+    """Поля, значения которых в values отличаются от прочитанных в строке row"""
+    return {name: value for name, value in values.items()
+            if not same_value(row.values.get(name), value)}
+
+
+def read_rows(conn, table, keys):
+    """Текущие значения и версии строк по ключам (RowState в порядке keys).
+
+    Удаленные строки пропускаются.
+    """
+    if not keys:
+        return []
+    condition, params = key_in_condition(table.primary_key, keys)
+    cursor = conn.cursor()
+    cursor.execute(sql.SQL("SELECT xmin::text, * FROM {} WHERE {}").format(
+        sql.Identifier(table.name), condition), params)
+    names = [column.name for column in cursor.description[1:]]
+    rows = {}
+    for version, *values in cursor.fetchall():
+        values = dict(zip(names, values))
+        key = tuple(values[col] for col in table.primary_key)
+        rows[key] = RowState(key, version, values)
+    conn.rollback()
+    return [rows[tuple(key)] for key in keys if tuple(key) in rows]
+
+
+def save_edits(conn, table, edits):
+    """Запись изменений нескольких строк одной транзакцией.
+
+    Каждый UPDATE меняет только измененные поля и выполняется, только если
+    версия строки (xmin) не изменилась после чтения. Если хоть одна
+    строка изменена или удалена другим пользователем, транзакция
+    откатывается и выбрасывается EditConflict с текущими значениями этих
+    строк. Возвращает число измененных строк.
+    """
+    cursor = conn.cursor()
+    missed = []
+    saved = 0
+    for edit in edits:
+        if not edit.changes:
+            continue
+        names = list(edit.changes)
+        cursor.execute(
+            sql.SQL("UPDATE {} SET {} WHERE {} AND xmin::text = %s").format(
+                sql.Identifier(table.name),
+                sql.SQL(", ").join(sql.SQL("{} = %s").format(sql.Identifier(name))
+                                   for name in names),
+                key_condition(table.primary_key)),
+            [edit.changes[name] for name in names] + list(edit.row.key) + [edit.row.version])
+        if cursor.rowcount:
+            saved += 1
+        else:
+            missed.append(edit)
+
+    if missed:
+        conn.rollback()
+        current = {row.key: row for row in read_rows(conn, table, [e.row.key for e in missed])}
+        raise EditConflict([RowConflict(edit, current.get(edit.row.key)) for edit in missed])
+    conn.commit()
+    return saved
@@ -0,0 +1,327 @@
+import datetime
+import decimal
+import json
+import operator
+import os
+import re
+import threading
+from dataclasses import dataclass
+
+from psycopg2 import sql
+
+from search import ILIKE, TRGM, TSV, search_columns, search_condition
+
+
+FILTERS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "car_service_filters.json")
+
+# Операции условия фильтра
+EQ, NE, LT, LE, GT, GE = "=", "<>", "<", "<=", ">", ">="
+BETWEEN, IN, IS_NULL, NOT_NULL = "between", "in", "is null", "is not null"
+PREFIX, CONTAINS = "prefix", "contains"
+
+# Подписи операций в окне фильтра
+OPERATOR_LABELS = {
+    EQ: "=", NE: "≠", LT: "<", LE: "≤", GT: ">", GE: "≥",
+    BETWEEN: "между", IN: "в списке", IS_NULL: "пусто", NOT_NULL: "не пусто",
+    PREFIX: "начинается с", CONTAINS: "содержит",
+}
+
+AND, OR = "and", "or"
+
+_INTEGER_TYPES = ("smallint", "integer", "bigint")
+_NUMERIC_TYPES = ("numeric", "real", "double precision")
+_TEXT_TYPES = ("character", "text")
+
+_NULL_CHECKS = (IS_NULL, NOT_NULL)
+
+# Разбор условия из строки: "столбец операция значение"
+_CONDITION = re.compile(
+    r"^\s*(?P<column>\w+)(?:\s+(?P<word>between|in|is\s+not\s+null|is\s+null|prefix|contains)\b"
+    r"|\s*(?P<sign><>|!=|<=|>=|=|<|>))\s*(?P<value>.*?)\s*$", re.IGNORECASE)
+
+
+class FilterError(Exception):
+    """Неверное условие фильтра (поле, операция или значение)"""
+
+
+@dataclass(frozen=True)
+class Condition:
+    """Условие фильтра по одному полю.
+
+    value - текст значения как его ввел пользователь; для between -
+    "от..до", для in - значения через запятую, для is null - не нужно.
+    """
+    column: str
+    op: str
+    value: str = ""
+
+    def __str__(self):
+        if self.op in _NULL_CHECKS:
+            return f"{self.column} {self.op}"
+        return f"{self.column} {self.op} {self.value}"
+
+    def label(self):
+        """Условие для показа в окне"""
+        if self.op in _NULL_CHECKS:
+            return f"{self.column} {OPERATOR_LABELS[self.op]}"
+        return f"{self.column} {OPERATOR_LABELS[self.op]} {self.value}"
+
+
+@dataclass(frozen=True)
+class Filter:
+    """Условия фильтра, объединенные через AND или OR"""
+    conditions: tuple = ()
+    combine: str = AND
+
+    def label(self):
+        joiner = " И " if self.combine == AND else " ИЛИ "
+        return joiner.join(condition.label() for condition in self.conditions)
+
+    def to_dict(self):
+        return {"combine": self.combine, "conditions": [str(c) for c in self.conditions]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(tuple(parse_condition(text) for text in data["conditions"]),
+                   data.get("combine", AND))
+
+
+def parse_condition(text):
+    """Условие из строки вида "car_id = 5", "admission_date between
+    2024-01-01..2024-03-31", "fault_id in 1,2,3", "owner prefix Иван",
+    "leader is null".
+    """
+    match = _CONDITION.match(text)
+    if not match:
+        raise FilterError(f"Не удалось разобрать условие: {text}")
+    op = " ".join(match["word"].lower().split()) if match["word"] else match["sign"]
+    if op == "!=":
+        op = NE
+    value = match["value"]
+    if op in _NULL_CHECKS:
+        if value:
+            raise FilterError(f"Лишнее значение в условии: {text}")
+    elif not value:
+        raise FilterError(f"Не указано значение в условии: {text}")
+    return Condition(match["column"], op, value)
+
+
+def operators(column):
+    """Операции, применимые к столбцу (по его типу)"""
+    if column.type.startswith(_TEXT_TYPES):
+        ops = (EQ, NE, PREFIX, CONTAINS, IN)
+    elif column.type == "boolean":
+        ops = (EQ,)
+    elif _is_ordered(column):
+        ops = (EQ, NE, LT, LE, GT, GE, BETWEEN, IN)
+    else:
+        ops = (EQ, NE, IN)
+    return ops + (_NULL_CHECKS if column.nullable else ())
+
+
+def parse_value(column, text):
+    """Значение условия, приведенное к типу столбца"""
+    text = text.strip()
+    kind = column.type
+    try:
+        if kind.startswith(_INTEGER_TYPES):
+            return int(text)
+        if kind.startswith(_NUMERIC_TYPES):
+            return decimal.Decimal(text.replace(",", "."))
+        if kind == "date":
+            return datetime.date.fromisoformat(text)
+        if kind.startswith("timestamp"):
+            return datetime.datetime.fromisoformat(text)
+        if kind == "boolean":
+            lowered = text.lower()
+            if lowered in ("да", "true", "t", "1", "yes"):
+                return True
+            if lowered in ("нет", "false", "f", "0", "no"):
+                return False
+            raise ValueError(text)
+    except (ValueError, decimal.InvalidOperation):
+        raise FilterError(f"Поле {column.name}: значение «{text}» не подходит для типа {kind}")
+    return text
+
+
+def condition_sql(table, condition, mode=ILIKE):
+    """Условие фильтра в SQL: пара (sql.Composable, параметры).
+
+    Поле проверяется по структуре таблицы, значение приводится к типу
+    столбца, поэтому сравнения и списки используют индексы по полю (а
+    для ключа секционирования - отсекают секции). Подстрока и префикс
+    текста дополнительно проверяются условием поиска по всем полям, чтобы
+    строки отбирались GIN-индексом поиска (mode - режим поиска).
+    """
+    column = _checked_column(table, condition)
+    field = sql.Identifier(column.name)
+    op = condition.op
+    if op == IS_NULL:
+        return sql.SQL("{} IS NULL").format(field), []
+    if op == NOT_NULL:
+        return sql.SQL("{} IS NOT NULL").format(field), []
+    if op == BETWEEN:
+        return sql.SQL("{} BETWEEN %s AND %s").format(field), _range_values(column, condition)
+    if op == IN:
+        return sql.SQL("{} = ANY(%s)").format(field), [_list_values(column, condition)]
+    if op in (PREFIX, CONTAINS):
+        text = _like_escape(condition.value.strip())
+        pattern = text + "%" if op == PREFIX else "%" + text + "%"
+        where = sql.SQL("{} ILIKE %s").format(field)
+        # Строка, подходящая под условие, находится и поиском того же текста
+        # по всем полям; его условие отбирается индексом поиска. Для tsvector
+        # это верно только для префикса: подстрока может быть серединой слова
+        if column.name in search_columns(table) and (mode == TRGM or mode == TSV and op == PREFIX):
+            found = search_condition(table, condition.value, mode)
+            if found is not None:
+                return sql.SQL("{} AND {}").format(found[0], where), found[1] + [pattern]
+        return where, [pattern]
+    return sql.SQL("{} {} %s").format(field, sql.SQL(op)), [parse_value(column, condition.value)]
+
+
+def filter_sql(table, flt, mode=ILIKE):
+    """Фильтр в SQL: пара (sql.Composable, параметры) или None, если
+    условий нет.
+    """
+    if not flt.conditions:
+        return None
+    parts = [condition_sql(table, condition, mode) for condition in flt.conditions]
+    joiner = sql.SQL(" AND ") if flt.combine == AND else sql.SQL(" OR ")
+    condition = joiner.join(sql.SQL("({})").format(part) for part, params in parts)
+    return condition, [param for part, params in parts for param in params]
+
+
+_COMPARE = {EQ: operator.eq, NE: operator.ne, LT: operator.lt, LE: operator.le,
+            GT: operator.gt, GE: operator.ge}
+
+
+def condition_predicate(table, condition):
+    """Условие фильтра в виде функции значения столбца - для отбора уже
+    загруженных строк без запроса (QueryTableModel.filter_loaded).
+
+    Как и в SQL, NULL не удовлетворяет сравнениям; начало и подстрока
+    текста, как ILIKE, сравниваются без учета регистра.
+    """
+    column = _checked_column(table, condition)
+    op = condition.op
+    if op == IS_NULL:
+        return lambda value: value is None
+    if op == NOT_NULL:
+        return lambda value: value is not None
+    if op == BETWEEN:
+        low, high = _range_values(column, condition)
+        return lambda value: value is not None and low <= value <= high
+    if op == IN:
+        values = set(_list_values(column, condition))
+        return lambda value: value in values
+    if op in (PREFIX, CONTAINS):
+        text = condition.value.strip().casefold()
+        if op == PREFIX:
+            return lambda value: value is not None and str(value).casefold().startswith(text)
+        return lambda value: value is not None and text in str(value).casefold()
+    compare = _COMPARE[op]
+    expected = parse_value(column, condition.value)
+    return lambda value: value is not None and compare(value, expected)
+
+
+def _checked_column(table, condition):
+    """Столбец условия, проверенный по структуре таблицы"""
+    column = table.column(condition.column)
+    if column is None:
+        raise FilterError(f"В таблице {table.name} нет поля {condition.column}")
+    if condition.op not in operators(column):
+        raise FilterError(f"Операция {OPERATOR_LABELS.get(condition.op, condition.op)} "
+                          f"неприменима к полю {column.name} ({column.type})")
+    return column
+
+
+def _range_values(column, condition):
+    low, sep, high = condition.value.partition("..")
+    if not sep:
+        raise FilterError(f"Поле {column.name}: диапазон задается как «от..до»")
+    return [parse_value(column, low), parse_value(column, high)]
+
+
+def _list_values(column, condition):
+    values = [parse_value(column, item) for item in condition.value.split(",") if item.strip()]
+    if not values:
+        raise FilterError(f"Поле {column.name}: пустой список значений")
+    return values
+
+
+def _is_ordered(column):
+    return column.type.startswith(_INTEGER_TYPES + _NUMERIC_TYPES + ("date", "timestamp", "time"))
+
+
+def _like_escape(text):
+    return re.sub(r"([\\%_])", r"\\\1", text)
+
+
+class SavedFilters:
+    """Сохраненные фильтры (файл JSON): имя -> таблица и условия.
+
+    Файл общий для окна и командной строки (путь можно задать в
+    CAR_SERVICE_FILTERS).
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("CAR_SERVICE_FILTERS", FILTERS_FILE)
+        self._lock = threading.Lock()
+
+    def names(self, table=None):
+        """Имена сохраненных фильтров (только для таблицы table, если задана).
+
+        Поврежденные записи (файл правили вручную) пропускаются.
+        """
+        with self._lock:
+            saved = self._load()
+        return sorted(name for name, data in saved.items()
+                      if _valid_entry(data) and (table is None or data["table"] == table))
+
+    def get(self, name):
+        """Пара (таблица, Filter) по имени"""
+        with self._lock:
+            data = self._load().get(name)
+        if data is None:
+            raise FilterError(f"Нет сохраненного фильтра {name}")
+        if not _valid_entry(data):
+            raise FilterError(f"Сохраненный фильтр {name} поврежден")
+        return data["table"], Filter.from_dict(data)
+
+    def save(self, name, table, flt):
+        """Сохранение фильтра (существующий с тем же именем заменяется)"""
+        with self._lock:
+            saved = self._load()
+            saved[name] = dict(table=table, **flt.to_dict())
+            self._save(saved)
+
+    def delete(self, name):
+        """Удаление фильтра; False, если его не было"""
+        with self._lock:
+            saved = self._load()
+            if saved.pop(name, None) is None:
+                return False
+            self._save(saved)
+            return True
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, encoding="utf-8") as f:
+            saved = json.load(f)
+        if not isinstance(saved, dict):
+            raise ValueError(f"Неверный формат файла фильтров {self.path}")
+        return saved
+
+    def _save(self, saved):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(saved, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def _valid_entry(data):
+    """Запись файла фильтров в ожидаемом виде: таблица и список условий-строк"""
+    return (isinstance(data, dict) and isinstance(data.get("table"), str)
+            and isinstance(data.get("conditions"), list)
+            and all(isinstance(text, str) for text in data["conditions"]))
@@ -0,0 +1,144 @@
+from collections import OrderedDict
+
+from PyQt6.QtCore import QStringListModel, Qt, QTimer
+from PyQt6.QtWidgets import QCompleter, QLineEdit
+
+from lookup import LOOKUP_LIMIT, lookup, lookup_label, parse_key
+from search import ILIKE
+
+
+RECENT_PICKS = 10    # недавно выбранных строк на справочник
+LOOKUP_DELAY = 250   # мс после ввода до запроса
+
+# Недавно выбранные строки: таблица -> {ключ: подпись}, общие для всех полей
+_recent = {}
+
+
+class ForeignKeyPicker(QLineEdit):
+    """Поле выбора строки справочника по внешнему ключу.
+
+    По мере ввода в фоне запрашиваются не больше LOOKUP_LIMIT подходящих
+    строк таблицы table (см. lookup.lookup); в пустом поле предлагаются
+    недавно выбранные строки. value() - ключ выбранной строки или
+    введенное вручную значение ключа.
+
+    Если справочник есть в локальной копии mirror (mirror.LocalMirror),
+    строки ищутся в ней, без запросов к БД.
+    """
+
+    def __init__(self, runner, table, key_column, search_mode=ILIKE, parent=None, mirror=None):
+        super().__init__(parent)
+        self.runner = runner
+        self.mirror = mirror
+        self.table = table
+        self.key_column = key_column
+        self.search_mode = search_mode
+        self._choices = {}     # подпись -> ключ для текущего списка
+        self._key = None       # выбранный ключ
+        self._label = None     # подпись выбранного ключа
+        self._request = 0      # номер запроса, чтобы отбросить устаревшие ответы
+
+        self.setPlaceholderText(f"Поиск в {table.name}...")
+        self._model = QStringListModel(self)
+        completer = QCompleter(self._model, self)
+        completer.setCompletionMode(QCompleter.CompletionMode.UnfilteredPopupCompletion)
+        completer.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        completer.setMaxVisibleItems(LOOKUP_LIMIT)
+        completer.activated.connect(self._on_picked)
+        self.setCompleter(completer)
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(LOOKUP_DELAY)
+        self._timer.timeout.connect(self._search)
+        self.textEdited.connect(self._on_text_edited)
+
+    def value(self):
+        """Ключ выбранной строки; None, если поле пусто или текст не распознан"""
+        text = self.text().strip()
+        if self._key is not None and text == self._label:
+            return self._key
+        return parse_key(self.table, self.key_column, text)
+
+    def set_value(self, key):
+        """Установка значения ключа; подпись строки загружается в фоне"""
+        self._request += 1
+        self._key = key
+        self._label = None if key is None else str(key)
+        self.setText(self._label or "")
+        if key is None:
+            return
+        recent = _recent.get(self.table.name, {})
+        if key in recent:
+            self._set_label(key, recent[key])
+            return
+        request = self._request
+
+        def on_found(label):
+            if label is not None and request == self._request:
+                self._set_label(key, label)
+
+        self._submit(lambda conn: lookup_label(conn, self.table, self.key_column, key),
+                     lambda: self.mirror.lookup_label(self.table, self.key_column, key),
+                     on_found)
+
+    def focusInEvent(self, event):
+        super().focusInEvent(event)
+        if not self.text():
+            self._show_recent()
+
+    def _set_label(self, key, label):
+        self._key = key
+        self._label = label
+        self.setText(label)
+
+    def _on_text_edited(self, text):
+        if not text.strip():
+            self._timer.stop()
+            self._show_recent()
+        else:
+            self._timer.start()
+
+    def _show_recent(self):
+        recent = _recent.get(self.table.name, {})
+        self._show_choices(list(reversed(recent.items())))
+
+    def _search(self):
+        self._request += 1
+        request = self._request
+        text = self.text()
+
+        def on_found(rows):
+            if request == self._request:
+                self._show_choices(rows)
+
+        self._submit(lambda conn: lookup(conn, self.table, self.key_column, text, self.search_mode),
+                     lambda: self.mirror.lookup(self.table, self.key_column, text),
+                     on_found)
+
+    def _submit(self, query, local, on_result):
+        """Поиск в фоне: в локальной копии, если справочник в ней есть, иначе в БД"""
+        if self.mirror is not None and self.table.name in self.mirror:
+            fn, conn = (lambda conn: local()), (lambda: None)
+        else:
+            fn, conn = query, None
+        self.runner.submit(fn, on_result=on_result, on_error=lambda e: None,
+                           description=f"Поиск в {self.table.name}", conn=conn, readonly=True)
+
+    def _show_choices(self, rows):
+        self._choices = {label: key for key, label in rows}
+        self._model.setStringList(list(self._choices))
+        if rows and self.hasFocus():
+            self.completer().complete()
+
+    def _on_picked(self, label):
+        if label not in self._choices:
+            return
+        key = self._choices[label]
+        self._request += 1
+        self._set_label(key, label)
+        recent = _recent.setdefault(self.table.name, OrderedDict())
+        recent[key] = label
+        recent.move_to_end(key)
+        while len(recent) > RECENT_PICKS:
+            recent.popitem(last=False)
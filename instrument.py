@@ -0,0 +1,313 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import psycopg2
+import psycopg2.extensions
+
+
+LOG_SIZE = 5000  # сколько последних запросов хранится в журнале
+
+# Модули, вызовы из которых не считаются источником запроса
+_INFRASTRUCTURE = {os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+                   for name in ("instrument.py", "workers.py", "table_model.py")}
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_LIST = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+_SPACE = re.compile(r"\s+")
+
+_context = threading.local()
+
+
+def fingerprint(text):
+    """Текст запроса без значений: литералы заменены на ?, списки свернуты"""
+    text = _STRING.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = text.replace("%s", "?")
+    text = re.sub(r"%\(\w+\)s", "?", text)
+    text = _LIST.sub("(...)", text)
+    return _SPACE.sub(" ", text).strip()
+
+
+@contextmanager
+def origin(name):
+    """Источник запросов, выполняемых в блоке with (в текущем потоке)"""
+    previous = getattr(_context, "origin", None)
+    _context.origin = name
+    try:
+        yield
+    finally:
+        _context.origin = previous
+
+
+def caller_origin():
+    """Метод, из которого идет вызов: SimpleDBApp.load_table и т.п."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        if os.path.abspath(code.co_filename) not in _INFRASTRUCTURE:
+            name = getattr(code, "co_qualname", code.co_name)
+            return name.replace(".<locals>", "")
+        frame = frame.f_back
+    return None
+
+
+@dataclass
+class QueryRecord:
+    """Выполненный запрос"""
+    sql: str
+    params: object
+    origin: str
+    started: datetime
+    duration: float = 0.0      # секунды: выполнение и чтение результата
+    rows: int = 0
+    bytes: int = 0             # примерный объем прочитанных данных (текстом)
+    error: str = None
+    fingerprint: str = field(init=False)
+
+    def __post_init__(self):
+        self.fingerprint = fingerprint(self.sql)
+
+    def to_dict(self):
+        return {
+            "started": self.started.isoformat(timespec="milliseconds"),
+            "duration_ms": round(self.duration * 1000, 3),
+            "origin": self.origin,
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "error": self.error,
+            "sql": self.sql,
+            "params": _printable(self.params),
+        }
+
+
+class QueryLog:
+    """Журнал последних запросов и файл медленных запросов.
+
+    Запрос, выполнявшийся (вместе с чтением результата) дольше
+    slow_query_ms, один раз дописывается в slow_query_log строкой JSON.
+    """
+
+    def __init__(self, size=LOG_SIZE):
+        self._records = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.slow_query_ms = 0
+        self.slow_query_log = None
+        self._logged = set()  # id записей, уже попавших в файл
+
+    def configure(self, slow_query_ms, slow_query_log):
+        """Порог медленного запроса (мс, 0 - не записывать) и путь к файлу"""
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_log = slow_query_log or None
+
+    def add(self, record):
+        with self._lock:
+            self._records.append(record)
+
+    def records(self):
+        """Копия журнала, от старых запросов к новым"""
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._logged.clear()
+
+    def check_slow(self, record):
+        """Запись медленного запроса в файл"""
+        if (not self.slow_query_ms or not self.slow_query_log
+                or record.duration * 1000 < self.slow_query_ms):
+            return
+        with self._lock:
+            if id(record) in self._logged:
+                return
+            self._logged.add(id(record))
+            if len(self._logged) > LOG_SIZE:
+                self._logged.clear()
+            try:
+                with open(self.slow_query_log, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record.to_dict(), ensure_ascii=False, default=str) + "\n")
+            except OSError:
+                pass
+
+
+query_log = QueryLog()
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Курсор, записывающий каждый запрос в query_log.
+
+    Для серверных курсоров время и строки чтения добавляются к записи
+    запроса, открывшего курсор.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._record = None
+
+    def execute(self, query, vars=None):
+        self._record = self._start(query, vars)
+        self._timed(super().execute, query, vars)
+        # Строки SELECT считаются при чтении, для остальных - rowcount
+        if self.description is None and self.name is None:
+            self._record.rows = max(self.rowcount, 0)
+
+    def executemany(self, query, vars_list):
+        self._record = self._start(query, None)
+        self._timed(super().executemany, query, vars_list)
+        self._record.rows += max(self.rowcount, 0)
+
+    def copy_expert(self, sql, file, size=8192):
+        self._record = self._start(sql, None)
+        self._timed(super().copy_expert, sql, file, size)
+        self._record.rows += max(self.rowcount, 0)
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        self._count([row] if row is not None else [])
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        self._count(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._count(rows)
+        return rows
+
+    def __iter__(self):
+        # Итерация идет через fetchone/fetchmany, чтобы строки попали в журнал
+        while True:
+            rows = self.fetchmany(self.itersize if self.name else self.arraysize or 1000)
+            if not rows:
+                return
+            yield from rows
+
+    def _start(self, query, params):
+        if isinstance(query, bytes):
+            query = query.decode(psycopg2.extensions.encodings[self.connection.encoding])
+        elif not isinstance(query, str):
+            query = query.as_string(self.connection)
+        record = QueryRecord(query, _copy_params(params),
+                             getattr(_context, "origin", None) or caller_origin(),
+                             datetime.now())
+        query_log.add(record)
+        return record
+
+    def _timed(self, method, *args):
+        record = self._record
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        except psycopg2.Error as e:
+            if record is not None:
+                record.error = str(e).strip().splitlines()[0] if str(e).strip() else type(e).__name__
+            raise
+        finally:
+            if record is not None:
+                record.duration += time.perf_counter() - started
+                query_log.check_slow(record)
+
+    def _count(self, rows):
+        if self._record is None:
+            return
+        self._record.rows += len(rows)
+        self._record.bytes += sum(len(str(value)) for row in rows for value in row
+                                  if value is not None)
+
+
+def explain(conn, record):
+    """План запроса из журнала: EXPLAIN (ANALYZE, BUFFERS) в откатываемой транзакции.
+
+    Запрос действительно выполняется, изменения данных откатываются.
+    Возвращает текст плана.
+    """
+    if record.sql.lstrip().upper().startswith(("COPY", "EXPLAIN", "BEGIN", "COMMIT", "ROLLBACK",
+                                               "SET ", "SHOW", "DECLARE", "CLOSE", "FETCH")):
+        raise ValueError("Для этого оператора план не строится")
+    cursor = conn.cursor()
+    try:
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + record.sql, record.params)
+        return "\n".join(row[0] for row in cursor.fetchall())
+    finally:
+        conn.rollback()
+
+
+def _copy_params(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return dict(params)
+    return list(params)
+
+
+def _printable(params):
+    if isinstance(params, dict):
+        return {key: _short(value) for key, value in params.items()}
+    if params is not None:
+        return [_short(value) for value in params]
+    return None
+
+
+def _short(value, limit=200):
+    """Значение параметра для журнала: длинные значения обрезаются"""
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    text = str(value)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+# Границы интервалов гистограммы времени выполнения, мс
+HISTOGRAM_BOUNDS = (1, 3, 10, 30, 100, 300, 1000, 3000)
+
+
+def histogram(durations, bounds=HISTOGRAM_BOUNDS):
+    """Число запросов по интервалам времени (секунды -> интервалы bounds в мс)"""
+    counts = [0] * (len(bounds) + 1)
+    for duration in durations:
+        ms = duration * 1000
+        index = 0
+        while index < len(bounds) and ms >= bounds[index]:
+            index += 1
+        counts[index] += 1
+    return counts
+
+
+def summarize(records):
+    """Сводка по отпечаткам запросов, от самых затратных по общему времени.
+
+    Возвращает список словарей: fingerprint, origins, calls, total, p50,
+    p95, max (секунды), rows, bytes, errors.
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(record.fingerprint, []).append(record)
+
+    summary = []
+    for key, group in groups.items():
+        durations = sorted(record.duration for record in group)
+        summary.append({
+            "fingerprint": key,
+            "origins": sorted({record.origin or "" for record in group}),
+            "calls": len(group),
+            "total": sum(durations),
+            "p50": durations[(len(durations) - 1) // 2],
+            "p95": durations[max(0, -(-len(durations) * 95 // 100) - 1)],
+            "max": durations[-1],
+            "rows": sum(record.rows for record in group),
+            "bytes": sum(record.bytes for record in group),
+            "errors": sum(1 for record in group if record.error),
+        })
+    summary.sort(key=lambda item: item["total"], reverse=True)
+    return summary
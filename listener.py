@@ -0,0 +1,132 @@
+import json
+
+import psycopg2
+import psycopg2.extensions
+from PyQt6.QtCore import QObject, QSocketNotifier, QTimer, pyqtSignal
+
+
+CHANNEL = "car_service_changes"
+
+
+def notify_triggers_installed(conn):
+    """Установлены ли триггеры оповещения (миграция 0007_change_notify)"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regprocedure('notify_change()') IS NOT NULL")
+    return cursor.fetchone()[0]
+
+
+class ChangeListener(QObject):
+    """Прием оповещений об изменениях таблиц (LISTEN/NOTIFY).
+
+    Держит отдельное соединение в режиме autocommit и ждет сообщений
+    через QSocketNotifier, не блокируя интерфейс. Соединение
+    устанавливается в фоне через QueryRunner: при недоступной БД
+    попытки подключения не останавливают окно. Сообщение передается
+    сигналом changed(таблица, операция, ключи, удаленные ключи); для
+    операции RELOAD ключей нет. Разорванное соединение восстанавливается
+    каждые RECONNECT_INTERVAL мс, после чего испускается reconnected:
+    сообщения за время разрыва потеряны.
+    """
+
+    changed = pyqtSignal(str, str, list, list)
+    reconnected = pyqtSignal()
+
+    RECONNECT_INTERVAL = 5000
+
+    def __init__(self, runner, parent=None):
+        super().__init__(parent)
+        self.runner = runner
+        self.config = runner.db.config
+        self.conn = None
+        self._notifier = None
+        self._was_connected = False
+        self._connecting = None  # задача подключения
+        self._attempt = 0  # номер попытки подключения, чтобы отбросить устаревшие
+        self._reconnect_timer = QTimer(self)
+        self._reconnect_timer.setSingleShot(True)
+        self._reconnect_timer.setInterval(self.RECONNECT_INTERVAL)
+        self._reconnect_timer.timeout.connect(self.start)
+
+    def start(self):
+        """Подключение и подписка на оповещения (в фоне)"""
+        if self._connecting is not None or self.conn is not None:
+            return
+        self._attempt += 1
+        attempt = self._attempt
+        self._connecting = self.runner.submit(
+            lambda conn: self._connect(),
+            conn=lambda: None,
+            on_result=lambda conn: self._on_connected(attempt, conn),
+            on_error=lambda error: self._on_connect_failed(attempt),
+            description="Подключение к оповещениям")
+
+    def _connect(self):
+        """Соединение с подпиской на оповещения (в фоновом потоке)"""
+        conn = psycopg2.connect(self.config["dsn"], connect_timeout=self.config["connect_timeout"])
+        try:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            conn.cursor().execute(f"LISTEN {CHANNEL}")
+        except psycopg2.Error:
+            conn.close()
+            raise
+        return conn
+
+    def _on_connect_failed(self, attempt):
+        if attempt != self._attempt:
+            return
+        self._connecting = None
+        self._reconnect_timer.start()
+
+    def _on_connected(self, attempt, conn):
+        if attempt != self._attempt:
+            # Слушатель остановлен, пока шло подключение
+            conn.close()
+            return
+        self._connecting = None
+        self.conn = conn
+        self._notifier = QSocketNotifier(self.conn.fileno(), QSocketNotifier.Type.Read, self)
+        self._notifier.activated.connect(self._poll)
+        if self._was_connected:
+            self.reconnected.emit()
+        self._was_connected = True
+
+    def is_active(self):
+        return self.conn is not None
+
+    def stop(self):
+        """Отключение"""
+        self._reconnect_timer.stop()
+        self._attempt += 1
+        if self._connecting is not None:
+            self._connecting.cancel()
+            self._connecting = None
+        self._disconnect()
+
+    def _disconnect(self):
+        if self._notifier is not None:
+            self._notifier.setEnabled(False)
+            self._notifier.deleteLater()
+            self._notifier = None
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except psycopg2.Error:
+                pass
+            self.conn = None
+
+    def _poll(self):
+        try:
+            self.conn.poll()
+        except psycopg2.Error:
+            self._disconnect()
+            self._reconnect_timer.start()
+            return
+
+        while self.conn.notifies:
+            notify = self.conn.notifies.pop(0)
+            try:
+                message = json.loads(notify.payload)
+            except ValueError:
+                continue
+            self.changed.emit(message.get("table", ""), message.get("op", ""),
+                              message.get("keys", []), message.get("old_keys", []))
@@ -0,0 +1,92 @@
+from psycopg2 import sql
+
+from search import ILIKE, search_columns, search_condition
+
+
+LOOKUP_LIMIT = 20  # строк в списке подсказок
+
+# Столбцы, по которым строка справочника узнается в списке; для остальных
+# таблиц берутся первые текстовые столбцы
+LOOKUP_LABELS = {
+    "cars": ("owner", "body_number"),
+    "faults": ("name", "work_cost"),
+    "teams": ("name",),
+    "workshops": ("name",),
+    "car_repair": ("admission_date", "car_id", "fault_id"),
+}
+
+_INTEGER_TYPES = ("smallint", "integer", "bigint")
+
+
+def label_columns(table):
+    """Столбцы подписи строки справочника"""
+    columns = LOOKUP_LABELS.get(table.name)
+    if columns and all(table.column(col) is not None for col in columns):
+        return list(columns)
+    text = [col for col in search_columns(table)
+            if col not in table.primary_key and not table.column(col).type.startswith(
+                _INTEGER_TYPES)]
+    return text[:2] or list(table.primary_key)
+
+
+def format_label(values):
+    """Подпись строки: первое значение, остальные - в скобках"""
+    values = ["" if value is None else str(value) for value in values]
+    if len(values) == 1:
+        return values[0]
+    return f"{values[0]} ({', '.join(values[1:])})"
+
+
+def parse_key(table, key_column, text):
+    """Значение ключа, введенное вручную (None, если текст не похож на ключ)"""
+    text = text.strip()
+    if table.column(key_column).type.startswith(_INTEGER_TYPES):
+        return int(text) if text.isdigit() else None
+    return text or None
+
+
+def lookup(conn, table, key_column, text, mode=ILIKE, limit=LOOKUP_LIMIT):
+    """Строки справочника table, подходящие под введенный текст.
+
+    Текст ищется по всем полям тем же условием, что и поиск в таблице
+    (индекс pg_trgm или tsvector), число - еще и как значение ключа.
+    Возвращает не больше limit пар (ключ, подпись).
+    """
+    labels = label_columns(table)
+    conditions = []
+    params = []
+    found = search_condition(table, text, mode)
+    if found is not None:
+        conditions.append(found[0])
+        params.extend(found[1])
+    key = parse_key(table, key_column, text)
+    if key is not None:
+        conditions.append(sql.SQL("{} = %s").format(sql.Identifier(key_column)))
+        params.append(key)
+
+    query = sql.SQL("SELECT {}, {} FROM {}").format(
+        sql.Identifier(key_column), sql.SQL(", ").join(map(sql.Identifier, labels)),
+        sql.Identifier(table.name))
+    if conditions:
+        query += sql.SQL(" WHERE {}").format(sql.SQL(" OR ").join(conditions))
+    query += sql.SQL(" ORDER BY {} LIMIT %s").format(
+        sql.SQL(", ").join(map(sql.Identifier, labels)))
+    params.append(limit)
+
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    rows = [(row[0], format_label(row[1:])) for row in cursor.fetchall()]
+    conn.rollback()
+    return rows
+
+
+def lookup_label(conn, table, key_column, key):
+    """Подпись строки справочника по значению ключа (None, если строки нет)"""
+    query = sql.SQL("SELECT {} FROM {} WHERE {} = %s").format(
+        sql.SQL(", ").join(map(sql.Identifier, label_columns(table))),
+        sql.Identifier(table.name), sql.Identifier(key_column))
+    cursor = conn.cursor()
+    cursor.execute(query, (key,))
+    row = cursor.fetchone()
+    conn.rollback()
+    return format_label(row) if row is not None else None
@@ -0,0 +1,231 @@
+import os
+import re
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Разделитель частей применения и отката в файле миграции
+DOWN_MARKER = "-- migrate:down"
+
+# Отметка миграции, которая выполняется вне транзакции (CREATE INDEX
+# CONCURRENTLY): операторы выполняются по одному в режиме autocommit.
+# Такая миграция должна допускать повторное выполнение (IF NOT EXISTS):
+# при ошибке уже выполненные операторы не отменяются.
+NO_TRANSACTION_MARKER = "-- migrate:no-transaction"
+
+_FILE_NAME = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+# Конец оператора в миграции без транзакции - точка с запятой в конце строки
+_STATEMENT_END = re.compile(r";[ \t]*(?:\r?\n|$)")
+
+# Ключ блокировки, чтобы две копии не применяли миграции одновременно
+_LOCK_KEY = 0x43415253  # "CARS"
+
+# Ожидание блокировок таблиц в миграции: при долгом чужом запросе миграция
+# завершается ошибкой, а не останавливает на это время работу с таблицей.
+# statement_timeout из настроек соединения в миграциях снимается - перенос
+# данных может идти дольше.
+LOCK_TIMEOUT = "30s"
+
+_VERSION_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+# Внешние ключи, для столбцов которых нет индекса, начинающегося с них
+# (в любом порядке)
+_MISSING_FK_INDEXES_SQL = """
+    SELECT c.conrelid::regclass::text,
+           c.conname,
+           array(SELECT a.attname
+                 FROM unnest(c.conkey) WITH ORDINALITY k(attnum, ord)
+                 JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+                 ORDER BY k.ord)
+    FROM pg_constraint c
+    JOIN pg_class t ON t.oid = c.conrelid
+    WHERE c.contype = 'f'
+      AND t.relnamespace = current_schema()::regnamespace
+      AND NOT EXISTS (
+          SELECT 1
+          FROM pg_index i
+          WHERE i.indrelid = c.conrelid
+            AND i.indpred IS NULL
+            AND (i.indkey::int2[])[0:cardinality(c.conkey) - 1] @> c.conkey
+      )
+    ORDER BY 1, 2
+"""
+
+
+class MigrationError(Exception):
+    """Ошибка в наборе миграций или в запрошенной версии"""
+
+
+@dataclass(frozen=True)
+class Migration:
+    """Файл миграции migrations/NNNN_имя.sql"""
+    version: int
+    name: str
+    up: str
+    down: str = ""
+    transaction: bool = True
+
+
+def available_migrations(path=None):
+    """Миграции из каталога, по возрастанию версии"""
+    path = path or MIGRATIONS_DIR
+    migrations = []
+    for file_name in sorted(os.listdir(path)):
+        match = _FILE_NAME.match(file_name)
+        if match is None:
+            continue
+        with open(os.path.join(path, file_name), encoding="utf-8") as f:
+            up, _, down = f.read().partition(DOWN_MARKER)
+        migrations.append(Migration(int(match.group(1)), match.group(2), up, down.strip(),
+                                    NO_TRANSACTION_MARKER not in up))
+
+    versions = [m.version for m in migrations]
+    duplicates = sorted({v for v in versions if versions.count(v) > 1})
+    if duplicates:
+        raise MigrationError(f"Повторяются номера миграций: {', '.join(map(str, duplicates))}")
+    return sorted(migrations, key=lambda m: m.version)
+
+
+def applied_versions(conn):
+    """Номера примененных миграций (пустой список, если таблицы версий нет)"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        conn.rollback()
+        return []
+    cursor.execute("SELECT version FROM schema_version ORDER BY version")
+    versions = [row[0] for row in cursor.fetchall()]
+    conn.rollback()
+    return versions
+
+
+def migrate(conn, target=None, migrations=None, on_step=None):
+    """Применение миграций до версии target (по умолчанию - до последней).
+
+    Каждая миграция выполняется в своей транзакции вместе с записью в
+    schema_version (миграция с NO_TRANSACTION_MARKER - вне транзакции, и
+    запись добавляется после всех ее операторов). on_step(миграция)
+    вызывается перед выполнением. Возвращает список примененных миграций.
+    """
+    migrations = available_migrations() if migrations is None else migrations
+    if target is not None and target not in {m.version for m in migrations} | {0}:
+        raise MigrationError(f"Нет миграции с номером {target}")
+
+    done = []
+    for migration in migrations:
+        if target is not None and migration.version > target:
+            break
+        with _locked(conn, migration.transaction) as cursor:
+            cursor.execute("SELECT 1 FROM schema_version WHERE version = %s", (migration.version,))
+            if cursor.fetchone():
+                continue
+            if on_step is not None:
+                on_step(migration)
+            _execute(cursor, migration, migration.up)
+            cursor.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)",
+                           (migration.version, migration.name))
+        done.append(migration)
+    return done
+
+
+def rollback(conn, target, migrations=None, on_step=None):
+    """Откат примененных миграций с номером больше target (в обратном порядке).
+
+    Возвращает список отмененных миграций.
+    """
+    migrations = available_migrations() if migrations is None else migrations
+    by_version = {m.version: m for m in migrations}
+
+    done = []
+    for version in reversed(applied_versions(conn)):
+        if version <= target:
+            break
+        migration = by_version.get(version)
+        if migration is None:
+            raise MigrationError(f"Нет файла примененной миграции {version}")
+        if not migration.down:
+            raise MigrationError(f"Миграцию {version}_{migration.name} нельзя откатить")
+        with _locked(conn, migration.transaction) as cursor:
+            if on_step is not None:
+                on_step(migration)
+            _execute(cursor, migration, migration.down)
+            cursor.execute("DELETE FROM schema_version WHERE version = %s", (version,))
+        done.append(migration)
+    return done
+
+
+def missing_fk_indexes(conn):
+    """Внешние ключи без индекса по своим столбцам.
+
+    Проверяются все таблицы текущей схемы, включая добавленные позже.
+    Возвращает список (таблица, ограничение, столбцы).
+    """
+    cursor = conn.cursor()
+    cursor.execute(_MISSING_FK_INDEXES_SQL)
+    result = [(table, name, tuple(columns)) for table, name, columns in cursor.fetchall()]
+    conn.rollback()
+    return result
+
+
+@contextmanager
+def _locked(conn, transaction=True):
+    """Курсор под блокировкой миграций.
+
+    В транзакции блокировка и таймауты действуют до ее конца, транзакция
+    фиксируется при выходе без ошибки. Без транзакции соединение на время
+    переводится в autocommit, блокировка берется на сеанс, а
+    lock_timeout не задается: CREATE INDEX CONCURRENTLY ждет завершения
+    всех начатых транзакций, не мешая им.
+    """
+    cursor = conn.cursor()
+    if transaction:
+        try:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_LOCK_KEY,))
+            cursor.execute("SET LOCAL statement_timeout = 0")
+            cursor.execute("SELECT set_config('lock_timeout', %s, true)", (LOCK_TIMEOUT,))
+            cursor.execute(_VERSION_TABLE_SQL)
+            yield cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return
+
+    conn.rollback()
+    conn.autocommit = True
+    try:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (_LOCK_KEY,))
+        try:
+            cursor.execute("SET statement_timeout = 0")
+            cursor.execute(_VERSION_TABLE_SQL)
+            yield cursor
+        finally:
+            cursor.execute("RESET statement_timeout")
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (_LOCK_KEY,))
+    finally:
+        conn.autocommit = False
+
+
+def _execute(cursor, migration, script):
+    if migration.transaction:
+        cursor.execute(script)
+        return
+    # Несколько операторов в одном запросе PostgreSQL выполняет в одной
+    # транзакции, поэтому они отправляются по одному
+    for statement in _STATEMENT_END.split(script):
+        if _strip_comments(statement):
+            cursor.execute(statement)
+
+
+def _strip_comments(statement):
+    return "\n".join(line for line in statement.splitlines()
+                     if not line.strip().startswith("--")).strip()
@@ -0,0 +1,40 @@
+-- Индексы для соединений и фильтров отчетов и для внешних ключей.
+--
+-- Отчеты соединяют car_repair и spare_parts по (car_id, fault_id) и
+-- фильтруют car_repair по admission_date; отчет по бригадам соединяет
+-- personnel по team_id. Индексы по внешним ключам нужны также для
+-- каскадного удаления и ON DELETE SET NULL: без них каждое удаление
+-- строки родительской таблицы просматривает дочернюю целиком.
+--
+-- Для admission_date выбран B-tree, а не BRIN: даты ремонтов не связаны
+-- с физическим порядком строк (импорт, правка задним числом).
+--
+-- Индексы строятся CONCURRENTLY, не останавливая запись в таблицы, поэтому
+-- миграция выполняется вне транзакции. Если построение прервалось,
+-- оставшийся недействительный индекс нужно удалить (DROP INDEX
+-- CONCURRENTLY) и применить миграцию снова.
+-- migrate:no-transaction
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS car_repair_admission_date_idx
+    ON car_repair (admission_date) INCLUDE (car_id, fault_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS car_repair_car_fault_idx ON car_repair (car_id, fault_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS car_repair_fault_id_idx ON car_repair (fault_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS car_repair_team_id_idx ON car_repair (team_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS spare_parts_car_fault_idx
+    ON spare_parts (car_id, fault_id) INCLUDE (price, quantity);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS spare_parts_fault_id_idx ON spare_parts (fault_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS personnel_team_id_idx ON personnel (team_id);
+
+ANALYZE car_repair, spare_parts, personnel;
+
+-- migrate:down
+
+DROP INDEX CONCURRENTLY IF EXISTS car_repair_admission_date_idx;
+DROP INDEX CONCURRENTLY IF EXISTS car_repair_car_fault_idx;
+DROP INDEX CONCURRENTLY IF EXISTS car_repair_fault_id_idx;
+DROP INDEX CONCURRENTLY IF EXISTS car_repair_team_id_idx;
+DROP INDEX CONCURRENTLY IF EXISTS spare_parts_car_fault_idx;
+DROP INDEX CONCURRENTLY IF EXISTS spare_parts_fault_id_idx;
+DROP INDEX CONCURRENTLY IF EXISTS personnel_team_id_idx;
@@ -0,0 +1,298 @@
+-- Секционирование car_repair по месяцам admission_date.
+--
+-- Отчеты за период читают только секции нужных месяцев. Первичный ключ
+-- секционированной таблицы обязан включать ключ секционирования, поэтому
+-- он становится (repair_id, admission_date); repair_id по-прежнему
+-- выдается последовательностью. Строки с датами вне созданных секций
+-- попадают в секцию по умолчанию, car_repair_ensure_partitions переносит
+-- их в секции своих месяцев.
+--
+-- Внешний ключ spare_parts.repair_id не может ссылаться на repair_id без
+-- уникального индекса по нему одному, поэтому он заменен триггерами:
+-- проверкой при записи запчасти и обнулением ссылки при удалении ремонта.
+--
+-- spare_parts не секционируется: в ней нет даты, а отчеты соединяют ее
+-- с ремонтами по (car_id, fault_id).
+
+ALTER TABLE car_repair RENAME TO car_repair_unpartitioned;
+ALTER SEQUENCE car_repair_repair_id_seq OWNED BY NONE;
+
+CREATE TABLE car_repair (
+    repair_id INT NOT NULL DEFAULT nextval('car_repair_repair_id_seq'),
+    car_id INT NOT NULL,
+    fault_id INT NOT NULL,
+    admission_date DATE NOT NULL,
+    completion_date DATE,
+    team_id INT,
+    CHECK (completion_date IS NULL OR completion_date >= admission_date)
+) PARTITION BY RANGE (admission_date);
+
+ALTER SEQUENCE car_repair_repair_id_seq OWNED BY car_repair.repair_id;
+
+CREATE TABLE car_repair_default PARTITION OF car_repair DEFAULT;
+
+-- Секция месяца, в который входит p_day; строки этого месяца из секции по
+-- умолчанию переносятся в нее. Возвращает true, если секция создана.
+CREATE OR REPLACE FUNCTION car_repair_create_partition(p_day DATE)
+RETURNS BOOLEAN AS $$
+DECLARE
+    month_start DATE := date_trunc('month', p_day)::date;
+    month_end DATE := (date_trunc('month', p_day) + INTERVAL '1 month')::date;
+    partition_name TEXT := 'car_repair_' || to_char(p_day, 'YYYY_MM');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN false;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE car_repair INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                   partition_name);
+    EXECUTE format('WITH moved AS ('
+                   '    DELETE FROM car_repair_default'
+                   '    WHERE admission_date >= %L AND admission_date < %L'
+                   '    RETURNING *'
+                   ') INSERT INTO %I SELECT * FROM moved',
+                   month_start, month_end, partition_name);
+    EXECUTE format('ALTER TABLE car_repair ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                   partition_name, month_start, month_end);
+    RETURN true;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Секции на p_months_ahead месяцев вперед и для всех месяцев, строки
+-- которых оказались в секции по умолчанию. Возвращает число новых секций.
+CREATE OR REPLACE FUNCTION car_repair_ensure_partitions(p_months_ahead INT DEFAULT 3)
+RETURNS INT AS $$
+DECLARE
+    created INT := 0;
+    day DATE;
+BEGIN
+    FOR day IN
+        SELECT generate_series(date_trunc('month', current_date),
+                               date_trunc('month', current_date)
+                                   + make_interval(months => p_months_ahead),
+                               INTERVAL '1 month')::date
+        UNION
+        SELECT DISTINCT date_trunc('month', admission_date)::date FROM car_repair_default
+        ORDER BY 1
+    LOOP
+        IF car_repair_create_partition(day) THEN
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Отключение секций, целиком лежащих до p_before, и перенос их в схему
+-- car_repair_archive (и в табличное пространство p_tablespace, если
+-- задано). Архивные ремонты исключаются из агрегатов отчетов.
+-- Возвращает имена перенесенных секций.
+CREATE OR REPLACE FUNCTION car_repair_archive(p_before DATE, p_tablespace TEXT DEFAULT NULL)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    part RECORD;
+    archived INT := 0;
+    car_ids INT[];
+    fault_ids INT[];
+BEGIN
+    CREATE SCHEMA IF NOT EXISTS car_repair_archive;
+
+    FOR part IN
+        SELECT c.relname,
+               substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \(''([^'']+)''\)')::date
+                   AS upper_bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'car_repair'::regclass
+          AND c.relname <> 'car_repair_default'
+        ORDER BY 2
+    LOOP
+        CONTINUE WHEN part.upper_bound IS NULL OR part.upper_bound > p_before;
+
+        EXECUTE format('ALTER TABLE car_repair DETACH PARTITION %I', part.relname);
+        EXECUTE format('SELECT array_agg(car_id), array_agg(fault_id) '
+                       'FROM (SELECT DISTINCT car_id, fault_id FROM %I) s', part.relname)
+            INTO car_ids, fault_ids;
+        EXECUTE format('ALTER TABLE %I SET SCHEMA car_repair_archive', part.relname);
+        IF p_tablespace IS NOT NULL THEN
+            EXECUTE format('ALTER TABLE car_repair_archive.%I SET TABLESPACE %I',
+                           part.relname, p_tablespace);
+        END IF;
+
+        IF car_ids IS NOT NULL
+           AND to_regprocedure('report_rollup_refresh(integer[], integer[])') IS NOT NULL THEN
+            PERFORM report_rollup_refresh(car_ids, fault_ids);
+        END IF;
+        archived := archived + 1;
+        RETURN NEXT part.relname;
+    END LOOP;
+
+    -- Отключение секции не вызывает триггеров - рабочие места перечитывают таблицу
+    IF archived > 0 THEN
+        PERFORM pg_notify('car_service_changes',
+                          json_build_object('table', 'car_repair', 'op', 'RELOAD')::text);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Секции для всех месяцев с данными и на три месяца вперед
+SELECT car_repair_create_partition(day)
+FROM (
+    SELECT generate_series(date_trunc('month', min(admission_date)),
+                           date_trunc('month', greatest(max(admission_date), current_date))
+                               + INTERVAL '3 months',
+                           INTERVAL '1 month')::date AS day
+    FROM car_repair_unpartitioned
+    HAVING count(*) > 0
+    UNION
+    SELECT generate_series(date_trunc('month', current_date),
+                           date_trunc('month', current_date) + INTERVAL '3 months',
+                           INTERVAL '1 month')::date
+) months;
+
+INSERT INTO car_repair SELECT * FROM car_repair_unpartitioned;
+
+DROP TABLE car_repair_unpartitioned CASCADE;
+
+ALTER TABLE car_repair ADD PRIMARY KEY (repair_id, admission_date);
+ALTER TABLE car_repair
+    ADD FOREIGN KEY (car_id) REFERENCES cars (car_id) ON DELETE CASCADE,
+    ADD FOREIGN KEY (fault_id) REFERENCES faults (fault_id) ON DELETE CASCADE,
+    ADD FOREIGN KEY (team_id) REFERENCES teams (team_id) ON DELETE SET NULL;
+
+CREATE INDEX car_repair_admission_date_idx
+    ON car_repair (admission_date) INCLUDE (car_id, fault_id);
+CREATE INDEX car_repair_car_fault_idx ON car_repair (car_id, fault_id);
+CREATE INDEX car_repair_fault_id_idx ON car_repair (fault_id);
+CREATE INDEX car_repair_team_id_idx ON car_repair (team_id);
+
+-- Замена внешнего ключа spare_parts.repair_id. Проверка выполняется в
+-- конце оператора, как и у внешнего ключа: ремонт и запчасти пишутся
+-- одним запросом (repairs.save_order)
+ALTER TABLE spare_parts ADD COLUMN IF NOT EXISTS repair_id INT;
+CREATE INDEX IF NOT EXISTS spare_parts_repair_id_idx ON spare_parts (repair_id);
+
+CREATE OR REPLACE FUNCTION spare_parts_check_repair()
+RETURNS trigger AS $$
+BEGIN
+    IF NEW.repair_id IS NOT NULL THEN
+        PERFORM 1 FROM car_repair WHERE repair_id = NEW.repair_id FOR KEY SHARE;
+        IF NOT FOUND THEN
+            RAISE foreign_key_violation USING
+                MESSAGE = format('Ремонт с repair_id = %s не найден', NEW.repair_id),
+                TABLE = 'spare_parts', COLUMN = 'repair_id';
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER spare_parts_check_repair
+    AFTER INSERT OR UPDATE OF repair_id ON spare_parts
+    FOR EACH ROW EXECUTE FUNCTION spare_parts_check_repair();
+
+CREATE OR REPLACE FUNCTION car_repair_unlink_parts()
+RETURNS trigger AS $$
+BEGIN
+    UPDATE spare_parts SET repair_id = NULL
+    WHERE repair_id IN (SELECT repair_id FROM old_rows);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER car_repair_unlink_parts AFTER DELETE ON car_repair
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION car_repair_unlink_parts();
+
+-- Триггеры агрегатов отчетов и оповещений остались на старой таблице
+DO $$
+BEGIN
+    IF to_regprocedure('report_rollup_trigger()') IS NOT NULL THEN
+        CREATE TRIGGER report_rollup_insert AFTER INSERT ON car_repair
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION report_rollup_trigger();
+        CREATE TRIGGER report_rollup_update AFTER UPDATE ON car_repair
+            REFERENCING NEW TABLE AS new_rows OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION report_rollup_trigger();
+        CREATE TRIGGER report_rollup_delete AFTER DELETE ON car_repair
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION report_rollup_trigger();
+        CREATE TRIGGER report_rollup_truncate AFTER TRUNCATE ON car_repair
+            FOR EACH STATEMENT EXECUTE FUNCTION report_rollup_truncate();
+    END IF;
+    IF to_regprocedure('create_notify_triggers(regclass, text[])') IS NOT NULL THEN
+        PERFORM create_notify_triggers('car_repair', 'repair_id', 'admission_date');
+    END IF;
+END;
+$$;
+
+ANALYZE car_repair;
+
+-- migrate:down
+
+ALTER TABLE car_repair RENAME TO car_repair_partitioned;
+ALTER SEQUENCE car_repair_repair_id_seq OWNED BY NONE;
+
+CREATE TABLE car_repair (
+    repair_id INT NOT NULL DEFAULT nextval('car_repair_repair_id_seq'),
+    car_id INT NOT NULL,
+    fault_id INT NOT NULL,
+    admission_date DATE NOT NULL,
+    completion_date DATE,
+    team_id INT,
+    CHECK (completion_date IS NULL OR completion_date >= admission_date)
+);
+
+ALTER SEQUENCE car_repair_repair_id_seq OWNED BY car_repair.repair_id;
+
+INSERT INTO car_repair SELECT * FROM car_repair_partitioned;
+
+DROP TABLE car_repair_partitioned CASCADE;
+DROP FUNCTION car_repair_ensure_partitions(INT);
+DROP FUNCTION car_repair_create_partition(DATE);
+DROP FUNCTION car_repair_archive(DATE, TEXT);
+DROP FUNCTION car_repair_unlink_parts();
+DROP TRIGGER spare_parts_check_repair ON spare_parts;
+DROP FUNCTION spare_parts_check_repair();
+
+ALTER TABLE car_repair ADD PRIMARY KEY (repair_id);
+ALTER TABLE car_repair
+    ADD FOREIGN KEY (car_id) REFERENCES cars (car_id) ON DELETE CASCADE,
+    ADD FOREIGN KEY (fault_id) REFERENCES faults (fault_id) ON DELETE CASCADE,
+    ADD FOREIGN KEY (team_id) REFERENCES teams (team_id) ON DELETE SET NULL;
+
+CREATE INDEX car_repair_admission_date_idx
+    ON car_repair (admission_date) INCLUDE (car_id, fault_id);
+CREATE INDEX car_repair_car_fault_idx ON car_repair (car_id, fault_id);
+CREATE INDEX car_repair_fault_id_idx ON car_repair (fault_id);
+CREATE INDEX car_repair_team_id_idx ON car_repair (team_id);
+
+-- Ссылки на ремонты, ушедшие в архив, обнуляются
+UPDATE spare_parts SET repair_id = NULL
+WHERE repair_id IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM car_repair cr WHERE cr.repair_id = spare_parts.repair_id);
+ALTER TABLE spare_parts
+    ADD FOREIGN KEY (repair_id) REFERENCES car_repair (repair_id) ON DELETE SET NULL;
+
+DO $$
+BEGIN
+    IF to_regprocedure('report_rollup_trigger()') IS NOT NULL THEN
+        CREATE TRIGGER report_rollup_insert AFTER INSERT ON car_repair
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION report_rollup_trigger();
+        CREATE TRIGGER report_rollup_update AFTER UPDATE ON car_repair
+            REFERENCING NEW TABLE AS new_rows OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION report_rollup_trigger();
+        CREATE TRIGGER report_rollup_delete AFTER DELETE ON car_repair
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION report_rollup_trigger();
+        CREATE TRIGGER report_rollup_truncate AFTER TRUNCATE ON car_repair
+            FOR EACH STATEMENT EXECUTE FUNCTION report_rollup_truncate();
+    END IF;
+    IF to_regprocedure('create_notify_triggers(regclass, text[])') IS NOT NULL THEN
+        PERFORM create_notify_triggers('car_repair', 'repair_id');
+    END IF;
+END;
+$$;
+
+ANALYZE car_repair;
@@ -0,0 +1,110 @@
+-- Журнал изменений строк для локальных копий таблиц (mirror.py).
+--
+-- Триггеры уровня оператора записывают в change_log ключи добавленных,
+-- измененных и удаленных строк; TRUNCATE записывается строкой без ключа.
+-- txid - номер транзакции изменения: локальная копия запоминает xmin
+-- снимка прошлой синхронизации и перечитывает строки по записям с
+-- txid не меньше него, поэтому транзакции, зафиксированные позже
+-- начатых после них, не теряются.
+--
+-- Журнал ведется для справочников; для других таблиц его можно включить
+-- вызовом create_change_log_triggers('таблица', 'столбец ключа', ...).
+-- Записи старше недели удаляются при синхронизации (mirror.CHANGE_LOG_DAYS).
+
+CREATE TABLE IF NOT EXISTS change_log (
+    id BIGSERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    row_key JSONB,
+    txid BIGINT NOT NULL DEFAULT txid_current(),
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS change_log_table_txid_idx ON change_log (table_name, txid);
+CREATE INDEX IF NOT EXISTS change_log_changed_at_idx ON change_log (changed_at);
+
+-- Аргументы триггерной функции - столбцы первичного ключа таблицы
+CREATE OR REPLACE FUNCTION log_change()
+RETURNS trigger AS $$
+DECLARE
+    key_expr TEXT;
+    source TEXT;
+BEGIN
+    SELECT string_agg(format('%I', col), ', ') INTO key_expr FROM unnest(TG_ARGV) AS col;
+    source := CASE TG_OP
+        WHEN 'INSERT' THEN format('SELECT %s FROM new_rows', key_expr)
+        WHEN 'DELETE' THEN format('SELECT %s FROM old_rows', key_expr)
+        ELSE format('SELECT %1$s FROM new_rows UNION SELECT %1$s FROM old_rows', key_expr)
+    END;
+    EXECUTE format('INSERT INTO change_log (table_name, row_key) '
+                   'SELECT %L, jsonb_build_array(%s) FROM (%s) k',
+                   TG_TABLE_NAME, key_expr, source);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION log_truncate()
+RETURNS trigger AS $$
+BEGIN
+    INSERT INTO change_log (table_name, row_key) VALUES (TG_TABLE_NAME, NULL);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION create_change_log_triggers(p_table REGCLASS, VARIADIC p_key TEXT[])
+RETURNS void AS $$
+DECLARE
+    args TEXT;
+BEGIN
+    SELECT string_agg(quote_literal(col), ', ') INTO args FROM unnest(p_key) AS col;
+
+    EXECUTE format('DROP TRIGGER IF EXISTS log_change_insert ON %s', p_table);
+    EXECUTE format('CREATE TRIGGER log_change_insert AFTER INSERT ON %s '
+                   'REFERENCING NEW TABLE AS new_rows '
+                   'FOR EACH STATEMENT EXECUTE FUNCTION log_change(%s)', p_table, args);
+    EXECUTE format('DROP TRIGGER IF EXISTS log_change_update ON %s', p_table);
+    EXECUTE format('CREATE TRIGGER log_change_update AFTER UPDATE ON %s '
+                   'REFERENCING NEW TABLE AS new_rows OLD TABLE AS old_rows '
+                   'FOR EACH STATEMENT EXECUTE FUNCTION log_change(%s)', p_table, args);
+    EXECUTE format('DROP TRIGGER IF EXISTS log_change_delete ON %s', p_table);
+    EXECUTE format('CREATE TRIGGER log_change_delete AFTER DELETE ON %s '
+                   'REFERENCING OLD TABLE AS old_rows '
+                   'FOR EACH STATEMENT EXECUTE FUNCTION log_change(%s)', p_table, args);
+    EXECUTE format('DROP TRIGGER IF EXISTS log_change_truncate ON %s', p_table);
+    EXECUTE format('CREATE TRIGGER log_change_truncate AFTER TRUNCATE ON %s '
+                   'FOR EACH STATEMENT EXECUTE FUNCTION log_truncate()', p_table);
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t REGCLASS;
+    key_columns TEXT[];
+BEGIN
+    FOREACH t IN ARRAY ARRAY['workshops', 'teams', 'personnel', 'cars', 'faults']::regclass[] LOOP
+        SELECT array_agg(a.attname::text ORDER BY k.ord) INTO key_columns
+        FROM pg_index i
+        CROSS JOIN unnest(i.indkey::int2[]) WITH ORDINALITY k(attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+        WHERE i.indrelid = t AND i.indisprimary;
+        PERFORM create_change_log_triggers(t, VARIADIC key_columns);
+    END LOOP;
+END;
+$$;
+
+-- migrate:down
+
+DO $$
+DECLARE
+    t REGCLASS;
+BEGIN
+    FOR t IN SELECT DISTINCT tgrelid::regclass FROM pg_trigger WHERE tgname LIKE 'log\_change\_%' LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS log_change_insert ON %s', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS log_change_update ON %s', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS log_change_delete ON %s', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS log_change_truncate ON %s', t);
+    END LOOP;
+END;
+$$;
+DROP FUNCTION IF EXISTS create_change_log_triggers(REGCLASS, TEXT[]);
+DROP FUNCTION IF EXISTS log_change();
+DROP FUNCTION IF EXISTS log_truncate();
+DROP TABLE IF EXISTS change_log;
@@ -0,0 +1,48 @@
+-- Отказ в неоднозначной ссылке spare_parts.repair_id.
+--
+-- После секционирования (0002) repair_id уникален только вместе с
+-- admission_date: последовательность выдает разные номера, но строку с
+-- уже занятым repair_id можно добавить явно (импорт, ручной INSERT).
+-- Триггер проверки ссылки принимал такой repair_id, и запчасть
+-- относилась сразу к нескольким ремонтам. Теперь ссылка на repair_id,
+-- который встречается больше одного раза, отклоняется.
+
+CREATE OR REPLACE FUNCTION spare_parts_check_repair()
+RETURNS trigger AS $$
+DECLARE
+    matches INT;
+BEGIN
+    IF NEW.repair_id IS NOT NULL THEN
+        SELECT count(*) INTO matches
+        FROM (SELECT 1 FROM car_repair WHERE repair_id = NEW.repair_id FOR KEY SHARE) r;
+        IF matches = 0 THEN
+            RAISE foreign_key_violation USING
+                MESSAGE = format('Ремонт с repair_id = %s не найден', NEW.repair_id),
+                TABLE = 'spare_parts', COLUMN = 'repair_id';
+        ELSIF matches > 1 THEN
+            RAISE foreign_key_violation USING
+                MESSAGE = format('Ремонтов с repair_id = %s несколько: ссылка неоднозначна',
+                                 NEW.repair_id),
+                TABLE = 'spare_parts', COLUMN = 'repair_id';
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- migrate:down
+
+CREATE OR REPLACE FUNCTION spare_parts_check_repair()
+RETURNS trigger AS $$
+BEGIN
+    IF NEW.repair_id IS NOT NULL THEN
+        PERFORM 1 FROM car_repair WHERE repair_id = NEW.repair_id FOR KEY SHARE;
+        IF NOT FOUND THEN
+            RAISE foreign_key_violation USING
+                MESSAGE = format('Ремонт с repair_id = %s не найден', NEW.repair_id),
+                TABLE = 'spare_parts', COLUMN = 'repair_id';
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,53 @@
+-- Уникальность repair_id в секционированной car_repair.
+--
+-- Первичный ключ секционированной таблицы обязан включать ключ
+-- секционирования, поэтому после 0002 второй ремонт с тем же repair_id
+-- (импорт, ручной INSERT) принимался. Ссылки spare_parts на такой
+-- repair_id становились неоднозначными, car_repair_unlink_parts отвязывал
+-- запчасти не того ремонта, а откат 0002 не мог вернуть PRIMARY KEY
+-- (repair_id). Триггер BEFORE INSERT/UPDATE на родительской таблице
+-- отклоняет repair_id, который уже занят. Совпадающие вставки
+-- упорядочиваются advisory-блокировкой по номеру ремонта.
+-- При переносе строки в другую секцию (смена admission_date) триггер
+-- срабатывает как INSERT в новой секции; старая строка к этому моменту
+-- уже удалена и дубликатом не считается. Отсоединенные архивные секции
+-- (car_repair_archive) не проверяются.
+
+DO $$
+DECLARE
+    duplicate INT;
+BEGIN
+    SELECT repair_id INTO duplicate
+    FROM car_repair GROUP BY repair_id HAVING count(*) > 1 LIMIT 1;
+    IF FOUND THEN
+        RAISE EXCEPTION 'В car_repair повторяется repair_id = %: исправьте данные и повторите миграцию',
+            duplicate;
+    END IF;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION car_repair_check_repair_id()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.repair_id = OLD.repair_id THEN
+        RETURN NEW;
+    END IF;
+    PERFORM pg_advisory_xact_lock(hashtext('car_repair.repair_id'), NEW.repair_id);
+    PERFORM 1 FROM car_repair WHERE repair_id = NEW.repair_id;
+    IF FOUND THEN
+        RAISE unique_violation USING
+            MESSAGE = format('Ремонт с repair_id = %s уже существует', NEW.repair_id),
+            TABLE = 'car_repair', COLUMN = 'repair_id';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER car_repair_check_repair_id
+    BEFORE INSERT OR UPDATE OF repair_id ON car_repair
+    FOR EACH ROW EXECUTE FUNCTION car_repair_check_repair_id();
+
+-- migrate:down
+
+DROP TRIGGER IF EXISTS car_repair_check_repair_id ON car_repair;
+DROP FUNCTION IF EXISTS car_repair_check_repair_id();
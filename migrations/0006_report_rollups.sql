@@ -0,0 +1,245 @@
+-- Агрегаты для отчетов "Ремонты по датам" и "Финансовый отчет".
+--
+-- Отчеты соединяют car_repair и spare_parts по (car_id, fault_id), поэтому
+-- каждый ремонт учитывает все запчасти этой машины по этой неисправности,
+-- а число строк соединения - max(1, число запчастей). Агрегаты хранят
+-- ровно эти величины, чтобы отчеты по ним совпадали с исходными запросами:
+--   repair_count - число ремонтов;
+--   joined_rows  - число строк соединения с запчастями;
+--   parts_cost   - сумма price * quantity по строкам соединения.
+-- Стоимость работ берется из faults при построении отчета.
+--
+-- Раньше агрегаты создавались скриптом sql/report_rollups.sql; на базе,
+-- где он уже выполнялся, миграция заменяет функции и триггеры и
+-- пересчитывает агрегаты заново.
+
+CREATE TABLE IF NOT EXISTS report_repairs_daily (
+    admission_date DATE NOT NULL,
+    car_id INT NOT NULL,
+    fault_id INT NOT NULL,
+    repair_count INT NOT NULL,
+    joined_rows INT NOT NULL,
+    parts_cost NUMERIC(14, 2) NOT NULL,
+    PRIMARY KEY (admission_date, car_id, fault_id)
+);
+
+CREATE INDEX IF NOT EXISTS report_repairs_daily_car_fault_idx
+    ON report_repairs_daily (car_id, fault_id);
+
+CREATE TABLE IF NOT EXISTS report_repairs_monthly (
+    month DATE NOT NULL,  -- первое число месяца
+    fault_id INT NOT NULL,
+    repair_count INT NOT NULL,
+    joined_rows INT NOT NULL,
+    parts_cost NUMERIC(14, 2) NOT NULL,
+    PRIMARY KEY (month, fault_id)
+);
+
+-- Пересчет агрегатов для пар (машина, неисправность).
+--
+-- Строки удаляются и вставляются заново, поэтому параллельные пересчеты
+-- одних и тех же ключей при READ COMMITTED мешали бы друг другу: второй
+-- не видит строк, вставленных первым, и его INSERT падает с
+-- unique_violation. Поэтому пересчет ключей сериализуется
+-- рекомендательными блокировками до конца транзакции: сначала пары
+-- (машина, неисправность), затем (месяц, неисправность) - каждые в
+-- порядке значения блокировки, чтобы транзакции не ждали друг друга по
+-- кругу.
+CREATE OR REPLACE FUNCTION report_rollup_refresh(p_car_ids INT[], p_fault_ids INT[])
+RETURNS void AS $$
+DECLARE
+    removed_months DATE[];
+    removed_faults INT[];
+    added_months DATE[];
+    added_faults INT[];
+    lock_key BIGINT;
+BEGIN
+    FOR lock_key IN
+        SELECT DISTINCT hashtextextended(format('report_repairs_daily:%s:%s', car_id, fault_id), 0)
+        FROM unnest(p_car_ids, p_fault_ids) AS p(car_id, fault_id)
+        ORDER BY 1
+    LOOP
+        PERFORM pg_advisory_xact_lock(lock_key);
+    END LOOP;
+
+    WITH pairs AS (
+        SELECT DISTINCT car_id, fault_id FROM unnest(p_car_ids, p_fault_ids) AS p(car_id, fault_id)
+    ), removed AS (
+        DELETE FROM report_repairs_daily d
+        USING pairs p
+        WHERE p.car_id = d.car_id AND p.fault_id = d.fault_id
+        RETURNING d.admission_date, d.fault_id
+    )
+    SELECT array_agg(date_trunc('month', admission_date)::date), array_agg(fault_id)
+    INTO removed_months, removed_faults
+    FROM removed;
+
+    WITH pairs AS (
+        SELECT DISTINCT car_id, fault_id FROM unnest(p_car_ids, p_fault_ids) AS p(car_id, fault_id)
+    ), added AS (
+        INSERT INTO report_repairs_daily
+        SELECT cr.admission_date, cr.car_id, cr.fault_id,
+               count(*),
+               count(*) * greatest(1, coalesce(sp.part_rows, 0)),
+               count(*) * coalesce(sp.parts_cost, 0)
+        FROM car_repair cr
+        JOIN pairs p ON p.car_id = cr.car_id AND p.fault_id = cr.fault_id
+        LEFT JOIN (
+            SELECT s.car_id, s.fault_id, count(*) AS part_rows,
+                   sum(s.price * s.quantity) AS parts_cost
+            FROM spare_parts s
+            JOIN pairs p ON p.car_id = s.car_id AND p.fault_id = s.fault_id
+            GROUP BY s.car_id, s.fault_id
+        ) sp ON sp.car_id = cr.car_id AND sp.fault_id = cr.fault_id
+        GROUP BY cr.admission_date, cr.car_id, cr.fault_id, sp.part_rows, sp.parts_cost
+        RETURNING admission_date, fault_id
+    )
+    SELECT array_agg(date_trunc('month', admission_date)::date), array_agg(fault_id)
+    INTO added_months, added_faults
+    FROM added;
+
+    -- Месячные агрегаты пересчитываются из дневных для затронутых
+    -- (месяц, неисправность) - до и после изменения
+    FOR lock_key IN
+        SELECT DISTINCT hashtextextended(format('report_repairs_monthly:%s:%s', month, fault_id), 0)
+        FROM unnest(removed_months || added_months, removed_faults || added_faults) AS a(month, fault_id)
+        ORDER BY 1
+    LOOP
+        PERFORM pg_advisory_xact_lock(lock_key);
+    END LOOP;
+
+    DELETE FROM report_repairs_monthly m
+    USING unnest(removed_months || added_months, removed_faults || added_faults) AS a(month, fault_id)
+    WHERE a.month = m.month AND a.fault_id = m.fault_id;
+
+    INSERT INTO report_repairs_monthly
+    SELECT a.month, a.fault_id, sum(d.repair_count), sum(d.joined_rows), sum(d.parts_cost)
+    FROM (
+        SELECT DISTINCT month, fault_id
+        FROM unnest(removed_months || added_months, removed_faults || added_faults) AS a(month, fault_id)
+    ) a
+    JOIN report_repairs_daily d
+      ON d.fault_id = a.fault_id
+     AND d.admission_date >= a.month
+     AND d.admission_date < a.month + INTERVAL '1 month'
+    GROUP BY a.month, a.fault_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Полный пересчет агрегатов
+CREATE OR REPLACE FUNCTION report_rollup_rebuild()
+RETURNS void AS $$
+BEGIN
+    TRUNCATE report_repairs_daily, report_repairs_monthly;
+
+    INSERT INTO report_repairs_daily
+    SELECT cr.admission_date, cr.car_id, cr.fault_id,
+           count(*),
+           count(*) * greatest(1, coalesce(sp.part_rows, 0)),
+           count(*) * coalesce(sp.parts_cost, 0)
+    FROM car_repair cr
+    LEFT JOIN (
+        SELECT car_id, fault_id, count(*) AS part_rows, sum(price * quantity) AS parts_cost
+        FROM spare_parts
+        GROUP BY car_id, fault_id
+    ) sp ON sp.car_id = cr.car_id AND sp.fault_id = cr.fault_id
+    GROUP BY cr.admission_date, cr.car_id, cr.fault_id, sp.part_rows, sp.parts_cost;
+
+    INSERT INTO report_repairs_monthly
+    SELECT date_trunc('month', admission_date)::date, fault_id,
+           sum(repair_count), sum(joined_rows), sum(parts_cost)
+    FROM report_repairs_daily
+    GROUP BY 1, 2;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггеры уровня оператора: затронутые пары собираются из переходных таблиц
+CREATE OR REPLACE FUNCTION report_rollup_trigger()
+RETURNS trigger AS $$
+DECLARE
+    car_ids INT[];
+    fault_ids INT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(car_id), array_agg(fault_id) INTO car_ids, fault_ids
+        FROM (SELECT DISTINCT car_id, fault_id FROM new_rows) s;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(car_id), array_agg(fault_id) INTO car_ids, fault_ids
+        FROM (SELECT DISTINCT car_id, fault_id FROM old_rows) s;
+    ELSE
+        SELECT array_agg(car_id), array_agg(fault_id) INTO car_ids, fault_ids
+        FROM (SELECT car_id, fault_id FROM new_rows
+              UNION
+              SELECT car_id, fault_id FROM old_rows) s;
+    END IF;
+
+    IF car_ids IS NOT NULL THEN
+        PERFORM report_rollup_refresh(car_ids, fault_ids);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION report_rollup_truncate()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM report_rollup_rebuild();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS report_rollup_insert ON car_repair;
+CREATE TRIGGER report_rollup_insert AFTER INSERT ON car_repair
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION report_rollup_trigger();
+
+DROP TRIGGER IF EXISTS report_rollup_update ON car_repair;
+CREATE TRIGGER report_rollup_update AFTER UPDATE ON car_repair
+    REFERENCING NEW TABLE AS new_rows OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION report_rollup_trigger();
+
+DROP TRIGGER IF EXISTS report_rollup_delete ON car_repair;
+CREATE TRIGGER report_rollup_delete AFTER DELETE ON car_repair
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION report_rollup_trigger();
+
+DROP TRIGGER IF EXISTS report_rollup_truncate ON car_repair;
+CREATE TRIGGER report_rollup_truncate AFTER TRUNCATE ON car_repair
+    FOR EACH STATEMENT EXECUTE FUNCTION report_rollup_truncate();
+
+DROP TRIGGER IF EXISTS report_rollup_insert ON spare_parts;
+CREATE TRIGGER report_rollup_insert AFTER INSERT ON spare_parts
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION report_rollup_trigger();
+
+DROP TRIGGER IF EXISTS report_rollup_update ON spare_parts;
+CREATE TRIGGER report_rollup_update AFTER UPDATE ON spare_parts
+    REFERENCING NEW TABLE AS new_rows OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION report_rollup_trigger();
+
+DROP TRIGGER IF EXISTS report_rollup_delete ON spare_parts;
+CREATE TRIGGER report_rollup_delete AFTER DELETE ON spare_parts
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION report_rollup_trigger();
+
+DROP TRIGGER IF EXISTS report_rollup_truncate ON spare_parts;
+CREATE TRIGGER report_rollup_truncate AFTER TRUNCATE ON spare_parts
+    FOR EACH STATEMENT EXECUTE FUNCTION report_rollup_truncate();
+
+SELECT report_rollup_rebuild();
+
+-- migrate:down
+
+DROP TRIGGER IF EXISTS report_rollup_insert ON car_repair;
+DROP TRIGGER IF EXISTS report_rollup_update ON car_repair;
+DROP TRIGGER IF EXISTS report_rollup_delete ON car_repair;
+DROP TRIGGER IF EXISTS report_rollup_truncate ON car_repair;
+DROP TRIGGER IF EXISTS report_rollup_insert ON spare_parts;
+DROP TRIGGER IF EXISTS report_rollup_update ON spare_parts;
+DROP TRIGGER IF EXISTS report_rollup_delete ON spare_parts;
+DROP TRIGGER IF EXISTS report_rollup_truncate ON spare_parts;
+DROP FUNCTION IF EXISTS report_rollup_truncate();
+DROP FUNCTION IF EXISTS report_rollup_trigger();
+DROP FUNCTION IF EXISTS report_rollup_rebuild();
+DROP FUNCTION IF EXISTS report_rollup_refresh(INT[], INT[]);
+DROP TABLE IF EXISTS report_repairs_daily, report_repairs_monthly;
@@ -0,0 +1,130 @@
+-- Оповещение рабочих мест об изменениях таблиц (LISTEN car_service_changes).
+--
+-- Триггеры уровня оператора отправляют одно сообщение на оператор:
+--   {"table": "cars", "op": "UPDATE", "keys": [[1], [2]], "old_keys": [[3]]}
+-- keys - первичные ключи добавленных/измененных строк, old_keys - ключи
+-- удаленных строк (при UPDATE - ключи, которых больше нет). Если строк
+-- слишком много для одного сообщения, отправляется {"op": "RELOAD"}.
+-- Аргументы триггерной функции - столбцы первичного ключа таблицы.
+--
+-- Раньше триггеры устанавливались скриптом sql/change_notify.sql; на базе,
+-- где он уже выполнялся, миграция пересоздает их.
+
+CREATE OR REPLACE FUNCTION notify_change()
+RETURNS trigger AS $$
+DECLARE
+    key_expr TEXT;
+    rows_table TEXT := CASE TG_OP WHEN 'DELETE' THEN 'old_rows' ELSE 'new_rows' END;
+    keys JSON;
+    old_keys JSON;
+    row_count BIGINT;
+    payload TEXT;
+BEGIN
+    EXECUTE format('SELECT count(*) FROM %I', rows_table) INTO row_count;
+    IF row_count = 0 THEN
+        RETURN NULL;
+    END IF;
+
+    -- Размер сообщения NOTIFY ограничен 8000 байт: при массовых изменениях
+    -- рабочие места просто перечитывают таблицу
+    IF row_count > 200 THEN
+        PERFORM pg_notify('car_service_changes',
+                          json_build_object('table', TG_TABLE_NAME, 'op', 'RELOAD')::text);
+        RETURN NULL;
+    END IF;
+
+    SELECT string_agg(format('%I', col), ', ') INTO key_expr FROM unnest(TG_ARGV) AS col;
+    IF TG_OP = 'DELETE' THEN
+        EXECUTE format('SELECT json_agg(json_build_array(%s)) FROM old_rows', key_expr)
+            INTO old_keys;
+    ELSE
+        EXECUTE format('SELECT json_agg(json_build_array(%s)) FROM new_rows', key_expr)
+            INTO keys;
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        EXECUTE format('SELECT json_agg(json_build_array(%1$s)) FROM '
+                       '(SELECT %1$s FROM old_rows EXCEPT SELECT %1$s FROM new_rows) k', key_expr)
+            INTO old_keys;
+    END IF;
+
+    payload := json_build_object('table', TG_TABLE_NAME, 'op', TG_OP,
+                                 'keys', coalesce(keys, '[]'), 'old_keys', coalesce(old_keys, '[]'))::text;
+    IF octet_length(payload) > 7900 THEN
+        payload := json_build_object('table', TG_TABLE_NAME, 'op', 'RELOAD')::text;
+    END IF;
+    PERFORM pg_notify('car_service_changes', payload);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_truncate()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('car_service_changes',
+                      json_build_object('table', TG_TABLE_NAME, 'op', 'RELOAD')::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггеры для таблицы с заданным первичным ключом
+CREATE OR REPLACE FUNCTION create_notify_triggers(p_table REGCLASS, VARIADIC p_key TEXT[])
+RETURNS void AS $$
+DECLARE
+    args TEXT;
+BEGIN
+    SELECT string_agg(quote_literal(col), ', ') INTO args FROM unnest(p_key) AS col;
+
+    EXECUTE format('DROP TRIGGER IF EXISTS notify_change_insert ON %s', p_table);
+    EXECUTE format('CREATE TRIGGER notify_change_insert AFTER INSERT ON %s '
+                   'REFERENCING NEW TABLE AS new_rows '
+                   'FOR EACH STATEMENT EXECUTE FUNCTION notify_change(%s)', p_table, args);
+    EXECUTE format('DROP TRIGGER IF EXISTS notify_change_update ON %s', p_table);
+    EXECUTE format('CREATE TRIGGER notify_change_update AFTER UPDATE ON %s '
+                   'REFERENCING NEW TABLE AS new_rows OLD TABLE AS old_rows '
+                   'FOR EACH STATEMENT EXECUTE FUNCTION notify_change(%s)', p_table, args);
+    EXECUTE format('DROP TRIGGER IF EXISTS notify_change_delete ON %s', p_table);
+    EXECUTE format('CREATE TRIGGER notify_change_delete AFTER DELETE ON %s '
+                   'REFERENCING OLD TABLE AS old_rows '
+                   'FOR EACH STATEMENT EXECUTE FUNCTION notify_change(%s)', p_table, args);
+    EXECUTE format('DROP TRIGGER IF EXISTS notify_change_truncate ON %s', p_table);
+    EXECUTE format('CREATE TRIGGER notify_change_truncate AFTER TRUNCATE ON %s '
+                   'FOR EACH STATEMENT EXECUTE FUNCTION notify_truncate()', p_table);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Столбцы первичного ключа таблицы (у секционированной car_repair в ключ
+-- входит admission_date)
+CREATE OR REPLACE FUNCTION primary_key_columns(p_table REGCLASS)
+RETURNS TEXT[] AS $$
+    SELECT array_agg(a.attname::text ORDER BY k.ord)
+    FROM pg_index i
+    CROSS JOIN unnest(i.indkey::int2[]) WITH ORDINALITY k(attnum, ord)
+    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+    WHERE i.indrelid = p_table AND i.indisprimary
+$$ LANGUAGE sql STABLE;
+
+SELECT create_notify_triggers(t, VARIADIC primary_key_columns(t))
+FROM unnest(ARRAY['workshops', 'teams', 'personnel', 'cars', 'faults',
+                  'car_repair', 'spare_parts']::regclass[]) AS t;
+
+-- migrate:down
+
+DO $$
+DECLARE
+    t REGCLASS;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['workshops', 'teams', 'personnel', 'cars', 'faults',
+                             'car_repair', 'spare_parts']::regclass[]
+    LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS notify_change_insert ON %s', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS notify_change_update ON %s', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS notify_change_delete ON %s', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS notify_change_truncate ON %s', t);
+    END LOOP;
+END;
+$$;
+
+DROP FUNCTION IF EXISTS create_notify_triggers(REGCLASS, TEXT[]);
+DROP FUNCTION IF EXISTS primary_key_columns(REGCLASS);
+DROP FUNCTION IF EXISTS notify_change();
+DROP FUNCTION IF EXISTS notify_truncate();
@@ -0,0 +1,426 @@
+-- Дневные агрегаты отчетов по (дата, неисправность) вместо
+-- (дата, машина, неисправность).
+--
+-- С машиной в ключе report_repairs_daily содержала почти строку на ремонт
+-- и не сокращала чтение. Теперь дневные агрегаты нужны только для неполных
+-- месяцев финансового отчета; отчет "Ремонты по датам" перечисляет
+-- машины и строится по исходным таблицам с индексом
+-- car_repair_admission_date_idx (0001).
+--
+-- Пересчет идет по ключам (дата, неисправность): изменения car_repair
+-- затрагивают ключи своих строк, изменения запчастей пары (машина,
+-- неисправность) - ключи всех ремонтов этой пары.
+
+DROP TABLE report_repairs_daily;
+
+CREATE TABLE report_repairs_daily (
+    admission_date DATE NOT NULL,
+    fault_id INT NOT NULL,
+    repair_count INT NOT NULL,
+    joined_rows INT NOT NULL,
+    parts_cost NUMERIC(14, 2) NOT NULL,
+    PRIMARY KEY (admission_date, fault_id)
+);
+
+DROP FUNCTION report_rollup_refresh(INT[], INT[]);
+
+-- Пересчет агрегатов для ключей (дата, неисправность).
+--
+-- Строки удаляются и вставляются заново, поэтому пересчет одних и тех же
+-- ключей сериализуется рекомендательными блокировками до конца
+-- транзакции: сначала дневные ключи, затем (месяц, неисправность) -
+-- каждые в порядке значения блокировки (см. 0006).
+CREATE FUNCTION report_rollup_refresh(p_days DATE[], p_fault_ids INT[])
+RETURNS void AS $$
+DECLARE
+    lock_key BIGINT;
+BEGIN
+    FOR lock_key IN
+        SELECT DISTINCT hashtextextended(format('report_repairs_daily:%s:%s', day, fault_id), 0)
+        FROM unnest(p_days, p_fault_ids) AS k(day, fault_id)
+        ORDER BY 1
+    LOOP
+        PERFORM pg_advisory_xact_lock(lock_key);
+    END LOOP;
+
+    DELETE FROM report_repairs_daily d
+    USING unnest(p_days, p_fault_ids) AS k(day, fault_id)
+    WHERE d.admission_date = k.day AND d.fault_id = k.fault_id;
+
+    INSERT INTO report_repairs_daily
+    SELECT cr.admission_date, cr.fault_id,
+           count(*),
+           sum(greatest(1, sp.part_rows)),
+           sum(coalesce(sp.parts_cost, 0))
+    FROM (SELECT DISTINCT day, fault_id FROM unnest(p_days, p_fault_ids) AS k(day, fault_id)) k
+    JOIN car_repair cr ON cr.admission_date = k.day AND cr.fault_id = k.fault_id
+    CROSS JOIN LATERAL (
+        SELECT count(*) AS part_rows, sum(s.price * s.quantity) AS parts_cost
+        FROM spare_parts s
+        WHERE s.car_id = cr.car_id AND s.fault_id = cr.fault_id
+    ) sp
+    GROUP BY cr.admission_date, cr.fault_id;
+
+    -- Месячные агрегаты пересчитываются из дневных
+    FOR lock_key IN
+        SELECT DISTINCT hashtextextended(
+                   format('report_repairs_monthly:%s:%s', date_trunc('month', day)::date, fault_id), 0)
+        FROM unnest(p_days, p_fault_ids) AS k(day, fault_id)
+        ORDER BY 1
+    LOOP
+        PERFORM pg_advisory_xact_lock(lock_key);
+    END LOOP;
+
+    DELETE FROM report_repairs_monthly m
+    USING unnest(p_days, p_fault_ids) AS k(day, fault_id)
+    WHERE m.month = date_trunc('month', k.day)::date AND m.fault_id = k.fault_id;
+
+    INSERT INTO report_repairs_monthly
+    SELECT a.month, a.fault_id, sum(d.repair_count), sum(d.joined_rows), sum(d.parts_cost)
+    FROM (
+        SELECT DISTINCT date_trunc('month', day)::date AS month, fault_id
+        FROM unnest(p_days, p_fault_ids) AS k(day, fault_id)
+    ) a
+    JOIN report_repairs_daily d
+      ON d.fault_id = a.fault_id
+     AND d.admission_date >= a.month
+     AND d.admission_date < a.month + INTERVAL '1 month'
+    GROUP BY a.month, a.fault_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Полный пересчет агрегатов
+CREATE OR REPLACE FUNCTION report_rollup_rebuild()
+RETURNS void AS $$
+BEGIN
+    TRUNCATE report_repairs_daily, report_repairs_monthly;
+
+    INSERT INTO report_repairs_daily
+    SELECT cr.admission_date, cr.fault_id,
+           count(*),
+           sum(greatest(1, coalesce(sp.part_rows, 0))),
+           sum(coalesce(sp.parts_cost, 0))
+    FROM car_repair cr
+    LEFT JOIN (
+        SELECT car_id, fault_id, count(*) AS part_rows, sum(price * quantity) AS parts_cost
+        FROM spare_parts
+        GROUP BY car_id, fault_id
+    ) sp ON sp.car_id = cr.car_id AND sp.fault_id = cr.fault_id
+    GROUP BY cr.admission_date, cr.fault_id;
+
+    INSERT INTO report_repairs_monthly
+    SELECT date_trunc('month', admission_date)::date, fault_id,
+           sum(repair_count), sum(joined_rows), sum(parts_cost)
+    FROM report_repairs_daily
+    GROUP BY 1, 2;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггеры уровня оператора: затронутые ключи собираются из переходных таблиц
+CREATE OR REPLACE FUNCTION report_rollup_trigger()
+RETURNS trigger AS $$
+DECLARE
+    changed TEXT := CASE TG_OP
+        WHEN 'INSERT' THEN 'SELECT * FROM new_rows'
+        WHEN 'DELETE' THEN 'SELECT * FROM old_rows'
+        ELSE 'SELECT * FROM new_rows UNION ALL SELECT * FROM old_rows'
+    END;
+    days DATE[];
+    fault_ids INT[];
+BEGIN
+    IF TG_TABLE_NAME = 'spare_parts' THEN
+        -- Запчасти пары (машина, неисправность) входят во все ремонты этой пары
+        EXECUTE format('SELECT array_agg(admission_date), array_agg(fault_id) FROM ('
+                       '    SELECT DISTINCT cr.admission_date, cr.fault_id'
+                       '    FROM car_repair cr'
+                       '    JOIN (SELECT DISTINCT car_id, fault_id FROM (%s) c) p'
+                       '      ON p.car_id = cr.car_id AND p.fault_id = cr.fault_id'
+                       ') k', changed)
+            INTO days, fault_ids;
+    ELSE
+        EXECUTE format('SELECT array_agg(admission_date), array_agg(fault_id) FROM ('
+                       '    SELECT DISTINCT admission_date, fault_id FROM (%s) c'
+                       ') k', changed)
+            INTO days, fault_ids;
+    END IF;
+
+    IF days IS NOT NULL THEN
+        PERFORM report_rollup_refresh(days, fault_ids);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- car_repair_archive из 0002 с пересчетом агрегатов по ключам (дата,
+-- неисправность) перенесенных ремонтов.
+--
+-- Отключение секций, целиком лежащих до p_before, и перенос их в схему
+-- car_repair_archive (и в табличное пространство p_tablespace, если
+-- задано). Архивные ремонты исключаются из агрегатов отчетов.
+-- Возвращает имена перенесенных секций.
+CREATE OR REPLACE FUNCTION car_repair_archive(p_before DATE, p_tablespace TEXT DEFAULT NULL)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    part RECORD;
+    archived INT := 0;
+    days DATE[];
+    fault_ids INT[];
+BEGIN
+    CREATE SCHEMA IF NOT EXISTS car_repair_archive;
+
+    FOR part IN
+        SELECT c.relname,
+               substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \(''([^'']+)''\)')::date
+                   AS upper_bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'car_repair'::regclass
+          AND c.relname <> 'car_repair_default'
+        ORDER BY 2
+    LOOP
+        CONTINUE WHEN part.upper_bound IS NULL OR part.upper_bound > p_before;
+
+        EXECUTE format('ALTER TABLE car_repair DETACH PARTITION %I', part.relname);
+        EXECUTE format('SELECT array_agg(admission_date), array_agg(fault_id) '
+                       'FROM (SELECT DISTINCT admission_date, fault_id FROM %I) s', part.relname)
+            INTO days, fault_ids;
+        EXECUTE format('ALTER TABLE %I SET SCHEMA car_repair_archive', part.relname);
+        IF p_tablespace IS NOT NULL THEN
+            EXECUTE format('ALTER TABLE car_repair_archive.%I SET TABLESPACE %I',
+                           part.relname, p_tablespace);
+        END IF;
+
+        IF days IS NOT NULL
+           AND to_regprocedure('report_rollup_refresh(date[], integer[])') IS NOT NULL THEN
+            PERFORM report_rollup_refresh(days, fault_ids);
+        END IF;
+        archived := archived + 1;
+        RETURN NEXT part.relname;
+    END LOOP;
+
+    -- Отключение секции не вызывает триггеров - рабочие места перечитывают таблицу
+    IF archived > 0 THEN
+        PERFORM pg_notify('car_service_changes',
+                          json_build_object('table', 'car_repair', 'op', 'RELOAD')::text);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT report_rollup_rebuild();
+
+-- migrate:down
+
+DROP FUNCTION report_rollup_refresh(DATE[], INT[]);
+DROP TABLE report_repairs_daily;
+
+CREATE TABLE IF NOT EXISTS report_repairs_daily (
+    admission_date DATE NOT NULL,
+    car_id INT NOT NULL,
+    fault_id INT NOT NULL,
+    repair_count INT NOT NULL,
+    joined_rows INT NOT NULL,
+    parts_cost NUMERIC(14, 2) NOT NULL,
+    PRIMARY KEY (admission_date, car_id, fault_id)
+);
+
+CREATE INDEX IF NOT EXISTS report_repairs_daily_car_fault_idx
+    ON report_repairs_daily (car_id, fault_id);
+
+-- Пересчет агрегатов для пар (машина, неисправность).
+--
+-- Строки удаляются и вставляются заново, поэтому параллельные пересчеты
+-- одних и тех же ключей при READ COMMITTED мешали бы друг другу: второй
+-- не видит строк, вставленных первым, и его INSERT падает с
+-- unique_violation. Поэтому пересчет ключей сериализуется
+-- рекомендательными блокировками до конца транзакции: сначала пары
+-- (машина, неисправность), затем (месяц, неисправность) - каждые в
+-- порядке значения блокировки, чтобы транзакции не ждали друг друга по
+-- кругу.
+CREATE OR REPLACE FUNCTION report_rollup_refresh(p_car_ids INT[], p_fault_ids INT[])
+RETURNS void AS $$
+DECLARE
+    removed_months DATE[];
+    removed_faults INT[];
+    added_months DATE[];
+    added_faults INT[];
+    lock_key BIGINT;
+BEGIN
+    FOR lock_key IN
+        SELECT DISTINCT hashtextextended(format('report_repairs_daily:%s:%s', car_id, fault_id), 0)
+        FROM unnest(p_car_ids, p_fault_ids) AS p(car_id, fault_id)
+        ORDER BY 1
+    LOOP
+        PERFORM pg_advisory_xact_lock(lock_key);
+    END LOOP;
+
+    WITH pairs AS (
+        SELECT DISTINCT car_id, fault_id FROM unnest(p_car_ids, p_fault_ids) AS p(car_id, fault_id)
+    ), removed AS (
+        DELETE FROM report_repairs_daily d
+        USING pairs p
+        WHERE p.car_id = d.car_id AND p.fault_id = d.fault_id
+        RETURNING d.admission_date, d.fault_id
+    )
+    SELECT array_agg(date_trunc('month', admission_date)::date), array_agg(fault_id)
+    INTO removed_months, removed_faults
+    FROM removed;
+
+    WITH pairs AS (
+        SELECT DISTINCT car_id, fault_id FROM unnest(p_car_ids, p_fault_ids) AS p(car_id, fault_id)
+    ), added AS (
+        INSERT INTO report_repairs_daily
+        SELECT cr.admission_date, cr.car_id, cr.fault_id,
+               count(*),
+               count(*) * greatest(1, coalesce(sp.part_rows, 0)),
+               count(*) * coalesce(sp.parts_cost, 0)
+        FROM car_repair cr
+        JOIN pairs p ON p.car_id = cr.car_id AND p.fault_id = cr.fault_id
+        LEFT JOIN (
+            SELECT s.car_id, s.fault_id, count(*) AS part_rows,
+                   sum(s.price * s.quantity) AS parts_cost
+            FROM spare_parts s
+            JOIN pairs p ON p.car_id = s.car_id AND p.fault_id = s.fault_id
+            GROUP BY s.car_id, s.fault_id
+        ) sp ON sp.car_id = cr.car_id AND sp.fault_id = cr.fault_id
+        GROUP BY cr.admission_date, cr.car_id, cr.fault_id, sp.part_rows, sp.parts_cost
+        RETURNING admission_date, fault_id
+    )
+    SELECT array_agg(date_trunc('month', admission_date)::date), array_agg(fault_id)
+    INTO added_months, added_faults
+    FROM added;
+
+    -- Месячные агрегаты пересчитываются из дневных для затронутых
+    -- (месяц, неисправность) - до и после изменения
+    FOR lock_key IN
+        SELECT DISTINCT hashtextextended(format('report_repairs_monthly:%s:%s', month, fault_id), 0)
+        FROM unnest(removed_months || added_months, removed_faults || added_faults) AS a(month, fault_id)
+        ORDER BY 1
+    LOOP
+        PERFORM pg_advisory_xact_lock(lock_key);
+    END LOOP;
+
+    DELETE FROM report_repairs_monthly m
+    USING unnest(removed_months || added_months, removed_faults || added_faults) AS a(month, fault_id)
+    WHERE a.month = m.month AND a.fault_id = m.fault_id;
+
+    INSERT INTO report_repairs_monthly
+    SELECT a.month, a.fault_id, sum(d.repair_count), sum(d.joined_rows), sum(d.parts_cost)
+    FROM (
+        SELECT DISTINCT month, fault_id
+        FROM unnest(removed_months || added_months, removed_faults || added_faults) AS a(month, fault_id)
+    ) a
+    JOIN report_repairs_daily d
+      ON d.fault_id = a.fault_id
+     AND d.admission_date >= a.month
+     AND d.admission_date < a.month + INTERVAL '1 month'
+    GROUP BY a.month, a.fault_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Полный пересчет агрегатов
+CREATE OR REPLACE FUNCTION report_rollup_rebuild()
+RETURNS void AS $$
+BEGIN
+    TRUNCATE report_repairs_daily, report_repairs_monthly;
+
+    INSERT INTO report_repairs_daily
+    SELECT cr.admission_date, cr.car_id, cr.fault_id,
+           count(*),
+           count(*) * greatest(1, coalesce(sp.part_rows, 0)),
+           count(*) * coalesce(sp.parts_cost, 0)
+    FROM car_repair cr
+    LEFT JOIN (
+        SELECT car_id, fault_id, count(*) AS part_rows, sum(price * quantity) AS parts_cost
+        FROM spare_parts
+        GROUP BY car_id, fault_id
+    ) sp ON sp.car_id = cr.car_id AND sp.fault_id = cr.fault_id
+    GROUP BY cr.admission_date, cr.car_id, cr.fault_id, sp.part_rows, sp.parts_cost;
+
+    INSERT INTO report_repairs_monthly
+    SELECT date_trunc('month', admission_date)::date, fault_id,
+           sum(repair_count), sum(joined_rows), sum(parts_cost)
+    FROM report_repairs_daily
+    GROUP BY 1, 2;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггеры уровня оператора: затронутые пары собираются из переходных таблиц
+CREATE OR REPLACE FUNCTION report_rollup_trigger()
+RETURNS trigger AS $$
+DECLARE
+    car_ids INT[];
+    fault_ids INT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(car_id), array_agg(fault_id) INTO car_ids, fault_ids
+        FROM (SELECT DISTINCT car_id, fault_id FROM new_rows) s;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(car_id), array_agg(fault_id) INTO car_ids, fault_ids
+        FROM (SELECT DISTINCT car_id, fault_id FROM old_rows) s;
+    ELSE
+        SELECT array_agg(car_id), array_agg(fault_id) INTO car_ids, fault_ids
+        FROM (SELECT car_id, fault_id FROM new_rows
+              UNION
+              SELECT car_id, fault_id FROM old_rows) s;
+    END IF;
+
+    IF car_ids IS NOT NULL THEN
+        PERFORM report_rollup_refresh(car_ids, fault_ids);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Отключение секций, целиком лежащих до p_before, и перенос их в схему
+-- car_repair_archive (и в табличное пространство p_tablespace, если
+-- задано). Архивные ремонты исключаются из агрегатов отчетов.
+-- Возвращает имена перенесенных секций.
+CREATE OR REPLACE FUNCTION car_repair_archive(p_before DATE, p_tablespace TEXT DEFAULT NULL)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    part RECORD;
+    archived INT := 0;
+    car_ids INT[];
+    fault_ids INT[];
+BEGIN
+    CREATE SCHEMA IF NOT EXISTS car_repair_archive;
+
+    FOR part IN
+        SELECT c.relname,
+               substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \(''([^'']+)''\)')::date
+                   AS upper_bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'car_repair'::regclass
+          AND c.relname <> 'car_repair_default'
+        ORDER BY 2
+    LOOP
+        CONTINUE WHEN part.upper_bound IS NULL OR part.upper_bound > p_before;
+
+        EXECUTE format('ALTER TABLE car_repair DETACH PARTITION %I', part.relname);
+        EXECUTE format('SELECT array_agg(car_id), array_agg(fault_id) '
+                       'FROM (SELECT DISTINCT car_id, fault_id FROM %I) s', part.relname)
+            INTO car_ids, fault_ids;
+        EXECUTE format('ALTER TABLE %I SET SCHEMA car_repair_archive', part.relname);
+        IF p_tablespace IS NOT NULL THEN
+            EXECUTE format('ALTER TABLE car_repair_archive.%I SET TABLESPACE %I',
+                           part.relname, p_tablespace);
+        END IF;
+
+        IF car_ids IS NOT NULL
+           AND to_regprocedure('report_rollup_refresh(integer[], integer[])') IS NOT NULL THEN
+            PERFORM report_rollup_refresh(car_ids, fault_ids);
+        END IF;
+        archived := archived + 1;
+        RETURN NEXT part.relname;
+    END LOOP;
+
+    -- Отключение секции не вызывает триггеров - рабочие места перечитывают таблицу
+    IF archived > 0 THEN
+        PERFORM pg_notify('car_service_changes',
+                          json_build_object('table', 'car_repair', 'op', 'RELOAD')::text);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT report_rollup_rebuild();
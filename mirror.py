@@ -0,0 +1,514 @@
+import datetime
+import decimal
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from dataclasses import asdict
+
+import psycopg2
+from psycopg2 import sql
+
+from edits import EditConflict, RowEdit, RowState, save_edits
+from filters import OR, condition_predicate
+from lookup import LOOKUP_LIMIT, format_label, label_columns, parse_key
+from schema import Column, ForeignKey, TableInfo
+from search import search_columns
+
+
+MIRROR_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "car_service_mirror.db")
+
+# Записи журнала изменений хранятся столько дней; копия таблицы, не
+# синхронизированная дольше, загружается заново целиком
+CHANGE_LOG_DAYS = 7
+
+MERGE_ATTEMPTS = 3  # попыток записать отложенное изменение поверх чужих
+
+# Типы PostgreSQL (OID), значения которых хранятся в SQLite текстом
+_BOOL, _DATE, _TIMESTAMP, _TIMESTAMPTZ, _NUMERIC = 16, 1082, 1114, 1184, 1700
+_DECODERS = {
+    _BOOL: bool,
+    _DATE: datetime.date.fromisoformat,
+    _TIMESTAMP: datetime.datetime.fromisoformat,
+    _TIMESTAMPTZ: datetime.datetime.fromisoformat,
+    _NUMERIC: decimal.Decimal,
+}
+
+# Описание столбца результата, как у курсора psycopg2 (для ColumnarBuilder)
+ColumnDescription = namedtuple("ColumnDescription", "name type_code precision scale")
+
+_META_SQL = """
+    CREATE TABLE IF NOT EXISTS mirror_tables (
+        name TEXT PRIMARY KEY,
+        structure TEXT NOT NULL,   -- TableInfo (JSON)
+        columns TEXT NOT NULL,     -- описание столбцов результата (JSON)
+        since INTEGER,             -- xmin снимка прошлой синхронизации; NULL - без журнала
+        synced_at REAL NOT NULL    -- время прошлой синхронизации
+    );
+    CREATE TABLE IF NOT EXISTS mirror_queue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        op TEXT NOT NULL,          -- update или insert
+        data TEXT NOT NULL,        -- изменение (JSON)
+        created_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS mirror_stats (
+        name TEXT PRIMARY KEY,
+        value
+    );
+"""
+
+
+class MirrorStatus:
+    """Состояние локальной копии для показа"""
+
+    def __init__(self, tables, queued, stats):
+        self.tables = tables    # список (таблица, строк, время синхронизации, по журналу)
+        self.queued = queued    # отложенных изменений
+        self.stats = stats      # счетчики: syncs, changes, replayed, conflicts, last_error, ...
+
+    def lag(self):
+        """Секунды с последней синхронизации самой отстающей таблицы (None - не было)"""
+        times = [synced_at for name, rows, synced_at, logged in self.tables]
+        return time.time() - min(times) if times else None
+
+
+class LocalMirror:
+    """Локальная копия (SQLite) выбранных таблиц центральной БД.
+
+    Копия обновляется sync: таблицы с журналом изменений (миграция
+    0003_change_log) - только измененными строками, остальные - целиком.
+    Из нее показываются таблицы (select), ищутся строки справочников
+    (lookup) и берется структура таблиц без связи с БД (structures).
+    Изменения, сделанные без связи, копятся в очереди (queue_edits,
+    queue_insert) и отправляются replay.
+    """
+
+    def __init__(self, tables, path=None):
+        self.tables = tuple(tables)
+        self.path = path or MIRROR_FILE
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(_META_SQL)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __contains__(self, name):
+        """Есть ли в копии таблица name (уже загруженная)"""
+        return name in self.tables and self._meta(name) is not None
+
+    # --- Синхронизация ---
+
+    def sync(self, conn, schema):
+        """Обновление копии по центральной БД; возвращает число полученных строк.
+
+        Все таблицы читаются в одном снимке (REPEATABLE READ). Изменения,
+        записанные в журнал транзакциями, еще не завершенными к началу
+        снимка, будут прочитаны при следующей синхронизации.
+        """
+        schema.check(conn)
+        conn.rollback()
+        cursor = conn.cursor()
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cursor.execute("""
+            SELECT txid_snapshot_xmin(txid_current_snapshot()),
+                   array(SELECT DISTINCT c.relname FROM pg_trigger t
+                         JOIN pg_class c ON c.oid = t.tgrelid
+                         WHERE t.tgname = 'log_change_insert')
+        """)
+        since, logged = cursor.fetchone()
+
+        updates = []
+        for name in self.tables:
+            if name not in schema:
+                continue
+            table = schema.table(name)
+            meta = self._meta(name)
+            if (meta is not None and meta["since"] is not None and name in logged
+                    and meta["structure"] == table
+                    and time.time() - meta["synced_at"] < CHANGE_LOG_DAYS * 86400):
+                update = self._read_changes(cursor, table, meta["since"])
+            else:
+                update = None
+            if update is None:
+                update = self._read_table(cursor, table)
+            updates.append((table, name in logged, update))
+        conn.rollback()
+
+        received = 0
+        now = time.time()
+        with self._lock, self._db:
+            for table, logged_table, (full, columns, rows, removed_keys) in updates:
+                if full:
+                    self._create_table(table)
+                else:
+                    self._delete_keys(table, removed_keys)
+                self._insert_rows(table, rows)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO mirror_tables VALUES (?, ?, ?, ?, ?)",
+                    (table.name, json.dumps(asdict(table)), json.dumps(columns),
+                     since if logged_table else None, now))
+                received += len(rows)
+            self._count("syncs", 1)
+            self._count("received", received)
+            self._set_stat("synced_at", now)
+            self._set_stat("last_error", None)
+
+        if logged:
+            # Старые записи журнала больше не нужны ни одной копии
+            cursor.execute("DELETE FROM change_log WHERE changed_at < now() - make_interval(days => %s)",
+                           (CHANGE_LOG_DAYS,))
+            conn.commit()
+        return received
+
+    def sync_failed(self, error):
+        """Запоминание ошибки синхронизации (для состояния копии)"""
+        with self._lock, self._db:
+            self._set_stat("last_error", str(error).strip())
+
+    def _read_table(self, cursor, table):
+        cursor.execute(sql.SQL("SELECT * FROM {}").format(sql.Identifier(table.name)))
+        return True, _columns(cursor.description), cursor.fetchall(), []
+
+    def _read_changes(self, cursor, table, since):
+        """Строки, измененные после снимка since, и ключи удаленных строк;
+        None, если таблицу нужно загрузить целиком (она очищалась)
+        """
+        cursor.execute("SELECT DISTINCT row_key FROM change_log WHERE table_name = %s AND txid >= %s",
+                       (table.name, since))
+        keys = [row[0] for row in cursor.fetchall()]
+        if None in keys:
+            return None
+        if not keys:
+            return False, self._meta(table.name)["columns"], [], []
+        cursor.execute(sql.SQL("""
+            SELECT t.* FROM {} t
+            WHERE jsonb_build_array({}) IN (
+                SELECT row_key FROM change_log WHERE table_name = %s AND txid >= %s)
+        """).format(sql.Identifier(table.name),
+                    sql.SQL(", ").join(sql.Identifier("t", col) for col in table.primary_key)),
+            (table.name, since))
+        # Строки измененных ключей удаляются и записываются заново;
+        # ключи в журнале - в том же виде, что и в копии (JSON)
+        return False, _columns(cursor.description), cursor.fetchall(), keys
+
+    def _create_table(self, table):
+        self._db.execute(f"DROP TABLE IF EXISTS {_quote(table.name)}")
+        columns = ", ".join(_quote(name) for name in table.column_names())
+        key = ", ".join(_quote(col) for col in table.primary_key)
+        self._db.execute(f"CREATE TABLE {_quote(table.name)} ({columns}"
+                         + (f", PRIMARY KEY ({key})" if key else "") + ")")
+
+    def _delete_keys(self, table, keys):
+        condition = " AND ".join(f"{_quote(col)} = ?" for col in table.primary_key)
+        self._db.executemany(f"DELETE FROM {_quote(table.name)} WHERE {condition}",
+                             [tuple(key) for key in keys])
+
+    def _insert_rows(self, table, rows):
+        placeholders = ", ".join("?" for _ in table.columns)
+        self._db.executemany(
+            f"INSERT OR REPLACE INTO {_quote(table.name)} VALUES ({placeholders})",
+            [tuple(map(_encode, row)) for row in rows])
+
+    # --- Чтение ---
+
+    def structures(self):
+        """Структура таблиц копии (TableInfo) - для работы без связи с БД"""
+        with self._lock:
+            rows = self._db.execute("SELECT structure FROM mirror_tables").fetchall()
+        return [_table_from_dict(json.loads(structure)) for structure, in rows]
+
+    def description(self, name):
+        """Описание столбцов таблицы копии (ColumnDescription)"""
+        return [ColumnDescription(*column) for column in self._meta(name)["columns"]]
+
+    def select(self, table, flt=None, search=None, order=()):
+        """Строки таблицы копии: пара (описание столбцов, строки).
+
+        flt - filters.Filter, search - текст поиска по всем полям (все
+        слова должны встретиться, без учета регистра), order - пары
+        (поле, по убыванию). NULL при сортировке - как в PostgreSQL.
+        """
+        description = self.description(table.name)
+        headers = [column.name for column in description]
+        decoders = [_DECODERS.get(column.type_code) for column in description]
+        with self._lock:
+            stored = self._db.execute(f"SELECT * FROM {_quote(table.name)}").fetchall()
+        rows = [tuple(value if value is None or decode is None else decode(value)
+                      for value, decode in zip(row, decoders)) for row in stored]
+
+        if flt is not None and flt.conditions:
+            predicates = []
+            for condition in flt.conditions:
+                match = condition_predicate(table, condition)
+                predicates.append((headers.index(condition.column), match))
+            combine = any if flt.combine == OR else all
+            rows = [row for row in rows
+                    if combine(match(row[column]) for column, match in predicates)]
+        if search and search.strip():
+            words = search.casefold().split()
+            columns = [headers.index(col) for col in search_columns(table)]
+            rows = [row for row in rows if _matches_words(row, columns, words)]
+
+        order = list(order) or [(col, False) for col in table.primary_key]
+        for name, descending in reversed(order):
+            column = headers.index(name)
+            present = [row for row in rows if row[column] is not None]
+            empty = [row for row in rows if row[column] is None]
+            present.sort(key=lambda row: row[column], reverse=descending)
+            rows = empty + present if descending else present + empty
+        return description, rows
+
+    def read_rows(self, table, keys):
+        """Строки по ключам для редактирования без связи с БД (как edits.read_rows).
+
+        Версия строки в копии неизвестна (None): при отправке replay
+        изменения всегда объединяются с текущей строкой БД по полям.
+        """
+        description, rows = self.select(table)
+        names = [column.name for column in description]
+        key_idx = [names.index(col) for col in table.primary_key]
+        found = {tuple(row[i] for i in key_idx): row for row in rows}
+        return [RowState(tuple(key), None, dict(zip(names, found[tuple(key)])))
+                for key in keys if tuple(key) in found]
+
+    def lookup(self, table, key_column, text, limit=LOOKUP_LIMIT):
+        """Строки справочника, подходящие под текст (как lookup.lookup)"""
+        labels = label_columns(table)
+        key = parse_key(table, key_column, text)
+        description, rows = self.select(table, order=[(col, False) for col in labels])
+        headers = [column.name for column in description]
+        key_idx = headers.index(key_column)
+        label_idx = [headers.index(col) for col in labels]
+        words = text.casefold().split()
+        columns = [headers.index(col) for col in search_columns(table)]
+        found = [row for row in rows
+                 if (key is not None and row[key_idx] == key) or _matches_words(row, columns, words)]
+        return [(row[key_idx], format_label([row[i] for i in label_idx])) for row in found[:limit]]
+
+    def lookup_label(self, table, key_column, key):
+        """Подпись строки справочника по ключу (как lookup.lookup_label)"""
+        labels = ", ".join(_quote(col) for col in label_columns(table))
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {labels} FROM {_quote(table.name)} WHERE {_quote(key_column)} = ?",
+                (_encode(key),)).fetchone()
+        return format_label(row) if row is not None else None
+
+    # --- Изменения без связи с БД ---
+
+    def queue_edits(self, table, edits):
+        """Отложенная запись изменений строк (edits.RowEdit).
+
+        Изменения сразу видны в копии; в центральную БД они пишутся
+        replay с проверкой версии строки, как при обычном сохранении.
+        """
+        now = time.time()
+        with self._lock, self._db:
+            for edit in edits:
+                data = {"key": list(map(_encode, edit.row.key)), "version": edit.row.version,
+                        "values": _encode_dict(edit.row.values),
+                        "changes": _encode_dict(edit.changes)}
+                self._db.execute(
+                    "INSERT INTO mirror_queue (table_name, op, data, created_at) VALUES (?, ?, ?, ?)",
+                    (table.name, "update", json.dumps(data), now))
+                if table.name in self.tables:
+                    assignments = ", ".join(f"{_quote(name)} = ?" for name in edit.changes)
+                    condition = " AND ".join(f"{_quote(col)} = ?" for col in table.primary_key)
+                    self._db.execute(
+                        f"UPDATE {_quote(table.name)} SET {assignments} WHERE {condition}",
+                        [_encode(value) for value in edit.changes.values()]
+                        + [_encode(value) for value in edit.row.key])
+
+    def queue_insert(self, table, values):
+        """Отложенное добавление строки (поле -> значение).
+
+        Строка появится в копии после отправки: ключ ей выдаст центральная БД.
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO mirror_queue (table_name, op, data, created_at) VALUES (?, ?, ?, ?)",
+                (table.name, "insert", json.dumps(_encode_dict(values)), time.time()))
+
+    def queued(self):
+        """Число отложенных изменений"""
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM mirror_queue").fetchone()[0]
+
+    def replay(self, conn, schema):
+        """Отправка отложенных изменений по порядку.
+
+        Изменение строки, которую после чтения изменил другой
+        пользователь, объединяется с чужим по полям (RowConflict.merge);
+        в полях, измененных обоими, остается чужое значение. Такие поля и
+        удаленные строки считаются конфликтами. Возвращает пару (отправлено,
+        конфликтов). При ошибке связи неотправленные изменения остаются
+        в очереди.
+        """
+        schema.check(conn)
+        with self._lock:
+            queued = self._db.execute(
+                "SELECT id, table_name, op, data FROM mirror_queue ORDER BY id").fetchall()
+        sent = conflicts = 0
+        for queue_id, table_name, op, data in queued:
+            table = schema.table(table_name)
+            data = json.loads(data)
+            try:
+                if op == "insert":
+                    lost = self._replay_insert(conn, table, data)
+                else:
+                    lost = self._replay_update(conn, table, data)
+            except (psycopg2.IntegrityError, psycopg2.DataError) as e:
+                # Изменение нарушает ограничения (например, ссылку на
+                # удаленную строку) - оно теряется, остальные отправляются
+                conn.rollback()
+                lost = [str(e).strip()]
+            sent += 1
+            conflicts += len(lost)
+            with self._lock, self._db:
+                self._db.execute("DELETE FROM mirror_queue WHERE id = ?", (queue_id,))
+                self._count("replayed", 1)
+                if lost:
+                    self._count("conflicts", len(lost))
+                    self._set_stat("last_conflict", f"{table_name}: {'; '.join(lost)}")
+        return sent, conflicts
+
+    def _replay_insert(self, conn, table, data):
+        values = self._decode_dict(table, data)
+        names = list(values)
+        cursor = conn.cursor()
+        cursor.execute(sql.SQL("INSERT INTO {} ({}) VALUES ({})").format(
+            sql.Identifier(table.name), sql.SQL(", ").join(map(sql.Identifier, names)),
+            sql.SQL(", ").join(sql.Placeholder() for _ in names)),
+            [values[name] for name in names])
+        conn.commit()
+        return []
+
+    def _replay_update(self, conn, table, data):
+        key = tuple(self._decode_dict(table, dict(zip(table.primary_key, data["key"]))).values())
+        row = RowState(key, data["version"], self._decode_dict(table, data["values"]))
+        edit = RowEdit(row, self._decode_dict(table, data["changes"]))
+        lost = []
+        for _ in range(MERGE_ATTEMPTS):
+            try:
+                save_edits(conn, table, [edit])
+                return lost
+            except EditConflict as e:
+                conflict = e.conflicts[0]
+                if conflict.current is None:
+                    return lost + [f"строка {', '.join(map(str, key))} удалена"]
+                edit, fields = conflict.merge()
+                for name in fields:
+                    del edit.changes[name]
+                    lost.append(f"{', '.join(map(str, key))}: {name}")
+                if not edit.changes:
+                    return lost
+        return lost + [f"строка {', '.join(map(str, key))} изменяется слишком часто"]
+
+    def _decode_dict(self, table, values):
+        description = {column.name: column for column in self.description(table.name)} \
+            if table.name in self else {}
+        result = {}
+        for name, value in values.items():
+            column = description.get(name)
+            decode = _DECODERS.get(column.type_code) if column is not None else None
+            result[name] = value if value is None or decode is None else decode(value)
+        return result
+
+    # --- Состояние ---
+
+    def status(self):
+        """Состояние копии (MirrorStatus)"""
+        with self._lock:
+            tables = []
+            for name, since, synced_at in self._db.execute(
+                    "SELECT name, since, synced_at FROM mirror_tables ORDER BY name").fetchall():
+                if name not in self.tables:
+                    continue
+                rows = self._db.execute(f"SELECT count(*) FROM {_quote(name)}").fetchone()[0]
+                tables.append((name, rows, synced_at, since is not None))
+            queued = self._db.execute("SELECT count(*) FROM mirror_queue").fetchone()[0]
+            stats = dict(self._db.execute("SELECT name, value FROM mirror_stats").fetchall())
+        return MirrorStatus(tables, queued, stats)
+
+    def _meta(self, name):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT structure, columns, since, synced_at FROM mirror_tables WHERE name = ?",
+                (name,)).fetchone()
+        if row is None:
+            return None
+        return {"structure": _table_from_dict(json.loads(row[0])), "columns": json.loads(row[1]),
+                "since": row[2], "synced_at": row[3]}
+
+    def _count(self, name, value):
+        self._db.execute("INSERT INTO mirror_stats VALUES (?, ?) "
+                         "ON CONFLICT (name) DO UPDATE SET value = coalesce(value, 0) + ?",
+                         (name, value, value))
+
+    def _set_stat(self, name, value):
+        self._db.execute("INSERT OR REPLACE INTO mirror_stats VALUES (?, ?)", (name, value))
+
+
+def open_mirror(config):
+    """Локальная копия по настройкам (db.load_config); None, если таблицы не заданы"""
+    tables = [name.strip() for name in config["mirror_tables"].split(",") if name.strip()]
+    if not tables:
+        return None
+    return LocalMirror(tables, config["mirror_path"] or None)
+
+
+def age_label(seconds):
+    """Давность для показа: «40 с назад», «5 мин назад», «3 ч назад»"""
+    seconds = max(int(seconds), 0)
+    if seconds < 60:
+        return f"{seconds} с назад"
+    if seconds < 3600:
+        return f"{seconds // 60} мин назад"
+    if seconds < 2 * 86400:
+        return f"{seconds // 3600} ч назад"
+    return f"{seconds // 86400} дн назад"
+
+
+def _columns(description):
+    return [[column.name, column.type_code, column.precision, column.scale]
+            for column in description]
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _encode(value):
+    """Значение для SQLite (даты и NUMERIC - текстом, как в JSON журнала)"""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return value
+
+
+def _encode_dict(values):
+    return {name: _encode(value) for name, value in values.items()}
+
+
+def _matches_words(row, columns, words):
+    text = " ".join(str(row[i]) for i in columns if row[i] is not None).casefold()
+    return all(word in text for word in words)
+
+
+def _table_from_dict(data):
+    return TableInfo(
+        name=data["name"],
+        columns=tuple(Column(**column) for column in data["columns"]),
+        primary_key=tuple(data["primary_key"]),
+        foreign_keys=tuple(ForeignKey(**dict(fk, columns=tuple(fk["columns"]),
+                                             ref_columns=tuple(fk["ref_columns"])))
+                           for fk in data["foreign_keys"]),
+        unique_keys=tuple(tuple(key) for key in data["unique_keys"]),
+        partition_key=tuple(data["partition_key"]))
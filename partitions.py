@@ -0,0 +1,81 @@
+MONTHS_AHEAD = 3  # на сколько месяцев вперед создаются секции car_repair
+
+
+def partitioning_installed(conn):
+    """Секционирована ли car_repair (миграция 0002_partition_car_repair)"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regprocedure('car_repair_ensure_partitions(integer)') IS NOT NULL")
+    return cursor.fetchone()[0]
+
+
+def ensure_partitions(conn, months_ahead=MONTHS_AHEAD):
+    """Создание секций car_repair на months_ahead месяцев вперед.
+
+    Строки из секции по умолчанию переносятся в секции своих месяцев.
+    Возвращает число созданных секций (0, если таблица не секционирована).
+    """
+    if not partitioning_installed(conn):
+        conn.rollback()
+        return 0
+    cursor = conn.cursor()
+    cursor.execute("SELECT car_repair_ensure_partitions(%s)", (months_ahead,))
+    created = cursor.fetchone()[0]
+    conn.commit()
+    return created
+
+
+def missing_partitions(conn, months_ahead=MONTHS_AHEAD):
+    """Месяцы без секций car_repair (только чтение, для проверки из приложения).
+
+    Возвращает начала месяцев от текущего на months_ahead вперед, для
+    которых секции нет, и месяцы строк, оставшихся в секции по умолчанию.
+    Пустой список - секции в порядке или таблица не секционирована.
+    """
+    if not partitioning_installed(conn):
+        conn.rollback()
+        return []
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT month FROM (
+            SELECT generate_series(date_trunc('month', current_date),
+                                   date_trunc('month', current_date)
+                                       + make_interval(months => %s),
+                                   INTERVAL '1 month')::date AS month
+        ) m
+        WHERE to_regclass('car_repair_' || to_char(month, 'YYYY_MM')) IS NULL
+        UNION
+        SELECT DISTINCT date_trunc('month', admission_date)::date FROM car_repair_default
+        ORDER BY 1
+    """, (months_ahead,))
+    result = [row[0] for row in cursor.fetchall()]
+    conn.rollback()
+    return result
+
+
+def archive_partitions(conn, before, tablespace=None):
+    """Перенос секций car_repair, целиком лежащих до даты before, в архив.
+
+    Секции отключаются и переносятся в схему car_repair_archive (и в
+    табличное пространство tablespace, если оно задано). Возвращает
+    имена перенесенных секций.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT car_repair_archive(%s, %s)", (before, tablespace))
+    names = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    return names
+
+
+def list_partitions(conn):
+    """Секции car_repair: список (имя, границы, примерное число строк)"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass('car_repair')
+        ORDER BY c.relname
+    """)
+    result = cursor.fetchall()
+    conn.rollback()
+    return result
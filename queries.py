@@ -0,0 +1,165 @@
+from psycopg2 import sql
+
+
+def browse_query(table, condition=None, order=None):
+    """Запрос просмотра таблицы (с условием фильтра/поиска, если оно задано).
+
+    order - порядок строк: пары (столбец, по убыванию), проверенные по
+    структуре таблицы (sorting.sort_order); по умолчанию - по первому столбцу.
+    """
+    query = sql.SQL("SELECT * FROM {}").format(sql.Identifier(table))
+    if condition is not None:
+        query += sql.SQL(" WHERE {}").format(condition)
+    if order:
+        return query + sql.SQL(" ORDER BY {}").format(_order_by(order))
+    return query + sql.SQL(" ORDER BY 1")
+
+
+def key_condition(key_columns):
+    """Условие отбора строки по значениям ключа: a = %s AND b = %s"""
+    return sql.SQL(" AND ").join(
+        sql.SQL("{} = %s").format(sql.Identifier(col)) for col in key_columns)
+
+
+def key_in_condition(key_columns, keys):
+    """Условие отбора строк по списку значений ключа: (a, b) IN ((%s, %s), ...)
+
+    Возвращает пару (условие, параметры).
+    """
+    row = sql.SQL("({})").format(sql.SQL(", ").join(sql.Placeholder() for _ in key_columns))
+    condition = sql.SQL("({}) IN ({})").format(
+        sql.SQL(", ").join(sql.Identifier(col) for col in key_columns),
+        sql.SQL(", ").join(row for _ in keys))
+    return condition, [value for key in keys for value in key]
+
+
+def typed_keys_query(key_types, keys):
+    """Запрос, приводящий значения ключей к типам столбцов ключа.
+
+    Нужен для ключей, пришедших в JSON (даты в нем - строки).
+    key_types - типы в виде format_type. Возвращает пару (запрос, параметры).
+    """
+    row = sql.SQL("({})").format(sql.SQL(", ").join(
+        sql.SQL("%s::{}").format(sql.SQL(key_type)) for key_type in key_types))
+    query = sql.SQL("SELECT * FROM (VALUES {}) k").format(sql.SQL(", ").join(row for _ in keys))
+    return query, [value for key in keys for value in key]
+
+
+def keyset_page_query(table, key_columns, limit, after=None, before=None,
+                      start=None, last=False, condition=None, condition_params=(), order=None,
+                      not_null=None):
+    """Запрос одной страницы с пагинацией по ключу (keyset/seek).
+
+    after  - ключ последней строки текущей страницы (следующая страница);
+    before - ключ первой строки текущей страницы (предыдущая страница);
+    start  - ключ или его префикс, с которого начинается страница;
+    last   - последняя страница.
+    condition - дополнительное условие фильтра (sql.Composable).
+    order  - порядок страниц (пары (столбец, по убыванию), заканчивающиеся
+             первичным ключом - см. sorting.sort_order); тогда after и
+             before - значения этих столбцов, а start не поддерживается.
+    not_null - столбцы с ограничением NOT NULL (по умолчанию - только
+               столбцы ключа); остальные столбцы сортировки могут
+               содержать NULL.
+
+    Сравнение идет по кортежу столбцов ключа, поэтому запрос использует
+    индекс первичного ключа (или индекс сортировки) и не зависит от
+    глубины прокрутки, в отличие от OFFSET. Возвращает пару (запрос,
+    параметры).
+    """
+    if order is None:
+        order = [(col, False) for col in key_columns]
+    elif start is not None:
+        raise ValueError("Переход к ключу возможен только в порядке ключа")
+    not_null = set(key_columns if not_null is None else not_null)
+
+    conditions = []
+    params = []
+
+    if condition is not None:
+        conditions.append(sql.SQL("({})").format(condition))
+        params.extend(condition_params)
+
+    descending = False
+    if after is not None:
+        conditions.append(_seek_condition(order, after, True, params, not_null))
+    elif before is not None:
+        conditions.append(_seek_condition(order, before, False, params, not_null))
+        descending = True
+    elif start is not None:
+        conditions.append(_key_compare(key_columns[:len(start)], ">=", start))
+        params.extend(start)
+    elif last:
+        descending = True
+
+    query = sql.SQL("SELECT * FROM {}").format(sql.Identifier(table))
+    if conditions:
+        query += sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions)
+    query += sql.SQL(" ORDER BY {} LIMIT %s").format(_order_by(order, descending))
+    params.append(limit)
+
+    if descending:
+        # Страница читается в обратном порядке, затем разворачивается
+        query = sql.SQL("SELECT * FROM ({}) page ORDER BY {}").format(query, _order_by(order))
+
+    return query, params
+
+
+def _key_compare(key_columns, operator, values):
+    return sql.SQL("({}) {} ({})").format(
+        sql.SQL(", ").join(sql.Identifier(col) for col in key_columns),
+        sql.SQL(operator),
+        sql.SQL(", ").join(sql.Placeholder() for _ in values))
+
+
+def _seek_condition(order, values, forward, params, not_null=()):
+    """Условие строк после (forward) или до строки со значениями values
+    в порядке order; параметры добавляются в params.
+
+    Если направления всех столбцов одинаковы и все они NOT NULL (not_null),
+    сравнивается кортеж целиком - так условие использует индекс. Сравнение
+    кортежей не пропускает строк только без NULL: (NULL, 5) > (1, 2) - это
+    NULL, и строка с пустым полем сортировки не попала бы ни на одну
+    страницу, хотя ORDER BY ставит ее в конец. Иначе
+    условие раскрывается: (a после x) OR (a = x AND b после y) ..., NULL
+    стоит в конце по возрастанию и в начале по убыванию, как в ORDER BY.
+    """
+    directions = {descending for col, descending in order}
+    if len(directions) == 1 and all(col in not_null for col, descending in order):
+        params.extend(values)
+        greater = forward != directions.pop()
+        return _key_compare([col for col, descending in order], ">" if greater else "<", values)
+
+    alternatives = []
+    for i, ((col, descending), value) in enumerate(zip(order, values)):
+        field = sql.Identifier(col)
+        parts = []
+        part_params = []
+        for (prev_col, _), prev_value in zip(order[:i], values[:i]):
+            if prev_value is None:
+                parts.append(sql.SQL("{} IS NULL").format(sql.Identifier(prev_col)))
+            else:
+                parts.append(sql.SQL("{} = %s").format(sql.Identifier(prev_col)))
+                part_params.append(prev_value)
+        if forward != descending:
+            # Нужны большие значения; NULL - в той же стороне
+            if value is None:
+                continue
+            parts.append(sql.SQL("({} > %s OR {} IS NULL)").format(field, field))
+        elif value is None:
+            parts.append(sql.SQL("{} IS NOT NULL").format(field))
+        else:
+            parts.append(sql.SQL("{} < %s").format(field))
+        if value is not None:
+            part_params.append(value)
+        params.extend(part_params)
+        alternatives.append(sql.SQL("({})").format(sql.SQL(" AND ").join(parts)))
+    if not alternatives:
+        return sql.SQL("false")
+    return sql.SQL("({})").format(sql.SQL(" OR ").join(alternatives))
+
+
+def _order_by(order, reverse=False):
+    return sql.SQL(", ").join(
+        sql.Identifier(col) + sql.SQL(" DESC" if descending != reverse else "")
+        for col, descending in order)
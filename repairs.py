@@ -0,0 +1,163 @@
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass, field
+from decimal import Decimal
+
+from psycopg2.extras import execute_values
+
+
+QUEUE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "car_service_queue.json")
+
+
+@dataclass
+class RepairOrder:
+    """Заказ на ремонт с запчастями"""
+    car_id: int
+    fault_id: int
+    admission_date: str            # YYYY-MM-DD
+    completion_date: str = None
+    team_id: int = None
+    parts: list = field(default_factory=list)  # [(название, цена, количество)]
+
+    def __post_init__(self):
+        self.parts = [(name, Decimal(str(price)), int(quantity))
+                      for name, price, quantity in self.parts]
+
+    def to_dict(self):
+        data = asdict(self)
+        data["parts"] = [[name, str(price), quantity] for name, price, quantity in self.parts]
+        return data
+
+
+# Ремонт и все его запчасти одним запросом
+_SAVE_ORDER_SQL = """
+    WITH repair AS (
+        INSERT INTO car_repair (car_id, fault_id, admission_date, completion_date, team_id)
+        VALUES (%(car_id)s, %(fault_id)s, %(admission_date)s, %(completion_date)s, %(team_id)s)
+        RETURNING repair_id, car_id, fault_id
+    ), parts AS (
+        INSERT INTO spare_parts ({columns})
+        SELECT {values}
+        FROM repair, unnest(%(names)s::text[], %(prices)s::numeric[], %(quantities)s::int[])
+            AS p(name, price, quantity)
+        RETURNING part_id
+    )
+    SELECT repair_id, (SELECT count(*) FROM parts) FROM repair
+"""
+
+
+def save_order(conn, order, link_parts=True):
+    """Сохранение заказа за один запрос; возвращает repair_id.
+
+    link_parts - записывать repair_id в spare_parts (если столбец есть).
+    Транзакция не фиксируется.
+    """
+    if link_parts:
+        columns = "repair_id, car_id, fault_id, name, price, quantity"
+        values = "repair.repair_id, repair.car_id, repair.fault_id, p.name, p.price, p.quantity"
+    else:
+        columns = "car_id, fault_id, name, price, quantity"
+        values = "repair.car_id, repair.fault_id, p.name, p.price, p.quantity"
+
+    params = asdict(order)
+    params["names"] = [name for name, price, quantity in order.parts]
+    params["prices"] = [price for name, price, quantity in order.parts]
+    params["quantities"] = [quantity for name, price, quantity in order.parts]
+
+    cursor = conn.cursor()
+    cursor.execute(_SAVE_ORDER_SQL.format(columns=columns, values=values), params)
+    repair_id, part_count = cursor.fetchone()
+    return repair_id
+
+
+def save_orders(conn, orders, link_parts=True):
+    """Сохранение пакета заказов в одной транзакции; возвращает список repair_id.
+
+    Идентификаторы ремонтов выделяются заранее одним запросом к
+    последовательности, затем ремонты и запчасти пишутся многострочными
+    INSERT (execute_values) - число запросов не зависит от числа заказов.
+    """
+    if len(orders) == 1:
+        repair_ids = [save_order(conn, orders[0], link_parts)]
+        conn.commit()
+        return repair_ids
+    if not orders:
+        return []
+
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT nextval(pg_get_serial_sequence('car_repair', 'repair_id'))
+        FROM generate_series(1, %s)
+    """, (len(orders),))
+    repair_ids = [row[0] for row in cursor.fetchall()]
+
+    execute_values(cursor, """
+        INSERT INTO car_repair (repair_id, car_id, fault_id, admission_date, completion_date, team_id)
+        VALUES %s
+    """, [(repair_id, o.car_id, o.fault_id, o.admission_date, o.completion_date, o.team_id)
+          for repair_id, o in zip(repair_ids, orders)], page_size=1000)
+
+    parts = []
+    for repair_id, o in zip(repair_ids, orders):
+        for name, price, quantity in o.parts:
+            row = (o.car_id, o.fault_id, name, price, quantity)
+            parts.append((repair_id,) + row if link_parts else row)
+    if parts:
+        columns = "car_id, fault_id, name, price, quantity"
+        if link_parts:
+            columns = "repair_id, " + columns
+        execute_values(cursor, f"INSERT INTO spare_parts ({columns}) VALUES %s",
+                       parts, page_size=1000)
+
+    conn.commit()
+    return repair_ids
+
+
+class OrderQueue:
+    """Очередь заказов, сохраненных без связи с БД (файл JSON).
+
+    Заказы копятся в файле и отправляются одним пакетом через save_orders.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("CAR_SERVICE_QUEUE", QUEUE_FILE)
+        self._lock = threading.Lock()
+
+    def orders(self):
+        """Заказы в очереди"""
+        with self._lock:
+            return self._load()
+
+    def __len__(self):
+        return len(self.orders())
+
+    def append(self, order):
+        """Добавление заказа в очередь"""
+        with self._lock:
+            orders = self._load()
+            orders.append(order)
+            self._save(orders)
+
+    def flush(self, conn, link_parts=True):
+        """Отправка всех заказов очереди одним пакетом; возвращает список repair_id.
+
+        При ошибке очередь не меняется.
+        """
+        with self._lock:
+            orders = self._load()
+            repair_ids = save_orders(conn, orders, link_parts)
+            self._save([])
+            return repair_ids
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding="utf-8") as f:
+            return [RepairOrder(**data) for data in json.load(f)]
+
+    def _save(self, orders):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump([order.to_dict() for order in orders], f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,299 @@
+import csv
+import io
+import json
+from collections import Counter
+from dataclasses import dataclass
+from datetime import timedelta
+
+# pyarrow импортируется долго и нужен только для Parquet - загружается
+# при первом выводе в этом формате
+pyarrow = None
+
+
+REPAIRS_BY_DATE_SQL = """
+    SELECT
+        cr.admission_date,
+        c.owner,
+        c.body_number,
+        f.name,
+        f.work_cost,
+        COALESCE(SUM(sp.price * sp.quantity), 0) as parts_cost,
+        f.work_cost + COALESCE(SUM(sp.price * sp.quantity), 0) as total_cost
+    FROM car_repair cr
+    JOIN cars c ON cr.car_id = c.car_id
+    JOIN faults f ON cr.fault_id = f.fault_id
+    LEFT JOIN spare_parts sp ON cr.car_id = sp.car_id AND cr.fault_id = sp.fault_id
+    WHERE cr.admission_date BETWEEN %(start)s AND %(end)s
+    GROUP BY cr.admission_date, c.owner, c.body_number, f.name, f.work_cost
+    ORDER BY cr.admission_date
+"""
+
+TEAMS_SQL = """
+    SELECT
+        t.name as team_name,
+        COUNT(p.inn) as person_count,
+        w.name as workshop_name,
+        STRING_AGG(p.inn, ', ') as inn_list
+    FROM teams t
+    LEFT JOIN personnel p ON t.team_id = p.team_id
+    LEFT JOIN workshops w ON p.workshop_id = w.workshop_id
+    GROUP BY t.team_id, t.name, w.name
+    ORDER BY person_count DESC
+"""
+
+FINANCE_SQL = """
+    SELECT
+        TO_CHAR(cr.admission_date, 'YYYY-MM') as month,
+        COUNT(*) as repair_count,
+        SUM(f.work_cost) as work_total,
+        COALESCE(SUM(sp.price * sp.quantity), 0) as parts_total,
+        SUM(f.work_cost) + COALESCE(SUM(sp.price * sp.quantity), 0) as total_income
+    FROM car_repair cr
+    JOIN faults f ON cr.fault_id = f.fault_id
+    LEFT JOIN spare_parts sp ON cr.car_id = sp.car_id AND cr.fault_id = sp.fault_id
+    WHERE cr.admission_date BETWEEN %(start)s AND %(end)s
+    GROUP BY TO_CHAR(cr.admission_date, 'YYYY-MM')
+    ORDER BY month
+"""
+
+# Полные месяцы периода берутся из месячных агрегатов, неполные по краям -
+# из дневных
+FINANCE_ROLLUP_SQL = """
+    WITH m AS (
+        SELECT month, fault_id, joined_rows, parts_cost
+        FROM report_repairs_monthly
+        WHERE month >= %(full_from)s AND month < %(full_to)s
+        UNION ALL
+        SELECT date_trunc('month', admission_date)::date, fault_id, joined_rows, parts_cost
+        FROM report_repairs_daily
+        WHERE admission_date BETWEEN %(start)s AND %(end)s
+          AND NOT (admission_date >= %(full_from)s AND admission_date < %(full_to)s)
+    )
+    SELECT
+        TO_CHAR(m.month, 'YYYY-MM') as month,
+        SUM(m.joined_rows)::bigint as repair_count,
+        SUM(f.work_cost * m.joined_rows) as work_total,
+        SUM(m.parts_cost) as parts_total,
+        SUM(f.work_cost * m.joined_rows) + SUM(m.parts_cost) as total_income
+    FROM m
+    JOIN faults f ON m.fault_id = f.fault_id
+    GROUP BY TO_CHAR(m.month, 'YYYY-MM')
+    ORDER BY month
+"""
+
+
+REPORT_FORMATS = ("csv", "jsonl", "parquet")
+REPORT_BATCH_SIZE = 10000  # строк за одно чтение серверного курсора
+
+
+class ReportError(Exception):
+    """Неизвестный отчет или формат вывода"""
+
+
+@dataclass(frozen=True)
+class Report:
+    """Отчет: исходный запрос и запрос по агрегатам (если есть)"""
+    name: str              # имя для командной строки и файлов
+    title: str
+    query: str
+    rollup_query: str = None
+    dated: bool = True     # отчет за период (параметры start/end)
+    tables: tuple = ()     # исходные таблицы (для сброса кэша результатов)
+
+
+REPORTS = (
+    # Отчет перечисляет машины - агрегаты без машины его не сокращают, он
+    # строится по исходным таблицам с индексом по admission_date
+    Report("repairs", "Ремонты по датам", REPAIRS_BY_DATE_SQL,
+           tables=("car_repair", "cars", "faults", "spare_parts")),
+    Report("teams", "Бригады и персонал", TEAMS_SQL, dated=False,
+           tables=("teams", "personnel", "workshops")),
+    Report("financial", "Финансовый отчет", FINANCE_SQL, FINANCE_ROLLUP_SQL,
+           tables=("car_repair", "faults", "spare_parts")),
+)
+
+
+def find_report(name):
+    """Отчет по имени"""
+    for report in REPORTS:
+        if report.name == name:
+            return report
+    raise ReportError(f"Неизвестный отчет: {name} "
+                      f"(есть: {', '.join(report.name for report in REPORTS)})")
+
+
+def report_params(start, end):
+    """Параметры отчета за период [start, end] (даты datetime.date)"""
+    # Первый полный месяц периода и первое число месяца после последнего полного
+    full_from = start if start.day == 1 else _next_month(start)
+    full_to = _next_month(end) if _next_month(end) - timedelta(days=1) == end else end.replace(day=1)
+    return {"start": start, "end": end, "full_from": full_from, "full_to": full_to}
+
+
+def report_query(report, use_rollups):
+    """Текст запроса отчета: по агрегатам, если они есть и доступны"""
+    if use_rollups and report.rollup_query is not None:
+        return report.rollup_query
+    return report.query
+
+
+def rollups_installed(conn):
+    """Созданы ли в БД таблицы агрегатов отчетов (миграция 0006_report_rollups)"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('report_repairs_daily') IS NOT NULL"
+                   " AND to_regclass('report_repairs_monthly') IS NOT NULL")
+    return cursor.fetchone()[0]
+
+
+def rebuild_rollups(conn):
+    """Полный пересчет агрегатов отчетов"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT report_rollup_rebuild()")
+    conn.commit()
+
+
+def verify_report(conn, report, params):
+    """Сверка отчета по агрегатам с исходным запросом.
+
+    Возвращает (число строк, недостающие строки, лишние строки): строки
+    сравниваются как мультимножества, порядок не учитывается.
+    """
+    cursor = conn.cursor()
+    cursor.execute(report.query, params)
+    raw = Counter(cursor.fetchall())
+    cursor.execute(report.rollup_query, params)
+    rolled = Counter(cursor.fetchall())
+    conn.rollback()
+    return sum(raw.values()), list((raw - rolled).elements()), list((rolled - raw).elements())
+
+
+def stream_report(conn, report, params, f, fmt="csv", use_rollups=False,
+                  batch_size=REPORT_BATCH_SIZE, progress=None):
+    """Выгрузка результата отчета в файл f (двоичный) в формате fmt.
+
+    Строки читаются серверным курсором порциями по batch_size и сразу
+    записываются, поэтому память не зависит от размера отчета.
+    progress(строк записано) вызывается после каждой порции. Возвращает
+    число строк.
+    """
+    if fmt not in REPORT_FORMATS:
+        raise ReportError(f"Неизвестный формат: {fmt} (есть: {', '.join(REPORT_FORMATS)})")
+    if fmt == "parquet":
+        _load_pyarrow()
+
+    cursor = conn.cursor(name=f"report_{report.name}")
+    cursor.itersize = batch_size
+    writer = None
+    try:
+        cursor.execute(report_query(report, use_rollups), params)
+        count = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if writer is None:
+                # У серверного курсора описание столбцов есть после первого чтения
+                writer = _WRITERS[fmt](f, cursor.description)
+            if not rows:
+                break
+            writer.write(rows)
+            count += len(rows)
+            if progress is not None:
+                progress(count)
+        return count
+    finally:
+        if writer is not None:
+            writer.close()
+        conn.rollback()
+
+
+class _TextWriter:
+    """Текстовый вывод поверх двоичного файла (файл после записи не закрывается)"""
+
+    def __init__(self, f):
+        self.text = io.TextIOWrapper(f, encoding="utf-8", newline="")
+
+    def close(self):
+        self.text.flush()
+        self.text.detach()
+
+
+class _CsvWriter(_TextWriter):
+    """CSV с заголовком"""
+
+    def __init__(self, f, description):
+        super().__init__(f)
+        self.csv = csv.writer(self.text)
+        self.csv.writerow([column.name for column in description])
+
+    def write(self, rows):
+        self.csv.writerows(rows)
+
+
+class _JsonLinesWriter(_TextWriter):
+    """Строка JSON на строку отчета; NUMERIC и даты записываются строками без потери точности"""
+
+    def __init__(self, f, description):
+        super().__init__(f)
+        self.names = [column.name for column in description]
+
+    def write(self, rows):
+        for row in rows:
+            self.text.write(json.dumps(dict(zip(self.names, row)), ensure_ascii=False,
+                                       default=str) + "\n")
+
+
+class _ParquetWriter:
+    """Parquet: группа строк на каждую порцию курсора"""
+
+    def __init__(self, f, description):
+        self.types = [_arrow_type(column) for column in description]
+        self.schema = pyarrow.schema([(column.name, arrow_type)
+                                      for column, arrow_type in zip(description, self.types)])
+        self.writer = pyarrow.parquet.ParquetWriter(f, self.schema)
+
+    def write(self, rows):
+        arrays = []
+        for index, arrow_type in enumerate(self.types):
+            values = [row[index] for row in rows]
+            if arrow_type == pyarrow.string():
+                values = [None if value is None else str(value) for value in values]
+            arrays.append(pyarrow.array(values, type=arrow_type))
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+_WRITERS = {"csv": _CsvWriter, "jsonl": _JsonLinesWriter, "parquet": _ParquetWriter}
+
+
+def _load_pyarrow():
+    global pyarrow
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ReportError("Для вывода в Parquet установите пакет pyarrow") from None
+
+
+def _arrow_type(column):
+    """Тип Parquet для столбца результата (по OID типа PostgreSQL)"""
+    types = {
+        16: pyarrow.bool_(),
+        20: pyarrow.int64(),
+        21: pyarrow.int16(),
+        23: pyarrow.int32(),
+        700: pyarrow.float32(),
+        701: pyarrow.float64(),
+        1082: pyarrow.date32(),
+        1114: pyarrow.timestamp("us"),
+        1184: pyarrow.timestamp("us", tz="UTC"),
+    }
+    if column.type_code == 1700:
+        # У NUMERIC без модификатора (например, результата SUM) масштаб не известен
+        declared = column.precision is not None and column.precision <= 38
+        return pyarrow.decimal128(38, column.scale if declared else 6)
+    return types.get(column.type_code, pyarrow.string())
+
+
+def _next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
@@ -0,0 +1,286 @@
+import json
+import threading
+from dataclasses import dataclass, field
+
+
+# Таблицы приложения (Таблицы.sql)
+TABLES = ("cars", "workshops", "teams", "personnel", "faults", "car_repair", "spare_parts")
+
+
+@dataclass(frozen=True)
+class Column:
+    """Столбец таблицы"""
+    name: str
+    type: str              # тип в виде format_type: integer, numeric(10,2), ...
+    nullable: bool
+    default: str = None    # выражение значения по умолчанию
+    serial: bool = False   # заполняется последовательностью (serial/identity)
+
+    @property
+    def required(self):
+        """Значение обязательно указывать при добавлении"""
+        return not self.nullable and self.default is None and not self.serial
+
+
+@dataclass(frozen=True)
+class ForeignKey:
+    """Внешний ключ"""
+    name: str
+    columns: tuple
+    ref_table: str
+    ref_columns: tuple
+    on_delete: str         # a - no action, r - restrict, c - cascade, n - set null, d - set default
+
+
+@dataclass(frozen=True)
+class TableInfo:
+    """Структура таблицы"""
+    name: str
+    columns: tuple
+    primary_key: tuple
+    foreign_keys: tuple = field(default_factory=tuple)
+    unique_keys: tuple = field(default_factory=tuple)  # первичный ключ и уникальные индексы
+    partition_key: tuple = field(default_factory=tuple)  # столбцы ключа секционирования
+
+    def column(self, name):
+        """Столбец по имени (None, если такого нет)"""
+        for column in self.columns:
+            if column.name == name:
+                return column
+        return None
+
+    def column_names(self):
+        return [column.name for column in self.columns]
+
+    def editable(self, column_name):
+        """Можно ли менять значение столбца существующей строки.
+
+        Столбцы первичного ключа не меняются, кроме ключа секционирования:
+        при его изменении строка переносится в другую секцию.
+        """
+        return column_name not in self.primary_key or column_name in self.partition_key
+
+    def foreign_key(self, column_name):
+        """Внешний ключ, в который входит столбец (None, если такого нет)"""
+        for fk in self.foreign_keys:
+            if column_name in fk.columns:
+                return fk
+        return None
+
+
+# Отпечаток записей каталога о таблицах: меняется при любом DDL над ними
+# (столбцы, значения по умолчанию, ограничения, пересоздание таблицы)
+_FINGERPRINT_SQL = """
+    SELECT md5(string_agg(item, ',' ORDER BY item))
+    FROM (
+        SELECT c.oid::text || ':' || c.xmin::text AS item
+        FROM pg_class c
+        WHERE c.oid IN (SELECT unnest(oids) FROM t)
+        UNION ALL
+        SELECT a.attrelid::text || '.' || a.attnum || ':' || a.xmin::text
+        FROM pg_attribute a
+        WHERE a.attrelid IN (SELECT unnest(oids) FROM t) AND a.attnum > 0
+        UNION ALL
+        SELECT d.oid::text || ':' || d.xmin::text
+        FROM pg_attrdef d
+        WHERE d.adrelid IN (SELECT unnest(oids) FROM t)
+        UNION ALL
+        SELECT con.oid::text || ':' || con.xmin::text
+        FROM pg_constraint con
+        WHERE con.conrelid IN (SELECT unnest(oids) FROM t)
+    ) items
+"""
+
+_TABLE_OIDS_SQL = """
+    SELECT array_agg(c.oid) AS oids
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = current_schema()
+      AND c.relname = ANY(%(tables)s)
+      AND c.relkind IN ('r', 'p')
+"""
+
+_SCHEMA_SQL = f"""
+    WITH t AS ({_TABLE_OIDS_SQL})
+    SELECT
+        c.relname,
+        (
+            SELECT json_agg(json_build_object(
+                'name', a.attname,
+                'type', format_type(a.atttypid, a.atttypmod),
+                'nullable', NOT a.attnotnull,
+                'default', pg_get_expr(d.adbin, d.adrelid),
+                'identity', a.attidentity <> ''
+            ) ORDER BY a.attnum)
+            FROM pg_attribute a
+            LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+            WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        ) AS columns,
+        (
+            SELECT json_agg(a.attname ORDER BY k.ord)
+            FROM pg_index i
+            CROSS JOIN unnest(i.indkey::int2[]) WITH ORDINALITY k(attnum, ord)
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+            WHERE i.indrelid = c.oid AND i.indisprimary
+        ) AS primary_key,
+        (
+            SELECT json_agg(json_build_object(
+                'name', con.conname,
+                'columns', (
+                    SELECT json_agg(a.attname ORDER BY k.ord)
+                    FROM unnest(con.conkey) WITH ORDINALITY k(attnum, ord)
+                    JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+                ),
+                'ref_table', rc.relname,
+                'ref_columns', (
+                    SELECT json_agg(a.attname ORDER BY k.ord)
+                    FROM unnest(con.confkey) WITH ORDINALITY k(attnum, ord)
+                    JOIN pg_attribute a ON a.attrelid = con.confrelid AND a.attnum = k.attnum
+                ),
+                'on_delete', con.confdeltype
+            ) ORDER BY con.conname)
+            FROM pg_constraint con
+            JOIN pg_class rc ON rc.oid = con.confrelid
+            WHERE con.conrelid = c.oid AND con.contype = 'f'
+        ) AS foreign_keys,
+        (
+            SELECT json_agg((
+                SELECT json_agg(a.attname ORDER BY k.ord)
+                FROM unnest(i.indkey::int2[]) WITH ORDINALITY k(attnum, ord)
+                JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+            ) ORDER BY NOT i.indisprimary, i.indexrelid)
+            FROM pg_index i
+            WHERE i.indrelid = c.oid AND i.indisunique
+              AND i.indexprs IS NULL AND i.indpred IS NULL
+        ) AS unique_keys,
+        (
+            SELECT json_agg(a.attname ORDER BY k.ord)
+            FROM pg_partitioned_table pt
+            CROSS JOIN unnest(pt.partattrs::int2[]) WITH ORDINALITY k(attnum, ord)
+            JOIN pg_attribute a ON a.attrelid = pt.partrelid AND a.attnum = k.attnum
+            WHERE pt.partrelid = c.oid
+        ) AS partition_key,
+        ({_FINGERPRINT_SQL}) AS fingerprint
+    FROM t
+    JOIN pg_class c ON c.oid = ANY(t.oids)
+"""
+
+
+class SchemaCache:
+    """Кэш структуры таблиц приложения.
+
+    Столбцы, типы, обязательность, значения по умолчанию, первичные и
+    внешние ключи всех таблиц загружаются одним запросом к pg_catalog.
+    Вместе со структурой запоминается отпечаток записей каталога;
+    check() сравнивает его с текущим и перезагружает кэш после DDL.
+    """
+
+    def __init__(self, tables=TABLES):
+        self.tables = tuple(tables)
+        self._lock = threading.Lock()
+        self._tables = {}
+        self._fingerprint = None
+
+    def load(self, conn):
+        """Загрузка структуры всех таблиц"""
+        cursor = conn.cursor()
+        cursor.execute(_SCHEMA_SQL, {"tables": list(self.tables)})
+        tables = {}
+        fingerprint = None
+        for (name, columns, primary_key, foreign_keys, unique_keys, partition_key,
+             fingerprint) in cursor.fetchall():
+            tables[name] = _table_info(name, columns, primary_key, foreign_keys, unique_keys,
+                                       partition_key)
+
+        with self._lock:
+            self._tables = tables
+            self._fingerprint = fingerprint
+
+    def check(self, conn):
+        """Перезагрузка кэша, если он пуст или структура таблиц изменилась.
+
+        Возвращает True, если кэш был перезагружен.
+        """
+        if self._fingerprint is not None:
+            cursor = conn.cursor()
+            cursor.execute(f"WITH t AS ({_TABLE_OIDS_SQL}) {_FINGERPRINT_SQL}",
+                           {"tables": list(self.tables)})
+            if cursor.fetchone()[0] == self._fingerprint:
+                return False
+        self.load(conn)
+        return True
+
+    def restore(self, tables):
+        """Структура, известная без связи с БД (например, из локальной копии).
+
+        Отпечаток не запоминается: при первом check() с соединением
+        структура загрузится из БД.
+        """
+        with self._lock:
+            self._tables = {table.name: table for table in tables}
+            self._fingerprint = None
+
+    def invalidate(self):
+        """Сброс кэша - при следующем check() структура загрузится заново"""
+        with self._lock:
+            self._tables = {}
+            self._fingerprint = None
+
+    def table(self, name):
+        """Структура таблицы (KeyError, если таблица неизвестна)"""
+        with self._lock:
+            return self._tables[name]
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._tables
+
+    def dependent_tables(self, name):
+        """Таблица и все таблицы, ссылающиеся на нее (в т.ч. через другие).
+
+        Удаление строк таблицы может изменить их по внешним ключам
+        (каскадное удаление, обнуление ссылки).
+        """
+        with self._lock:
+            tables = list(self._tables.values())
+        result = {name}
+        changed = True
+        while changed:
+            changed = False
+            for table in tables:
+                if table.name not in result and any(fk.ref_table in result
+                                                    for fk in table.foreign_keys):
+                    result.add(table.name)
+                    changed = True
+        return result
+
+
+def _table_info(name, columns, primary_key, foreign_keys, unique_keys, partition_key=None):
+    if isinstance(columns, str):
+        columns = json.loads(columns)
+    return TableInfo(
+        name=name,
+        columns=tuple(
+            Column(
+                name=col["name"],
+                type=col["type"],
+                nullable=col["nullable"],
+                default=col["default"],
+                serial=col["identity"] or (col["default"] or "").startswith("nextval("),
+            )
+            for col in columns or ()
+        ),
+        primary_key=tuple(primary_key or ()),
+        foreign_keys=tuple(
+            ForeignKey(
+                name=fk["name"],
+                columns=tuple(fk["columns"]),
+                ref_table=fk["ref_table"],
+                ref_columns=tuple(fk["ref_columns"]),
+                on_delete=fk["on_delete"],
+            )
+            for fk in foreign_keys or ()
+        ),
+        unique_keys=tuple(tuple(key) for key in unique_keys or ()),
+        partition_key=tuple(partition_key or ()),
+    )
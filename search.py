@@ -0,0 +1,148 @@
+import hashlib
+import re
+
+import psycopg2
+import psycopg2.errors
+from psycopg2 import sql
+
+from sorting import create_index_concurrently, index_name
+
+
+# Режимы поиска:
+#   trgm  - подстрока (ILIKE) по GIN-индексу pg_trgm;
+#   tsv   - слова по префиксу через tsvector, если pg_trgm недоступен;
+#   ilike - подстрока без индекса, пока индексы не подготовлены.
+TRGM, TSV, ILIKE = "trgm", "tsv", "ilike"
+
+# Типы, приведение которых к text неизменяемо (IMMUTABLE) и потому
+# допустимо в выражении индекса. Даты выводятся в зависимости от
+# DateStyle и в поисковый документ не входят - для них есть фильтр по полю
+_INDEXABLE_TYPES = ("smallint", "integer", "bigint", "numeric", "real", "double precision",
+                    "character", "text", "boolean")
+
+_TS_CONFIG = "simple"
+
+
+def search_columns(table):
+    """Столбцы таблицы, участвующие в поиске по всем полям"""
+    return [column.name for column in table.columns
+            if column.type.startswith(_INDEXABLE_TYPES)]
+
+
+def search_document(table):
+    """Поисковый документ строки: значения столбцов через пробел.
+
+    Выражение в запросе должно совпадать с выражением индекса, поэтому
+    оба строятся этой функцией.
+    """
+    parts = [sql.SQL("coalesce({}::text, '')").format(sql.Identifier(col))
+             for col in search_columns(table)]
+    return sql.SQL("(") + sql.SQL(" || ' ' || ").join(parts) + sql.SQL(")")
+
+
+def search_condition(table, text, mode=ILIKE):
+    """Условие поиска текста по всем полям: пара (sql.Composable, параметры).
+
+    None, если искать нечего.
+    """
+    text = text.strip()
+    if not text or not search_columns(table):
+        return None
+
+    document = search_document(table)
+    if mode == TSV:
+        words = re.findall(r"\w+", text.lower())
+        if not words:
+            return None
+        # Каждое слово - префикс: 'b1':* & 'ива':*
+        query = " & ".join("'{}':*".format(word.replace("'", "''")) for word in words)
+        condition = sql.SQL("to_tsvector({}, {}) @@ to_tsquery({}, %s)").format(
+            sql.Literal(_TS_CONFIG), document, sql.Literal(_TS_CONFIG))
+        return condition, [query]
+
+    pattern = "%" + re.sub(r"([\\%_])", r"\\\1", text) + "%"
+    return sql.SQL("{} ILIKE %s").format(document), [pattern]
+
+
+def prepare_search(conn, schema):
+    """Подготовка индексов поиска для всех таблиц; возвращает режим поиска.
+
+    Используется pg_trgm (расширение создается, если его еще нет и на это
+    хватает прав), иначе - tsvector. Индекс называется по хэшу выражения
+    документа: после изменения столбцов создается новый индекс, а прежние
+    индексы поиска таблицы удаляются. Индексы строятся с CONCURRENTLY
+    (sorting.create_index_concurrently) - таблицы при этом доступны для
+    записи.
+    """
+    mode = TRGM if _enable_trgm(conn) else TSV
+    schema.check(conn)
+    cursor = conn.cursor()
+
+    for table_name in schema.tables:
+        if table_name not in schema:
+            continue
+        table = schema.table(table_name)
+        if not search_columns(table):
+            continue
+
+        document = search_document(table)
+        if mode == TRGM:
+            expression = sql.SQL("{} gin_trgm_ops").format(document)
+        else:
+            expression = sql.SQL("(to_tsvector({}, {}))").format(sql.Literal(_TS_CONFIG), document)
+        digest = hashlib.md5(expression.as_string(conn).encode()).hexdigest()[:8]
+        suffix = f"search_{mode}_{digest}"
+        name = index_name(table_name, suffix)
+
+        cursor.execute("""
+            SELECT i.relname, x.indisvalid
+            FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            JOIN pg_class t ON t.oid = x.indrelid
+            WHERE t.relname = %s AND t.relnamespace = current_schema()::regnamespace
+              AND i.relname LIKE %s
+        """, (table_name, f"{table_name}\\_search\\_%"))
+        existing = dict(cursor.fetchall())
+        conn.rollback()
+
+        if not existing.get(name):
+            if name in existing and not table.partition_key:
+                # Недостроенный индекс: IF NOT EXISTS его бы пропустил
+                try:
+                    cursor.execute("SET LOCAL lock_timeout = '2s'")
+                    cursor.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(name)))
+                    conn.commit()
+                except psycopg2.errors.LockNotAvailable:
+                    conn.rollback()
+                    continue
+            # Индекс секционированной таблицы достраивается на оставшихся секциях
+            create_index_concurrently(conn, table_name, suffix,
+                                      sql.SQL("USING gin ({})").format(expression))
+
+        for old_name in existing:
+            if old_name == name:
+                continue
+            # Таблицу могут читать открытые курсоры - не ждем их, а удалим
+            # устаревший индекс при следующем запуске
+            try:
+                cursor.execute("SET LOCAL lock_timeout = '2s'")
+                cursor.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(old_name)))
+                conn.commit()
+            except psycopg2.errors.LockNotAvailable:
+                conn.rollback()
+
+    return mode
+
+
+def _enable_trgm(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    if cursor.fetchone():
+        return True
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        conn.commit()
+        return True
+    except psycopg2.Error:
+        conn.rollback()
+        return False
@@ -0,0 +1,193 @@
+import hashlib
+
+import psycopg2
+from psycopg2 import sql
+
+
+# В таблицах меньше этого числа строк сортировка без индекса быстрая -
+# создавать индекс не предлагается
+SORT_INDEX_MIN_ROWS = 10000
+
+# PostgreSQL обрезает имена длиннее этого - имя таблицы в имени индекса
+# укорачивается (index_name)
+_MAX_NAME_LENGTH = 63
+
+# Флаги столбца индекса в pg_index.indoption
+_INDOPTION_DESC, _INDOPTION_NULLS_FIRST = 1, 2
+
+
+class SortError(Exception):
+    """Неверный порядок сортировки (нет такого поля)"""
+
+
+def sort_order(table, order):
+    """Порядок строк для запроса: поля order (пары (поле, по убыванию)),
+    проверенные по структуре таблицы (TableInfo), и за ними первичный ключ.
+
+    Ключ делает порядок однозначным: иначе строки с равными значениями
+    при постраничном просмотре могли бы повториться или пропасть. Ключ
+    идет в направлении последнего поля, чтобы индекс по полям и ключу
+    читался целиком в прямом или обратном порядке.
+    """
+    result = []
+    names = set()
+    for name, descending in order:
+        if table.column(name) is None:
+            raise SortError(f"В таблице {table.name} нет поля {name}")
+        if name not in names:
+            names.add(name)
+            result.append((name, bool(descending)))
+    tail = result[-1][1] if result else False
+    return result + [(col, tail) for col in table.primary_key if col not in names]
+
+
+def order_label(order):
+    """Порядок сортировки для показа: "owner ↑, year ↓" """
+    return ", ".join(f"{name} {'↓' if descending else '↑'}" for name, descending in order)
+
+
+def supporting_index(conn, table_name, order):
+    """Индекс, по которому строки читаются в порядке order без сортировки.
+
+    Первые столбцы индекса должны совпадать с полями order, а направления -
+    все совпадать или все быть противоположными (индекс читается в
+    обратном порядке). Возвращает пару (имя индекса или None, оценка
+    числа строк таблицы по статистике).
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT c.oid,
+               (SELECT coalesce(sum(greatest(p.reltuples, 0)), 0)
+                FROM pg_class p
+                WHERE (p.oid = c.oid
+                       OR p.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = c.oid))
+                  AND p.relkind <> 'p')
+        FROM pg_class c
+        WHERE c.relname = %s AND c.relnamespace = current_schema()::regnamespace
+    """, (table_name,))
+    found = cursor.fetchone()
+    if found is None:
+        conn.rollback()
+        return None, 0
+    oid, rows = found
+
+    cursor.execute("""
+        SELECT i.indexrelid::regclass::text,
+               array(SELECT a.attname
+                     FROM unnest(i.indkey::int2[]) WITH ORDINALITY k(attnum, ord)
+                     LEFT JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                     ORDER BY k.ord),
+               i.indoption::int2[]
+        FROM pg_index i
+        WHERE i.indrelid = %s AND i.indpred IS NULL AND i.indisvalid
+        ORDER BY 1
+    """, (oid,))
+    indexes = cursor.fetchall()
+    conn.rollback()
+
+    for name, columns, options in indexes:
+        if _index_matches(columns, options, order):
+            return name, int(rows)
+    return None, int(rows)
+
+
+def _index_matches(columns, options, order):
+    if len(columns) < len(order):
+        return False
+    scans = {True, False}  # прямой и обратный просмотр индекса
+    for (name, descending), column, option in zip(order, columns, options):
+        if column != name:
+            return False
+        index_desc = bool(option & _INDOPTION_DESC)
+        nulls_first = bool(option & _INDOPTION_NULLS_FIRST)
+        # В ORDER BY NULL идет первым только по убыванию
+        if (index_desc, nulls_first) != (descending, descending):
+            scans.discard(True)
+        if (not index_desc, not nulls_first) != (descending, descending):
+            scans.discard(False)
+    return bool(scans)
+
+
+def create_sort_index(conn, table_name, order):
+    """Создание индекса для сортировки в порядке order (см. sort_order).
+
+    Индекс строится с CONCURRENTLY (см. create_index_concurrently).
+    Возвращает имя индекса.
+    """
+    columns = sql.SQL(", ").join(
+        sql.Identifier(col) + sql.SQL(" DESC" if descending else "") for col, descending in order)
+    digest = hashlib.md5(columns.as_string(conn).encode()).hexdigest()[:8]
+    return create_index_concurrently(conn, table_name, f"sort_{digest}",
+                                     sql.SQL("({})").format(columns))
+
+
+def index_name(table_name, suffix):
+    """Имя индекса таблицы: имя таблицы (укороченное при необходимости) и suffix"""
+    return f"{table_name[:_MAX_NAME_LENGTH - len(suffix) - 1]}_{suffix}"
+
+
+def create_index_concurrently(conn, table_name, suffix, definition):
+    """Создание индекса с CONCURRENTLY, чтобы чтение и запись таблицы не
+    останавливались.
+
+    definition - часть CREATE INDEX после имени таблицы: список столбцов
+    в скобках или USING gin (...); имя индекса - index_name(таблица,
+    suffix). Секционированной таблице так сразу индекс не создать: он
+    создается на самой таблице (ON ONLY), на каждой секции - с
+    CONCURRENTLY, и индексы секций присоединяются к нему. Повторный
+    вызов достраивает индекс, прерванный на части секций. Возвращает имя
+    индекса. Секции, созданные после индекса таблицы, получают свой индекс
+    при присоединении - они пропускаются.
+    """
+    name = index_name(table_name, suffix)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT c.relkind = 'p',
+               array(SELECT p.relname FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhrelid
+                     WHERE i.inhparent = c.oid ORDER BY 1)
+        FROM pg_class c
+        WHERE c.relname = %s AND c.relnamespace = current_schema()::regnamespace
+    """, (table_name,))
+    partitioned, partitions = cursor.fetchone()
+    conn.rollback()
+
+    # CREATE INDEX CONCURRENTLY нельзя выполнять в транзакции
+    conn.autocommit = True
+    try:
+        if not partitioned:
+            _create_concurrently(cursor, name, table_name, definition)
+            return name
+        cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON ONLY {} {}").format(
+            sql.Identifier(name), sql.Identifier(table_name), definition))
+        cursor.execute("""
+            SELECT t.relname
+            FROM pg_inherits i
+            JOIN pg_index x ON x.indexrelid = i.inhrelid
+            JOIN pg_class t ON t.oid = x.indrelid
+            WHERE i.inhparent = to_regclass(quote_ident(%s))
+        """, (name,))
+        indexed = {row[0] for row in cursor.fetchall()}
+        for partition in partitions:
+            if partition in indexed:
+                continue
+            partition_index = index_name(partition, suffix)
+            _create_concurrently(cursor, partition_index, partition, definition)
+            cursor.execute(sql.SQL("ALTER INDEX {} ATTACH PARTITION {}").format(
+                sql.Identifier(name), sql.Identifier(partition_index)))
+        return name
+    finally:
+        conn.autocommit = False
+
+
+def _create_concurrently(cursor, name, table_name, definition):
+    try:
+        cursor.execute(sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} {}").format(
+            sql.Identifier(name), sql.Identifier(table_name), definition))
+    except psycopg2.Error:
+        # Прерванное построение оставляет недействительный индекс - удаляем
+        # его, иначе IF NOT EXISTS пропустил бы его при следующей попытке
+        try:
+            cursor.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(name)))
+        except psycopg2.Error:
+            pass
+        raise
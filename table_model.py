@@ -0,0 +1,869 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from itertools import count
+
+import psycopg2
+from psycopg2.extensions import QueryCanceledError
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+
+from columnar import ColumnarBuilder, ColumnType
+from instrument import caller_origin
+
+
+class QueryTableModel(QAbstractTableModel):
+    """Модель таблицы, подгружающая строки порциями через серверный курсор.
+
+    Строки читаются порциями по chunk_size через именованный (серверный)
+    курсор psycopg2. В памяти хранится не больше max_chunks порций:
+    давно не использованные вытесняются и при необходимости читаются
+    повторно через scroll курсора.
+
+    Чтение выполняется в фоне через QueryRunner. Под курсор модель
+    берет из пула отдельное соединение и держит его до close(); если
+    соединение разорвано, оно заменяется, а курсор открывается заново.
+
+    Курсор открывается WITH HOLD, и транзакция фиксируется сразу после
+    первой порции (результат при этом сохраняется на сервере), а каждое
+    следующее чтение - своей короткой транзакцией. Открытая таблица не
+    держит соединение "idle in transaction" и не мешает VACUUM, CREATE
+    INDEX CONCURRENTLY и изменению секций.
+    По готовности первой
+    порции испускается loaded, после каждой порции - progress с числом
+    загруженных строк, при ошибке - failed.
+
+    Порции хранятся по столбцам (columnar.ColumnarChunk): числа и даты -
+    в типизированных массивах, повторяющиеся строки - кодами словаря;
+    текст ячейки получается при показе.
+
+    Изменения, сделанные после открытия курсора, накладываются поверх
+    его результата методом apply_changes (строки находятся по значениям
+    key_columns): измененные строки заменяются, удаленные скрываются,
+    новые показываются в начале таблицы. Курсор при этом не
+    перечитывается.
+
+    Если результат прочитан целиком и все порции в памяти
+    (fully_loaded), его можно сортировать (sort_loaded), отбирать
+    (filter_loaded) и подводить итоги (group_loaded) без повторного
+    запроса.
+    """
+
+    loaded = pyqtSignal()
+    progress = pyqtSignal(int)
+    failed = pyqtSignal(object)
+
+    _cursor_ids = count(1)
+
+    # Порции в столбцовом виде компактны: 500 порций по 500 строк таблицы
+    # spare_parts занимают около 10 МБ
+    def __init__(self, runner, chunk_size=500, max_chunks=500, parent=None):
+        super().__init__(parent)
+        self.runner = runner
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+
+        self._query = None
+        self._params = None
+        self._conn = None
+        self._cursor = None
+        self._lock = threading.RLock()  # курсор используется из разных потоков
+        self._generation = 0  # номер запроса, чтобы отбросить устаревшие ответы
+        self._headers = []
+        self._builder = None  # перевод порций текущего запроса в ColumnarChunk
+        self._chunks = OrderedDict()  # номер порции -> ColumnarChunk
+        self._pending = set()  # порции, чтение которых уже запрошено
+        self._row_count = 0
+        self._exhausted = True
+        self._fetching = False
+        self._open_task = None  # задача выполнения текущего запроса
+        self._origin = None  # метод, открывший запрос (для журнала запросов)
+        self._key_idx = None  # номера столбцов ключа в результате
+        self._patched = {}  # ключ -> новая строка или None (удалена)
+        self._removed = []  # отсортированные позиции курсора скрытых строк
+        self._inserted = []  # новые строки, показываемые в начале
+        self._overrides = {}  # позиция курсора -> измененная строка
+        self._view = None  # позиции курсора в порядке показа после sort_loaded/filter_loaded
+        self._local_sort = None  # список (столбец, по убыванию)
+        self._local_filter = None  # (список (столбец, условие), любое из условий)
+        self._cache_entry = None  # (кэш, ключ, таблицы, отметка) для сохранения результата
+        self._local_chunks = None  # все порции результата, полученного без запроса (set_rows)
+
+    # --- Загрузка данных ---
+
+    def set_query(self, query, params=None, fetch_all=False, description="Загрузка данных",
+                  dialog_parent=None, key_columns=None, cache=None, cache_tables=()):
+        """Выполнение нового запроса в фоне.
+
+        fetch_all - прочитать результат целиком (для ограниченных по
+        размеру выборок, например страниц); dialog_parent - окно, над
+        которым показывается прогресс с кнопкой отмены; key_columns -
+        столбцы первичного ключа для apply_changes. Еще выполняющийся
+        предыдущий запрос отменяется.
+
+        Если указан cache (QueryCache), результат берется из него, а
+        прочитанный до конца результат сохраняется в него с зависимостью
+        от таблиц cache_tables.
+        """
+        if self._open_task is not None:
+            self._open_task.cancel()
+        self._cache_entry = None
+        if cache is not None:
+            key = cache.key(query, params)
+            cached = cache.get(key)
+            if cached is not None and cached[1] == self.chunk_size:
+                headers, chunk_size, chunks = cached
+                self.close()
+                # Порции в кэше не изменяются - изменения строк хранятся в модели
+                chunks = list(chunks)
+                if not chunks or len(chunks[-1]) == self.chunk_size:
+                    chunks.append([])
+                self._on_opened(self._generation, (headers, chunks), key_columns)
+                return
+            self._cache_entry = (cache, key, cache_tables, cache.stamp())
+        self._generation += 1
+        generation = self._generation
+        self._fetching = True
+        self._pending.clear()
+        # Метод окна, открывший запрос, - для журнала запросов
+        self._origin = caller_origin()
+
+        def open_query(conn):
+            with self._lock:
+                # Завершаем транзакцию прежнего курсора
+                self._close_cursor()
+                conn.rollback()
+                self._query = query
+                self._params = params
+                self._builder = None
+                self._local_chunks = None
+                # Первая порция показывается, не дожидаясь сохранения
+                # всего результата (_hold)
+                rows = self._fetch_chunk(0, hold=False)
+                chunks = [rows]
+                while fetch_all and len(chunks[-1]) == self.chunk_size:
+                    chunks.append(self._fetch_chunk(len(chunks), hold=False))
+                headers = [desc[0] for desc in self._cursor.description]
+            return headers, chunks
+
+        def on_opened(result):
+            self._on_opened(generation, result, key_columns)
+            if generation == self._generation:
+                self.runner.submit(lambda conn: self._hold(),
+                                   conn=self._connection,
+                                   on_error=lambda error: self._on_error(generation, error),
+                                   description="Загрузка строк",
+                                   origin=self._origin)
+
+        self._open_task = self.runner.submit(
+            open_query,
+            conn=self._query_connection,
+            on_result=on_opened,
+            on_error=lambda error: self._on_error(generation, error),
+            description=description,
+            dialog_parent=dialog_parent,
+            origin=self._origin)
+
+    def set_rows(self, load, description="Загрузка данных", key_columns=None):
+        """Показ строк, полученных без запроса к БД (например, из локальной копии).
+
+        load выполняется в фоне и возвращает пару (описание столбцов, как
+        у курсора, строки). Порции строятся сразу все и хранятся в модели,
+        поэтому результат можно сортировать и отбирать как прочитанный
+        целиком.
+        """
+        if self._open_task is not None:
+            self._open_task.cancel()
+        self.close()
+        self._cache_entry = None
+        generation = self._generation
+        self._fetching = True
+        self._pending.clear()
+
+        def open_rows(conn):
+            columns, rows = load()
+            builder = ColumnarBuilder(columns)
+            chunks = [builder.build(rows[i:i + self.chunk_size])
+                      for i in range(0, len(rows), self.chunk_size)]
+            if not chunks or len(chunks[-1]) == self.chunk_size:
+                chunks.append([])
+            return [column.name for column in columns], chunks
+
+        def on_opened(result):
+            if generation == self._generation:
+                self._local_chunks = result[1]
+            self._on_opened(generation, result, key_columns)
+
+        self._open_task = self.runner.submit(
+            open_rows,
+            conn=lambda: None,
+            on_result=on_opened,
+            on_error=lambda error: self._on_error(generation, error),
+            description=description,
+            origin=caller_origin())
+
+    def _on_opened(self, generation, result, key_columns=None):
+        if generation != self._generation:
+            return
+        headers, chunks = result
+
+        self.beginResetModel()
+        self._headers = headers
+        self._chunks.clear()
+        self._reset_changes()
+        if key_columns and all(col in headers for col in key_columns):
+            self._key_idx = [headers.index(col) for col in key_columns]
+        self._row_count = 0
+        self._exhausted = False
+        self._fetching = False
+        for chunk_idx, rows in enumerate(chunks):
+            self._store_chunk(chunk_idx, rows)
+        self._save_to_cache()
+        self.endResetModel()
+        self.loaded.emit()
+        self.progress.emit(self._row_count)
+
+    def _on_error(self, generation, error):
+        if generation != self._generation:
+            return
+        self._fetching = False
+        self._exhausted = True
+        self._pending.clear()
+        self.failed.emit(error)
+        self.progress.emit(self._row_count)
+
+    def clear(self):
+        """Очистка модели и закрытие курсора"""
+        self.beginResetModel()
+        self.close()
+        self._headers = []
+        self._chunks.clear()
+        self._pending.clear()
+        self._reset_changes()
+        self._row_count = 0
+        self._fetching = False
+        self.endResetModel()
+
+    def _reset_changes(self):
+        self._key_idx = None
+        self._patched.clear()
+        self._removed = []
+        self._inserted = []
+        self._overrides.clear()
+        self._view = None
+        self._local_sort = None
+        self._local_filter = None
+
+    def close(self):
+        """Закрытие курсора и возврат соединения в пул; ожидающие ответы отбрасываются"""
+        self._generation += 1
+        with self._lock:
+            self._close_cursor()
+            self._query = None
+            self._params = None
+            self._builder = None
+            self._local_chunks = None
+            if self._conn is not None:
+                self.runner.db.putconn(self._conn)
+                self._conn = None
+        self._exhausted = True
+
+    def _connection(self):
+        """Соединение модели (берется из пула при первом обращении).
+
+        Модель только читает, поэтому соединение берется с реплики, если
+        она есть и не отстает (Database.getconn).
+        """
+        with self._lock:
+            if self._conn is not None and self._conn.closed:
+                self.runner.db.putconn(self._conn, close=True)
+                self._conn = None
+            if self._conn is None:
+                self._conn = self.runner.db.getconn(readonly=True)
+            return self._conn
+
+    def _query_connection(self):
+        """Соединение для нового запроса.
+
+        При настроенных репликах прежнее соединение возвращается в пул:
+        сервер для чтения выбирается заново, чтобы запрос после записи
+        не попал на отстающую реплику, а после ее восстановления чтение
+        вернулось на нее.
+        """
+        with self._lock:
+            if self._conn is not None and self.runner.db.replicas:
+                self._close_cursor()
+                self.runner.db.putconn(self._conn)
+                self._conn = None
+            return self._connection()
+
+    def _open_cursor(self):
+        name = f"browse_{next(self._cursor_ids)}"
+        self._cursor = self._connection().cursor(name=name, scrollable=True, withhold=True)
+        self._cursor.execute(self._query, self._params)
+
+    def _hold(self):
+        """Фиксация транзакции, в которой открыт курсор: сервер сохраняет
+        результат запроса, и соединение больше не держит снимок данных
+        """
+        with self._lock:
+            if self._cursor is not None and not self._cursor.connection.closed:
+                self._cursor.connection.commit()
+
+    def _close_cursor(self):
+        if self._cursor is not None:
+            try:
+                # CLOSE курсора WITH HOLD открывает новую транзакцию
+                self._cursor.close()
+                self._cursor.connection.commit()
+            except psycopg2.Error:
+                pass
+            self._cursor = None
+
+    def _fetch_chunk(self, chunk_idx, hold=True):
+        """Чтение порции строк с указанным номером.
+
+        hold - завершить транзакцию после чтения (см. _hold).
+        """
+        with self._lock:
+            if self._local_chunks is not None:
+                return self._local_chunks[chunk_idx] if chunk_idx < len(self._local_chunks) else []
+            if self._query is None:
+                return []
+            try:
+                return self._read(chunk_idx, hold)
+            except QueryCanceledError:
+                raise
+            except (psycopg2.InterfaceError, psycopg2.OperationalError,
+                    psycopg2.ProgrammingError):
+                # Курсор закрылся вместе с транзакцией или соединение
+                # разорвано - открываем курсор заново
+                self._close_cursor()
+                if self._conn is not None and not self._conn.closed:
+                    self._conn.rollback()
+                return self._read(chunk_idx, hold)
+
+    def _read(self, chunk_idx, hold):
+        if self._cursor is None:
+            self._open_cursor()
+        self._cursor.scroll(chunk_idx * self.chunk_size, mode="absolute")
+        rows = self._cursor.fetchmany(self.chunk_size)
+        if hold:
+            self._cursor.connection.commit()
+        if self._builder is None:
+            self._builder = ColumnarBuilder(self._cursor.description)
+        return self._builder.build(rows)
+
+    def _chunk_keys(self, rows):
+        """Значения ключа строк порции"""
+        return zip(*([rows.value(i, col) for i in range(len(rows))] for col in self._key_idx))
+
+    def _patch_chunk(self, chunk_idx, rows):
+        """Наложение изменений на порцию; возвращает позиции новых удаленных строк"""
+        if not self._patched or self._key_idx is None:
+            return []
+        deleted = []
+        first = chunk_idx * self.chunk_size
+        for i, key in enumerate(self._chunk_keys(rows)):
+            if key in self._patched:
+                if self._patched[key] is None:
+                    if not self._is_removed(first + i):
+                        deleted.append(first + i)
+                else:
+                    self._overrides[first + i] = self._patched[key]
+        return deleted
+
+    def _store_chunk(self, chunk_idx, rows):
+        self._chunks[chunk_idx] = rows
+        self._chunks.move_to_end(chunk_idx)
+        while len(self._chunks) > self.max_chunks:
+            self._chunks.popitem(last=False)
+
+        if chunk_idx * self.chunk_size + len(rows) > self._row_count:
+            self._row_count = chunk_idx * self.chunk_size + len(rows)
+        if len(rows) < self.chunk_size:
+            self._exhausted = True
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return self._query is not None and not self._exhausted and not self._fetching
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+
+        self._fetching = True
+        generation = self._generation
+        chunk_idx = self._row_count // self.chunk_size
+        self.runner.submit(lambda conn: self._fetch_chunk(chunk_idx),
+                           conn=self._connection,
+                           on_result=lambda rows: self._on_more(generation, chunk_idx, rows),
+                           on_error=lambda error: self._on_error(generation, error),
+                           description="Загрузка строк",
+                           origin=self._origin)
+
+    def _on_more(self, generation, chunk_idx, rows):
+        if generation != self._generation:
+            return
+        self._fetching = False
+        if rows:
+            deleted = self._patch_chunk(chunk_idx, rows)
+            first = self.rowCount()
+            visible = len(rows) - len(deleted)
+            if visible:
+                self.beginInsertRows(QModelIndex(), first, first + visible - 1)
+            self._store_chunk(chunk_idx, rows)
+            for pos in deleted:
+                insort(self._removed, pos)
+            if visible:
+                self.endInsertRows()
+        else:
+            self._exhausted = True
+        self._save_to_cache()
+        self.progress.emit(self._row_count)
+
+    def _save_to_cache(self):
+        """Сохранение прочитанного до конца результата в кэш запроса"""
+        if self._cache_entry is None or not self._exhausted:
+            return
+        cache, key, tables, stamp = self._cache_entry
+        self._cache_entry = None
+        chunk_count = self._chunk_count()
+        if self._patched or self._inserted or len(self._chunks) < chunk_count:
+            return  # часть порций вытеснена или изменена
+        chunks = [self._chunks[chunk_idx] for chunk_idx in range(chunk_count)]
+        cache.put(key, (list(self._headers), self.chunk_size, chunks), tables, stamp,
+                  rows=self._row_count)
+
+    def _chunk_count(self):
+        return -(-self._row_count // self.chunk_size)
+
+    def _request_chunk(self, chunk_idx):
+        """Фоновое повторное чтение вытесненной порции"""
+        if chunk_idx in self._pending:
+            return
+        self._pending.add(chunk_idx)
+        generation = self._generation
+
+        def on_result(rows):
+            if generation != self._generation:
+                return
+            self._pending.discard(chunk_idx)
+            if not rows:
+                return
+            deleted = self._patch_chunk(chunk_idx, rows)
+            self._store_chunk(chunk_idx, rows)
+            for pos in deleted:
+                self._hide_position(pos)
+            if self._view is not None:
+                first, last = len(self._inserted), self.rowCount() - 1
+            else:
+                first = self._view_row(chunk_idx * self.chunk_size)
+                last = self._view_row(min((chunk_idx + 1) * self.chunk_size, self._row_count)) - 1
+            if last >= first:
+                self.dataChanged.emit(self.index(first, 0),
+                                      self.index(last, self.columnCount() - 1))
+
+        self.runner.submit(lambda conn: self._fetch_chunk(chunk_idx),
+                           conn=self._connection,
+                           on_result=on_result,
+                           on_error=lambda error: self._on_error(generation, error),
+                           description="Загрузка строк",
+                           origin=self._origin)
+
+    # --- Доступ к строкам ---
+
+    def headers(self):
+        """Имена столбцов результата"""
+        return list(self._headers)
+
+    def row(self, row_idx):
+        """Строка результата по номеру (кортеж значений).
+
+        Если порция строки вытеснена, возвращается None, а порция читается
+        в фоне, как при показе (data); строки, которые нужны обязательно,
+        читаются через load_rows.
+        """
+        if row_idx < len(self._inserted):
+            return self._inserted[row_idx]
+        pos = self._cursor_position(row_idx)
+        chunk_idx, offset = divmod(pos, self.chunk_size)
+        rows = self._chunks.get(chunk_idx)
+        if rows is None:
+            self._request_chunk(chunk_idx)
+            return None
+        self._chunks.move_to_end(chunk_idx)
+        return self._overrides.get(pos) or rows[offset]
+
+    def load_rows(self, row_indices, on_result, on_error=None):
+        """Строки результата по номерам: on_result(список кортежей значений).
+
+        Если все строки в памяти, on_result вызывается сразу; вытесненные
+        порции читаются в фоне, и тогда on_result вызывается по их
+        прочтении (если запрос модели за это время не сменился). Поток
+        интерфейса не ждет курсора, занятого другим чтением.
+        """
+        positions = []
+        missing = set()
+        for row_idx in row_indices:
+            if row_idx < len(self._inserted):
+                positions.append((None, self._inserted[row_idx]))
+                continue
+            pos = self._cursor_position(row_idx)
+            positions.append((pos, None))
+            chunk_idx = pos // self.chunk_size
+            if chunk_idx in self._chunks:
+                self._chunks.move_to_end(chunk_idx)
+            else:
+                missing.add(chunk_idx)
+
+        def rows(fetched):
+            result = []
+            for pos, row in positions:
+                if row is None:
+                    chunk_idx, offset = divmod(pos, self.chunk_size)
+                    chunk = fetched.get(chunk_idx) or self._chunks[chunk_idx]
+                    row = self._overrides.get(pos) or chunk[offset]
+                result.append(row)
+            return result
+
+        if not missing:
+            on_result(rows({}))
+            return
+        if self._local_chunks is not None:
+            on_result(rows({chunk_idx: self._local_chunks[chunk_idx] for chunk_idx in missing}))
+            return
+        generation = self._generation
+
+        def on_fetched(fetched):
+            if generation != self._generation:
+                return
+            for chunk_idx, chunk in fetched.items():
+                deleted = self._patch_chunk(chunk_idx, chunk)
+                self._store_chunk(chunk_idx, chunk)
+                for pos in deleted:
+                    self._hide_position(pos)
+            on_result(rows(fetched))
+
+        self.runner.submit(lambda conn: {chunk_idx: self._fetch_chunk(chunk_idx)
+                                         for chunk_idx in sorted(missing)},
+                           conn=self._connection,
+                           on_result=on_fetched,
+                           on_error=on_error or (lambda error: self._on_error(generation, error)),
+                           description="Загрузка строк",
+                           origin=self._origin)
+
+    def row_key(self, row):
+        """Значение ключа строки результата"""
+        return tuple(row[i] for i in self._key_idx)
+
+    # --- Наложение изменений ---
+
+    def apply_changes(self, rows, removed_keys=(), insert_missing=False):
+        """Наложение изменений строк, сделанных после открытия курсора.
+
+        rows - актуальные строки (заменяют строки с теми же ключами;
+        если insert_missing, строки, которых нет среди загруженных,
+        добавляются в начало); removed_keys - ключи строк, которые нужно
+        скрыть. Строки вытесненных и еще не прочитанных порций
+        изменяются при их чтении.
+        """
+        if self._key_idx is None:
+            return
+        positions = self._loaded_positions()
+        inserted = {self.row_key(row): i for i, row in enumerate(self._inserted)}
+
+        for key in map(tuple, removed_keys):
+            self._patched[key] = None
+            if key in inserted:
+                i = inserted[key]
+                self.beginRemoveRows(QModelIndex(), i, i)
+                del self._inserted[i]
+                self.endRemoveRows()
+                inserted = {self.row_key(row): i for i, row in enumerate(self._inserted)}
+            elif key in positions and not self._is_removed(positions[key]):
+                self._hide_position(positions[key])
+
+        last_column = self.columnCount() - 1
+        for row in rows:
+            row = tuple(row)
+            key = self.row_key(row)
+            self._patched[key] = row
+            if key in inserted:
+                i = inserted[key]
+                self._inserted[i] = row
+                self.dataChanged.emit(self.index(i, 0), self.index(i, last_column))
+            elif key in positions:
+                pos = positions[key]
+                self._overrides[pos] = row
+                if self._is_removed(pos):
+                    continue
+                view_row = self._view_row(pos)
+                if view_row is not None:
+                    self.dataChanged.emit(self.index(view_row, 0),
+                                          self.index(view_row, last_column))
+            elif insert_missing:
+                self.beginInsertRows(QModelIndex(), 0, 0)
+                self._inserted.insert(0, row)
+                self.endInsertRows()
+                inserted = {self.row_key(row): i for i, row in enumerate(self._inserted)}
+
+    def _loaded_positions(self):
+        """Ключ -> позиция курсора для загруженных порций"""
+        positions = {}
+        for chunk_idx, rows in self._chunks.items():
+            first = chunk_idx * self.chunk_size
+            for i, key in enumerate(self._chunk_keys(rows)):
+                row = self._overrides.get(first + i)
+                positions[key if row is None else self.row_key(row)] = first + i
+        return positions
+
+    def _is_removed(self, pos):
+        i = bisect_left(self._removed, pos)
+        return i < len(self._removed) and self._removed[i] == pos
+
+    def _hide_position(self, pos):
+        view_row = self._view_row(pos)
+        if view_row is None:
+            insort(self._removed, pos)
+            return
+        self.beginRemoveRows(QModelIndex(), view_row, view_row)
+        insort(self._removed, pos)
+        if self._view is not None:
+            del self._view[view_row - len(self._inserted)]
+        self.endRemoveRows()
+
+    def _view_row(self, pos):
+        """Номер строки таблицы для позиции курсора (None, если строка не
+        показана из-за filter_loaded)
+        """
+        if self._view is not None:
+            try:
+                return len(self._inserted) + self._view.index(pos)
+            except ValueError:
+                return None
+        return len(self._inserted) + pos - bisect_left(self._removed, pos)
+
+    def _cursor_position(self, view_row):
+        """Позиция курсора для номера строки таблицы (после новых строк)"""
+        target = view_row - len(self._inserted)
+        if self._view is not None:
+            return self._view[target]
+        if not self._removed:
+            return target
+        pos = target + bisect_right(self._removed, target)
+        while True:
+            next_pos = target + bisect_right(self._removed, pos)
+            if next_pos == pos:
+                return pos
+            pos = next_pos
+
+    def is_loading(self):
+        """Выполняется ли сейчас чтение"""
+        return self._fetching
+
+    # --- Сортировка, отбор и итоги загруженных строк ---
+
+    def fully_loaded(self):
+        """Прочитан ли результат целиком и находятся ли все его порции в памяти"""
+        return (self._exhausted and not self._fetching
+                and all(chunk_idx in self._chunks for chunk_idx in range(self._chunk_count())))
+
+    def sort_loaded(self, order):
+        """Сортировка загруженных строк по столбцам order - списку пар
+        (номер столбца, по убыванию). NULL - как в PostgreSQL: в конце по
+        возрастанию, в начале по убыванию.
+        """
+        self._local_sort = list(order) or None
+        self._update_view()
+
+    def filter_loaded(self, conditions, any_match=False):
+        """Отбор загруженных строк.
+
+        conditions - список (номер столбца, условие): условие - функция
+        значения, возвращающая True для подходящих строк; any_match -
+        достаточно одного выполненного условия (OR), иначе нужны все.
+        Новые строки (apply_changes) показываются без отбора.
+        """
+        self._local_filter = (conditions, any_match) if conditions else None
+        self._update_view()
+
+    def reset_view(self):
+        """Отмена sort_loaded и filter_loaded"""
+        if self._view is None:
+            return
+        self.beginResetModel()
+        self._view = None
+        self._local_sort = None
+        self._local_filter = None
+        self.endResetModel()
+
+    def numeric_columns(self):
+        """Номера числовых столбцов результата (для итогов)"""
+        chunk = self._chunks.get(0)
+        if not chunk:
+            return []
+        return [i for i, column_type in enumerate(chunk.types) if column_type.numeric]
+
+    def group_loaded(self, column, sum_columns=()):
+        """Итоги показанных строк по значениям столбца column.
+
+        Возвращает список (значение, число строк, суммы sum_columns...)
+        по возрастанию значения; NULL в суммах не учитывается.
+        """
+        group_keys, group_nulls, group_type = self._gather(column)
+        sums = [self._gather(col) for col in sum_columns]
+        groups = {}
+
+        def add(key, values):
+            totals = groups.get(key)
+            if totals is None:
+                totals = groups[key] = [0] * (len(sums) + 1)
+            totals[0] += 1
+            for i, value in enumerate(values, 1):
+                if value is not None:
+                    totals[i] += value
+
+        for row in self._inserted:
+            add(group_type.key(row[column]),
+                [sum_type.key(row[col]) for col, (_, _, sum_type) in zip(sum_columns, sums)])
+        for pos in self._visible_positions():
+            add(None if group_nulls and group_nulls[pos] else group_keys[pos],
+                [None if nulls and nulls[pos] else keys[pos] for keys, nulls, _ in sums])
+
+        result = []
+        for key, totals in groups.items():
+            values = [sum_type.value(total) for total, (_, _, sum_type) in zip(totals[1:], sums)]
+            result.append((None if key is None else group_type.value(key), totals[0], *values))
+        result.sort(key=lambda group: (group[0] is not None, group[0] if group[0] is not None
+                                       else 0))
+        return result
+
+    def _visible_positions(self):
+        """Позиции курсора показанных строк (без новых)"""
+        if self._view is not None:
+            return self._view
+        removed = set(self._removed)
+        return [pos for pos in range(self._row_count) if pos not in removed]
+
+    def _update_view(self):
+        removed = set(self._removed)
+        positions = [pos for pos in range(self._row_count) if pos not in removed]
+        if self._local_filter is not None:
+            conditions, any_match = self._local_filter
+            masks = [self._matches(column, condition) for column, condition in conditions]
+            combine = any if any_match else all
+            positions = [pos for pos in positions if combine(mask[pos] for mask in masks)]
+        # Сортировка устойчива: сортируем от последнего столбца к первому
+        for column, descending in reversed(self._local_sort or ()):
+            keys, nulls, column_type = self._gather(column)
+            if column_type.dictionary is not None:
+                # Коды словаря идут в порядке появления - сортируем по месту значения
+                ranks = column_type.dictionary.ranks()
+                keys = [ranks[code] for code in keys]
+            empty = []
+            if nulls:
+                empty = [pos for pos in positions if nulls[pos]]
+                positions = [pos for pos in positions if not nulls[pos]]
+            positions.sort(key=keys.__getitem__, reverse=descending)
+            positions = empty + positions if descending else positions + empty
+        self.beginResetModel()
+        self._view = array("I", positions)
+        self.endResetModel()
+
+    def _gather(self, column):
+        """Ключи столбца всех загруженных строк по позициям курсора.
+
+        Возвращает (ключи, отметки NULL или None, columnar.ColumnType).
+        Если порции хранят столбец по-разному (см. ColumnarBuilder),
+        ключами служат сами значения.
+        """
+        chunks = [self._chunks[chunk_idx] for chunk_idx in range(self._chunk_count())]
+        types = {chunk.types[column] for chunk in chunks}
+        if len(types) == 1:
+            column_type = types.pop()
+            keys = array(column_type.typecode) if column_type.typecode else []
+            nulls = None
+            for chunk_idx, chunk in enumerate(chunks):
+                chunk_keys, chunk_nulls = chunk.keys(column)
+                keys.extend(chunk_keys)
+                if chunk_nulls is not None:
+                    if nulls is None:
+                        nulls = bytearray(self._row_count)
+                    first = chunk_idx * self.chunk_size
+                    nulls[first:first + len(chunk)] = chunk_nulls
+        else:
+            column_type = ColumnType(numeric=all(t.numeric for t in types))
+            keys = [chunk.value(i, column) for chunk in chunks for i in range(len(chunk))]
+            nulls = bytearray(key is None for key in keys)
+
+        if self._overrides:
+            keys = list(keys)
+            nulls = nulls or bytearray(self._row_count)
+            for pos, row in self._overrides.items():
+                value = row[column]
+                nulls[pos] = value is None
+                keys[pos] = 0 if value is None else column_type.key(value)
+        return keys, nulls, column_type
+
+    def _matches(self, column, condition):
+        """Выполнение условия для каждой загруженной строки.
+
+        Условие вычисляется один раз для каждого различного значения
+        (для строк, закодированных словарем, - по словарю).
+        """
+        keys, nulls, column_type = self._gather(column)
+        results = {}
+        empty = bool(condition(None))
+        mask = bytearray(len(keys))
+        for pos, key in enumerate(keys):
+            if nulls and nulls[pos]:
+                mask[pos] = empty
+                continue
+            matched = results.get(key)
+            if matched is None:
+                matched = results[key] = bool(condition(column_type.value(key)))
+            mask[pos] = matched
+        return mask
+
+    # --- Интерфейс QAbstractTableModel ---
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        if self._view is not None:
+            return len(self._inserted) + len(self._view)
+        return len(self._inserted) + self._row_count - len(self._removed)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._headers)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        row_idx = index.row()
+        if row_idx < len(self._inserted):
+            value = self._inserted[row_idx][index.column()]
+            return str(value) if value is not None else ""
+        pos = self._cursor_position(row_idx)
+        row = self._overrides.get(pos)
+        if row is not None:
+            value = row[index.column()]
+        else:
+            chunk_idx, offset = divmod(pos, self.chunk_size)
+            rows = self._chunks.get(chunk_idx)
+            if rows is None:
+                self._request_chunk(chunk_idx)
+                return None
+            value = rows.value(offset, index.column())
+        return str(value) if value is not None else ""
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Horizontal:
+            if section < len(self._headers):
+                return self._headers[section]
+            return None
+        return str(section + 1)
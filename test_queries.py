@@ -0,0 +1,77 @@
+"""Проверки построения запросов (без подключения к базе)"""
+import datetime
+import unittest
+
+from psycopg2 import sql
+
+from queries import _seek_condition, keyset_page_query
+
+
+def render(composable):
+    """Текст запроса без подключения: as_string требует соединение"""
+    if isinstance(composable, sql.Composed):
+        return "".join(render(part) for part in composable.seq)
+    if isinstance(composable, sql.Identifier):
+        return ".".join(f'"{name}"' for name in composable.strings)
+    if isinstance(composable, sql.Placeholder):
+        return "%s"
+    return composable.string
+
+
+# car_repair: completion_date и team_id допускают NULL, ключ - (repair_id, admission_date)
+REPAIR_KEY = ["repair_id", "admission_date"]
+DAY = datetime.date(2024, 3, 1)
+
+
+class SeekConditionTest(unittest.TestCase):
+
+    def test_tuple_for_not_null_columns(self):
+        # cars.owner - NOT NULL
+        params = []
+        condition = _seek_condition([("owner", False), ("car_id", False)], ("Иванов", 3), True,
+                                    params, not_null={"owner", "car_id"})
+        self.assertEqual(render(condition), '("owner", "car_id") > (%s, %s)')
+        self.assertEqual(params, ["Иванов", 3])
+
+    def test_nullable_column_keeps_null_rows(self):
+        # Кортеж (NULL, 5) > (1, 3) дает NULL - незавершенные ремонты пропали бы
+        params = []
+        condition = _seek_condition([("team_id", False), ("repair_id", False)], (1, 3), True,
+                                    params, not_null={"repair_id"})
+        text = render(condition)
+        self.assertIn('"team_id" IS NULL', text)
+        self.assertNotIn('("team_id", "repair_id")', text)
+        self.assertEqual(params, [1, 1, 3])
+
+    def test_nullable_column_backwards(self):
+        params = []
+        condition = _seek_condition([("completion_date", True), ("repair_id", True)], (DAY, 3),
+                                    True, params, not_null={"repair_id"})
+        self.assertEqual(render(condition),
+                         '(("completion_date" < %s) OR ("completion_date" = %s AND "repair_id" < %s))')
+        self.assertEqual(params, [DAY, DAY, 3])
+
+    def test_after_null_value(self):
+        params = []
+        condition = _seek_condition([("completion_date", False), ("repair_id", False)],
+                                    (None, 3), True, params, not_null={"repair_id"})
+        self.assertEqual(render(condition),
+                         '(("completion_date" IS NULL AND ("repair_id" > %s OR "repair_id" IS NULL)))')
+        self.assertEqual(params, [3])
+
+    def test_default_key_order_uses_tuple(self):
+        query, params = keyset_page_query("car_repair", REPAIR_KEY, 50, after=(7, DAY))
+        self.assertIn('("repair_id", "admission_date") > (%s, %s)', render(query))
+        self.assertEqual(params, [7, DAY, 50])
+
+    def test_page_by_nullable_sort_column(self):
+        query, params = keyset_page_query(
+            "car_repair", REPAIR_KEY, 50, after=(DAY, 7, DAY),
+            order=[("completion_date", False), ("repair_id", False), ("admission_date", False)],
+            not_null=["repair_id", "car_id", "fault_id", "admission_date"])
+        self.assertIn('"completion_date" IS NULL', render(query))
+        self.assertEqual(params, [DAY, DAY, 7, DAY, 7, DAY, 50])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+import csv
+import io
+import os
+
+from psycopg2 import sql
+from psycopg2.extensions import encodings
+
+
+COPY_BUFFER_SIZE = 1 << 16  # размер порции чтения файла для COPY FROM, байт
+
+class TransferError(Exception):
+    """Ошибка импорта/экспорта, обнаруженная до обращения к БД"""
+
+
+class _ProgressReader:
+    """Файл для COPY FROM: считает прочитанные байты"""
+
+    def __init__(self, f, progress, total, done=0):
+        self.f = f
+        self.progress = progress
+        self.total = total
+        self.done = done
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.done += len(data)
+        if self.progress is not None:
+            self.progress(self.done, self.total)
+        return data
+
+    def readline(self, size=-1):
+        data = self.f.readline(size)
+        self.done += len(data)
+        return data
+
+
+class _ProgressWriter:
+    """Файл для COPY TO: считает записанные байты"""
+
+    def __init__(self, f, progress):
+        self.f = f
+        self.progress = progress
+        self.done = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.done += len(data)
+        if self.progress is not None:
+            self.progress(self.done, 0)
+
+
+def _copy_options(delimiter):
+    return sql.SQL("(FORMAT csv, DELIMITER {}, ENCODING 'UTF8')").format(sql.Literal(delimiter))
+
+
+def export_table(conn, table, f, columns=None, delimiter=",", progress=None, condition=None):
+    """Выгрузка таблицы в CSV (с заголовком) через COPY TO STDOUT.
+
+    f - двоичный файл; progress(байт записано, 0) вызывается по мере
+    выгрузки. condition - условие отбора строк: пара (sql.Composable,
+    параметры). Строки упорядочены по первичному ключу.
+    """
+    columns = list(columns or table.column_names())
+    _check_columns(table, columns)
+
+    query = sql.SQL("SELECT {} FROM {}").format(
+        sql.SQL(", ").join(map(sql.Identifier, columns)), sql.Identifier(table.name))
+    if condition is not None:
+        query += sql.SQL(" WHERE {}").format(condition[0])
+    if table.primary_key:
+        query += sql.SQL(" ORDER BY {}").format(
+            sql.SQL(", ").join(map(sql.Identifier, table.primary_key)))
+
+    copy = sql.SQL("COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER true, DELIMITER {}, "
+                   "ENCODING 'UTF8')").format(query, sql.Literal(delimiter))
+    cursor = conn.cursor()
+    # COPY не принимает параметры - значения условия подставляются в текст
+    if condition is not None:
+        copy = cursor.mogrify(copy, condition[1]).decode(encodings[conn.encoding])
+    else:
+        copy = copy.as_string(conn)
+    cursor.copy_expert(copy, _ProgressWriter(f, progress))
+    conn.rollback()
+
+
+def read_header(f, delimiter=None):
+    """Имена столбцов из первой строки CSV (f - двоичный файл).
+
+    Возвращает (столбцы, разделитель); если разделитель не задан, он
+    определяется по заголовку: запятая, точка с запятой или табуляция.
+    """
+    line = f.readline().decode("utf-8-sig").strip("\r\n")
+    if delimiter is None:
+        delimiter = max(",;\t", key=line.count)
+    columns = [name.strip() for name in next(csv.reader([line], delimiter=delimiter), [])]
+    return columns, delimiter
+
+
+def import_table(conn, table, f, key=None, delimiter=None, progress=None):
+    """Загрузка CSV с заголовком в таблицу через COPY FROM STDIN.
+
+    Столбцы заголовка проверяются по структуре таблицы. Без key строки
+    добавляются напрямую; с key (кортеж столбцов уникального ключа)
+    файл загружается во временную таблицу и сливается с основной
+    INSERT ... ON CONFLICT: существующие строки обновляются. Все
+    выполняется в одной транзакции.
+
+    f - двоичный файл; progress(байт прочитано, размер файла);
+    delimiter - разделитель полей (по умолчанию определяется по заголовку).
+    Возвращает (добавлено, обновлено).
+    """
+    total = _file_size(f)
+    columns, delimiter = read_header(f, delimiter)
+    _check_columns(table, columns)
+    missing = [column.name for column in table.columns
+               if column.required and column.name not in columns]
+    if missing:
+        raise TransferError(f"В файле нет обязательных столбцов: {', '.join(missing)}")
+    if key is not None:
+        key = tuple(key)
+        if key not in table.unique_keys:
+            raise TransferError(f"{', '.join(key)} - не уникальный ключ таблицы {table.name}")
+        if not set(key) <= set(columns):
+            raise TransferError(f"В файле нет столбцов ключа: {', '.join(key)}")
+
+    reader = _ProgressReader(f, progress, total, done=f.tell() if total else 0)
+    column_list = sql.SQL(", ").join(map(sql.Identifier, columns))
+    cursor = conn.cursor()
+
+    if key is None:
+        copy = sql.SQL("COPY {} ({}) FROM STDIN WITH {}").format(
+            sql.Identifier(table.name), column_list, _copy_options(delimiter))
+        cursor.copy_expert(copy.as_string(conn), reader, size=COPY_BUFFER_SIZE)
+        inserted, updated = cursor.rowcount, 0
+    else:
+        # Временная таблица только со столбцами файла, без ограничений
+        cursor.execute(sql.SQL(
+            "CREATE TEMP TABLE import_stage ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA"
+        ).format(column_list, sql.Identifier(table.name)))
+        copy = sql.SQL("COPY import_stage ({}) FROM STDIN WITH {}").format(
+            column_list, _copy_options(delimiter))
+        cursor.copy_expert(copy.as_string(conn), reader, size=COPY_BUFFER_SIZE)
+
+        key_list = sql.SQL(", ").join(map(sql.Identifier, key))
+        updates = [col for col in columns if col not in key]
+        if updates:
+            action = sql.SQL("DO UPDATE SET {}").format(sql.SQL(", ").join(
+                sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(col)) for col in updates))
+        else:
+            action = sql.SQL("DO NOTHING")
+        # При повторе ключа в файле побеждает последняя строка
+        cursor.execute(sql.SQL("""
+            WITH merged AS (
+                INSERT INTO {table} ({columns})
+                SELECT DISTINCT ON ({key}) {columns}
+                FROM import_stage
+                ORDER BY {key}, ctid DESC
+                ON CONFLICT ({key}) {action}
+                RETURNING xmax = 0 AS inserted
+            )
+            SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted)
+            FROM merged
+        """).format(table=sql.Identifier(table.name), columns=column_list, key=key_list,
+                    action=action))
+        inserted, updated = cursor.fetchone()
+
+    _sync_sequences(cursor, table, columns)
+    conn.commit()
+    return inserted, updated
+
+
+def _check_columns(table, columns):
+    if not columns:
+        raise TransferError("Не указаны столбцы")
+    unknown = [col for col in columns if table.column(col) is None]
+    if unknown:
+        raise TransferError(f"В таблице {table.name} нет столбцов: {', '.join(unknown)}")
+    duplicates = {col for col in columns if columns.count(col) > 1}
+    if duplicates:
+        raise TransferError(f"Столбцы повторяются: {', '.join(sorted(duplicates))}")
+
+
+def _sync_sequences(cursor, table, columns):
+    """Сдвиг последовательностей, если значения serial-столбцов пришли из файла"""
+    for col in columns:
+        if not table.column(col).serial:
+            continue
+        cursor.execute(sql.SQL("""
+            SELECT setval(seq, max_value)
+            FROM (SELECT pg_get_serial_sequence(%s, %s) AS seq,
+                         (SELECT max({col}) FROM {table}) AS max_value) s
+            WHERE max_value > coalesce(pg_sequence_last_value(seq::regclass), 0)
+        """).format(col=sql.Identifier(col), table=sql.Identifier(table.name)),
+            (table.name, col))
+
+
+def _file_size(f):
+    try:
+        return os.fstat(f.fileno()).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return 0
@@ -0,0 +1,205 @@
+import threading
+import time
+
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extensions import QueryCanceledError
+from PyQt6.QtCore import Qt, QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt6.QtWidgets import QProgressDialog
+
+from instrument import caller_origin, origin
+
+
+def is_cancelled(error):
+    """Была ли ошибка вызвана отменой запроса пользователем или по таймауту"""
+    return isinstance(error, QueryCanceledError)
+
+
+def is_connection_error(error):
+    """Была ли ошибка вызвана отсутствием связи с БД (а не самим запросом)"""
+    return (isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError, pool.PoolError))
+            and not is_cancelled(error))
+
+
+class TaskSignals(QObject):
+    """Сигналы фоновой задачи (доставляются в поток интерфейса)"""
+    result = pyqtSignal(object)
+    error = pyqtSignal(object)
+    finished = pyqtSignal()
+    progress = pyqtSignal(object, object)  # выполнено, всего (0 - неизвестно)
+
+
+class QueryTask(QRunnable):
+    """Работа с БД, выполняемая в фоновом потоке.
+
+    fn вызывается с соединением в качестве аргумента; результат
+    передается сигналом result, исключение - сигналом error. При ошибке
+    транзакция соединения откатывается.
+
+    Если conn не задан, соединение берется из пула на время задачи:
+    при readonly - с реплики (см. Database.getconn). После задачи с
+    writes запоминается позиция WAL, чтобы следующее чтение с реплики
+    увидело записанное. conn может быть и функцией,
+    возвращающей соединение (так модели держат свое соединение под
+    серверный курсор).
+
+    Если with_progress, fn вызывается еще и с функцией progress(выполнено,
+    всего), сообщения которой передаются сигналом progress (не чаще
+    PROGRESS_INTERVAL секунд).
+    """
+
+    PROGRESS_INTERVAL = 0.1
+
+    def __init__(self, db, fn, description="", conn=None, with_progress=False, origin=None,
+                 readonly=False, writes=False):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.db = db
+        self.conn = conn
+        self.readonly = readonly
+        self.writes = writes
+        self.fn = fn
+        self.description = description
+        self.with_progress = with_progress
+        self.origin = origin
+        self._progress_time = 0
+        self.cancelled = False
+        self.active_conn = None
+        self._lock = threading.Lock()  # защищает active_conn от отмены из другого потока
+        self.signals = TaskSignals()
+
+    def run(self):
+        borrowed = self.conn is None
+        try:
+            if self.cancelled:
+                raise QueryCanceledError("canceling statement due to user request")
+            if borrowed:
+                conn = self.db.getconn(self.readonly)
+            elif callable(self.conn):
+                conn = self.conn()
+            else:
+                conn = self.conn
+            with self._lock:
+                self.active_conn = conn
+            if self.cancelled:
+                raise QueryCanceledError("canceling statement due to user request")
+            with origin(self.origin):
+                if self.with_progress:
+                    result = self.fn(conn, self.report_progress)
+                else:
+                    result = self.fn(conn)
+        except Exception as e:
+            if self.active_conn is not None and not self.active_conn.closed:
+                try:
+                    self.active_conn.rollback()
+                except Exception:
+                    pass
+            self.signals.error.emit(e)
+        else:
+            self.signals.result.emit(result)
+        finally:
+            with self._lock:
+                conn, self.active_conn = self.active_conn, None
+            if borrowed and conn is not None:
+                # И после ошибки: часть порций могла быть уже зафиксирована
+                if self.writes:
+                    self.db.note_write(conn)
+                self.db.putconn(conn)
+            self.signals.finished.emit()
+
+    def report_progress(self, done, total=0):
+        """Сообщение о ходе выполнения (вызывается из fn)"""
+        now = time.monotonic()
+        if now - self._progress_time >= self.PROGRESS_INTERVAL or (total and done >= total):
+            self._progress_time = now
+            self.signals.progress.emit(done, total)
+
+    def cancel(self):
+        """Отмена задачи и выполняющегося в ней запроса"""
+        with self._lock:
+            self.cancelled = True
+            if self.active_conn is not None and not self.active_conn.closed:
+                self.active_conn.cancel()
+
+
+class QueryRunner(QObject):
+    """Выполнение задач с БД в фоновых потоках.
+
+    Каждая задача получает свое соединение из пула Database, поэтому
+    задачи выполняются параллельно (не больше размера пула), а интерфейс
+    не блокируется. Выполняющиеся запросы отменяются через
+    connection.cancel(), ожидающие в очереди - флагом отмены.
+    """
+
+    busy_changed = pyqtSignal(bool, str)  # занято, описание текущей задачи
+
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(db.config["pool_max"])
+        self._tasks = []
+
+    def submit(self, fn, on_result=None, on_error=None, description="", dialog_parent=None,
+               conn=None, on_progress=None, origin=None, readonly=False, writes=False):
+        """Постановка задачи в очередь.
+
+        Если указан dialog_parent, над ним через полсекунды ожидания
+        появляется окно прогресса с кнопкой отмены. conn - соединение
+        (или функция, возвращающая его), если задача не должна брать
+        соединение из пула. Если указан on_progress, fn получает вторым
+        аргументом функцию progress(выполнено, всего), а on_progress -
+        ее сообщения. origin - источник запросов для журнала (по умолчанию -
+        вызвавший submit метод). readonly - задача только читает, и ее
+        можно выполнить на реплике. writes - задача фиксирует изменения:
+        чтение с реплик после нее дождется их воспроизведения. Задача без
+        обоих флагов читает с основного сервера (нужны самые свежие данные).
+        """
+        task = QueryTask(self.db, fn, description, conn, with_progress=on_progress is not None,
+                         origin=origin or caller_origin(), readonly=readonly, writes=writes)
+        if on_result is not None:
+            task.signals.result.connect(on_result)
+        if on_error is not None:
+            task.signals.error.connect(on_error)
+        if on_progress is not None:
+            task.signals.progress.connect(on_progress)
+        task.signals.finished.connect(lambda: self._task_finished(task))
+
+        if dialog_parent is not None:
+            progress = QProgressDialog(description or "Выполнение запроса...", "Отмена",
+                                       0, 0, dialog_parent)
+            progress.setWindowModality(Qt.WindowModality.WindowModal)
+            progress.setMinimumDuration(500)
+            progress.canceled.connect(self.cancel)
+            if on_progress is not None:
+                task.signals.progress.connect(
+                    lambda done, total: self._show_progress(progress, done, total))
+            task.signals.finished.connect(progress.reset)
+            task.signals.finished.connect(progress.deleteLater)
+
+        self._tasks.append(task)
+        self.busy_changed.emit(True, self._tasks[0].description)
+        self.pool.start(task)
+        return task
+
+    def cancel(self):
+        """Отмена выполняющегося и всех ожидающих запросов"""
+        for task in list(self._tasks):
+            task.cancel()
+
+    @staticmethod
+    def _show_progress(progress, done, total):
+        if total:
+            progress.setMaximum(1000)
+            progress.setValue(min(done * 1000 // total, 999))
+
+    def is_busy(self):
+        return bool(self._tasks)
+
+    def _task_finished(self, task):
+        if task in self._tasks:
+            self._tasks.remove(task)
+        if self._tasks:
+            self.busy_changed.emit(True, self._tasks[0].description)
+        else:
+            self.busy_changed.emit(False, "")
@@ -58,6 +58,20 @@ CREATE TABLE spare_parts (
     name VARCHAR(200) NOT NULL,
     price NUMERIC(10, 2) NOT NULL CHECK (price >= 0),
     quantity INT NOT NULL CHECK (quantity > 0),
+    repair_id INT,  -- Ремонт, в котором использована запчасть
     FOREIGN KEY (car_id) REFERENCES cars (car_id) ON DELETE CASCADE,
-    FOREIGN KEY (fault_id) REFERENCES faults (fault_id) ON DELETE CASCADE
-);
\ No newline at end of file
+    FOREIGN KEY (fault_id) REFERENCES faults (fault_id) ON DELETE CASCADE,
+    FOREIGN KEY (repair_id) REFERENCES car_repair (repair_id) ON DELETE SET NULL
+);
+
+CREATE INDEX spare_parts_repair_id_idx ON spare_parts (repair_id);
+
+-- Индексы соединений и фильтров отчетов и внешних ключей
+-- (для существующих баз - миграция migrations/0001_report_indexes.sql)
+CREATE INDEX car_repair_admission_date_idx ON car_repair (admission_date) INCLUDE (car_id, fault_id);
+CREATE INDEX car_repair_car_fault_idx ON car_repair (car_id, fault_id);
+CREATE INDEX car_repair_fault_id_idx ON car_repair (fault_id);
+CREATE INDEX car_repair_team_id_idx ON car_repair (team_id);
+CREATE INDEX spare_parts_car_fault_idx ON spare_parts (car_id, fault_id) INCLUDE (price, quantity);
+CREATE INDEX spare_parts_fault_id_idx ON spare_parts (fault_id);
+CREATE INDEX personnel_team_id_idx ON personnel (team_id);
\ No newline at end of file